@@ -0,0 +1,277 @@
+"""
+Воспроизводимые бенчмарки на churn.csv с локальной заглушкой LLM.
+
+    python benchmarks/run.py --scales 1,10,100 --llm-delay 0.3 --output bench.json
+
+Результат — JSON (по умолчанию в stdout), чтобы сравнивать замеры между коммитами.
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("MISTRAL_API_KEY", "benchmark")
+
+CHURN_CSV = os.path.join(ROOT, "churn.csv")
+QUESTIONS = [
+    "Средний ежемесячный платёж по типам контракта",
+    "Сколько клиентов ушло по каждому типу контракта",
+    "Покажи распределение клиентов по контрактам",
+]
+INTENT_QUESTIONS = [
+    "покажи первые 10 строк", "последние 20 строк", "отсортируй по tenure",
+    "уникальные значения столбца Contract", "где Churn = Yes", "сколько строк",
+    "названия столбцов", "describe",
+]
+
+def timed(fn, repeat=3):
+    """
+    Медиана и минимум времени выполнения fn (секунды) по repeat запускам.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return {"median_s": statistics.median(times), "min_s": min(times), "runs": repeat}, result
+
+def quiet(fn, *args, **kwargs):
+    """
+    Вызов без вывода print-сообщений импорта/выгрузки в stdout (stdout — для JSON).
+    """
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+def make_scaled_csv(path, scale):
+    with open(CHURN_CSV, encoding="utf-8") as f:
+        header, *rows = f.read().splitlines()
+    with open(path, "w", encoding="utf-8") as out:
+        out.write(header + "\n")
+        for _ in range(scale):
+            out.write("\n".join(rows) + "\n")
+    return len(rows) * scale
+
+def _typed(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+def make_scaled_xlsx(path, scale, sheets=4):
+    """
+    Книга из churn.csv x scale строк, разложенных поровну по нескольким листам.
+    """
+    from openpyxl import Workbook
+    with open(CHURN_CSV, encoding="utf-8", newline="") as f:
+        header, *rows = list(csv.reader(f))
+    rows = [[_typed(v) for v in row] for row in rows]
+    total = len(rows) * scale
+    per_sheet = -(-total // sheets)
+    source = itertools.cycle(rows)
+    wb = Workbook(write_only=True)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Sheet{s + 1}")
+        ws.append(header)
+        for _ in range(min(per_sheet, total - s * per_sheet)):
+            ws.append(next(source))
+    wb.save(path)
+    return total
+
+def bench_import(workdir, scales):
+    from core import database
+    results = []
+    for scale in scales:
+        csv_path = os.path.join(workdir, f"churn_x{scale}.csv")
+        rows = make_scaled_csv(csv_path, scale)
+        db = os.path.join(workdir, f"import_csv_x{scale}.db")
+
+        def run_csv():
+            conn = sqlite3.connect(db)
+            quiet(database.import_csv_streaming, conn, csv_path, "churn", override_existing=True)
+            conn.close()
+        stat, _ = timed(run_csv, repeat=1 if scale >= 100 else 3)
+        results.append(dict(stat, kind="csv", scale=scale, rows=rows,
+                            rows_per_s=rows / stat["median_s"], file_mb=os.path.getsize(csv_path) / 2 ** 20))
+
+        xlsx_path = os.path.join(workdir, f"churn_x{scale}.xlsx")
+        rows = make_scaled_xlsx(xlsx_path, scale)
+        db = os.path.join(workdir, f"import_xlsx_x{scale}.db")
+
+        def run_xlsx():
+            conn = sqlite3.connect(db)
+            names = {s: f"churn_{s}" for s in database.excel_sheet_names(xlsx_path)}
+            quiet(database.import_excel_parallel, conn, xlsx_path, names, override_existing=True)
+            conn.close()
+        stat, _ = timed(run_xlsx, repeat=1)
+        results.append(dict(stat, kind="xlsx", scale=scale, rows=rows,
+                            rows_per_s=rows / stat["median_s"], file_mb=os.path.getsize(xlsx_path) / 2 ** 20))
+    return results
+
+def bench_load(db):
+    from core.catalog import load_catalog
+    from core.database import load_tables_from_db
+    conn = sqlite3.connect(db)
+    catalog, _ = timed(lambda: load_catalog(conn, "churn"), repeat=20)
+    conn.close()
+    full_sql, _ = timed(lambda: load_tables_from_db(["churn"], db, use_columnar=False), repeat=3)
+    full, _ = timed(lambda: load_tables_from_db(["churn"], db), repeat=3)
+    projected, _ = timed(lambda: load_tables_from_db(["churn"], db, columns=["Contract", "MonthlyCharges"]), repeat=3)
+    return {"catalog": catalog, "full_table_sql": full_sql, "full_table": full, "projected_2_columns": projected}
+
+def bench_questions(db, url, delay):
+    from core import llm_client, llm_cache, result_cache
+    from agents import sql_agent
+    llm_cache.LLM_CACHE_ENABLED = False
+    result_cache.RESULT_CACHE_ENABLED = False
+    llm_client._client = llm_client.MistralClient("benchmark", url=url)
+    conn = sqlite3.connect(db)
+    results = {"llm_delay_s": delay}
+    modes = {
+        "serial": lambda q: sql_agent.answer_question_sql(
+            conn, "churn", None, sql_agent.reformat_query({"content": q}, [])[0], "benchmark"),
+        "combined": lambda q: sql_agent.answer_question_combined(conn, "churn", None, q, "benchmark"),
+        "speculative": lambda q: sql_agent.answer_question_speculative(conn, "churn", None, q, "benchmark"),
+    }
+    for mode, fn in modes.items():
+        times = []
+        for q in QUESTIONS:
+            stat, _ = timed(lambda: quiet(fn, q), repeat=1)
+            times.append(stat["median_s"])
+        results[mode] = {"median_s": statistics.median(times), "max_s": max(times), "questions": len(times)}
+    conn.close()
+    return results
+
+def bench_stream(db, server, url, token_delay=0.02, trailing=3):
+    """
+    Время до результата с потоковым ответом LLM (SQL выполняется, как только пришёл
+    SELECT ...;) и без него; заглушка генерирует токены с паузой token_delay.
+    """
+    from core import llm_client, llm_cache, result_cache
+    from agents import sql_agent, importer
+    llm_cache.LLM_CACHE_ENABLED = False
+    result_cache.RESULT_CACHE_ENABLED = False
+    llm_client._client = llm_client.MistralClient("benchmark", url=url)
+    server.token_delay, server.trailing = token_delay, trailing
+    conn = sqlite3.connect(db)
+    results = {"token_delay_s": token_delay, "trailing": trailing}
+    try:
+        for streaming in (False, True):
+            sql_agent.LLM_STREAM = importer.LLM_STREAM = streaming
+            modes = {
+                "sql_only": lambda q: sql_agent.answer_question_sql(conn, "churn", None, q, "benchmark"),
+                "combined": lambda q: sql_agent.answer_question_combined(conn, "churn", None, q, "benchmark"),
+            }
+            for mode, fn in modes.items():
+                times = [timed(lambda: quiet(fn, q), repeat=1)[0]["median_s"] for q in QUESTIONS]
+                results[f"{mode}_{'stream' if streaming else 'full'}"] = {"median_s": statistics.median(times)}
+    finally:
+        server.token_delay, server.trailing = 0.0, 0
+        conn.close()
+    return results
+
+def bench_intents(db):
+    import pandas as pd
+    from core.intents import route_intent
+    from core.pipeline import apply_simple_task
+    conn = sqlite3.connect(db)
+    df = pd.read_sql_query("SELECT * FROM churn", conn)
+    results = {}
+    for q in INTENT_QUESTIONS:
+        sql_stat, _ = timed(lambda: route_intent(conn, "churn", q), repeat=5)
+        pandas_stat, _ = timed(lambda: apply_simple_task(df, q), repeat=5)
+        results[q] = {"sqlite_median_ms": 1000 * sql_stat["median_s"], "pandas_median_ms": 1000 * pandas_stat["median_s"]}
+    conn.close()
+    return results
+
+def bench_export(db, workdir):
+    from core.export import export_query
+    conn = sqlite3.connect(db)
+    results = {}
+    for ext in ("xlsx", "csv", "csv.gz"):
+        path = os.path.join(workdir, f"export.{ext}")
+        stat, rows = timed(lambda: quiet(export_query, conn, "SELECT * FROM churn", path), repeat=1)
+        results[ext] = dict(stat, rows=rows, rows_per_s=rows / stat["median_s"], file_mb=os.path.getsize(path) / 2 ** 20)
+    conn.close()
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Exel-Automatic")
+    parser.add_argument("--scales", default="1,10", help="множители churn.csv через запятую, например 1,10,100")
+    parser.add_argument("--llm-delay", type=float, default=0.3, help="задержка ответа заглушки LLM, секунды")
+    parser.add_argument("--stages", default="import,load,questions,stream,intents,export")
+    parser.add_argument("--output", help="файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    stages = set(args.stages.split(","))
+
+    from stub_server import start_stub_server
+    server, url = start_stub_server(delay=args.llm_delay)
+    workdir = tempfile.mkdtemp(prefix="exel_bench_")
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scales": scales,
+    }
+    try:
+        base_db = os.path.join(workdir, "base.db")
+        conn = sqlite3.connect(base_db)
+        from core.database import import_csv_streaming
+        quiet(import_csv_streaming, conn, CHURN_CSV, "churn", override_existing=True)
+        conn.close()
+        if "import" in stages:
+            report["import"] = bench_import(workdir, scales)
+        if "load" in stages:
+            report["load"] = bench_load(base_db)
+        if "questions" in stages:
+            report["questions"] = bench_questions(base_db, url, args.llm_delay)
+            report["questions"]["stub_requests"] = server.requests
+        if "stream" in stages:
+            report["stream"] = bench_stream(base_db, server, url)
+        if "intents" in stages:
+            report["intents"] = bench_intents(base_db)
+        if "export" in stages:
+            report["export"] = bench_export(base_db, workdir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Локальная заглушка Mistral chat/completions для бенчмарков и отладки без сети.
+
+Запуск отдельно: python benchmarks/stub_server.py --port 8080 --delay 0.3
+и MISTRAL_API_URL=http://127.0.0.1:8080/v1/chat/completions.
+На запрос со "stream": true отвечает потоком SSE по токену раз в --token-delay секунд
+(проверка LLM_STREAM), обычный ответ — после того же времени генерации; --trailing добавляет
+к SQL хвост пояснений, как у многословной модели.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TOKEN_RE = re.compile(r"\s*\S+|\s+")
+TRAILING_TEXT = "\nЗапрос группирует клиентов по типу договора и считает средний платёж."
+TABLE_RE = re.compile(r"Таблица: ([^.\s]+)")
+QUESTION_RE = re.compile(r"(?:Текущий запрос пользователя|ответить на вопрос): '?([^'\n]+)")
+
+def stub_answer(messages, table_default="churn", trailing=0):
+    """
+    Ответ в формате, которого ждёт вызывающий код: JSON для combined-режима,
+    нумерованный список для reformat_query, иначе одна строка SQL.
+    """
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    text = "\n".join(m["content"] for m in messages)
+    table = TABLE_RE.search(text)
+    table = table.group(1) if table else table_default
+    question = QUESTION_RE.search(text)
+    question = question.group(1).strip() if question else "вопрос"
+    sql = f"SELECT Contract, COUNT(*) AS cnt, AVG(MonthlyCharges) AS avg_charges FROM {table} GROUP BY Contract;"
+    if "JSON" in system:
+        return json.dumps({"rephrased": question, "need_excel": False, "sql": sql}, ensure_ascii=False)
+    if "Нужно создать Excel" in system:
+        return f"1. {question}\n2. Нужно создать Excel: нет"
+    return sql + TRAILING_TEXT * trailing
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        content = stub_answer(body.get("messages", []), trailing=self.server.trailing)
+        if body.get("stream"):
+            self.stream(content)
+            return
+        # Без потока ответ приходит целиком, когда сгенерированы все токены
+        time.sleep(self.server.token_delay * len(TOKEN_RE.findall(content)))
+        payload = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": sum(len(m["content"]) // 4 for m in body.get("messages", [])),
+                      "completion_tokens": len(content) // 4},
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream(self, content):
+        """
+        Ответ потоком SSE: событие на токен, затем data: [DONE]. Клиент может оборвать
+        соединение раньше — это не ошибка.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for token in TOKEN_RE.findall(content):
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                self.server.streamed_tokens += 1
+                time.sleep(self.server.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def start_stub_server(port=0, delay=0.0, token_delay=0.0, trailing=0):
+    """
+    Запускает заглушку в фоновом потоке. Возвращает (server, url).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.delay = delay
+    server.token_delay = token_delay
+    server.trailing = trailing
+    server.streamed_tokens = 0
+    server.requests = 0
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Mistral API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.3, help="задержка ответа, секунды")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="пауза между токенами потока, секунды")
+    parser.add_argument("--trailing", type=int, default=0, help="повторов хвоста пояснений после SQL")
+    args = parser.parse_args()
+    server, url = start_stub_server(args.port, args.delay, args.token_delay, args.trailing)
+    print(f"Заглушка LLM слушает {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
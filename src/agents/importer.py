@@ -1,11 +1,21 @@
+import argparse
+import contextlib
+import glob
 import pandas as pd
 import sqlite3
 import ntpath
 import os
 import re
-import requests
-from core.database import write_to_sql
+from core.database import (
+    write_to_sql, import_csv_streaming, import_excel_parallel, excel_sheet_names, EXCEL_STREAM_EXTENSIONS,
+    import_csv_incremental, write_incremental, IMPORT_WORKERS
+)
+from core.bulk_import import bulk_import
+from core.catalog import clean_table_name
 from core.config import model, key as CONFIG_KEY
+from core import llm_cache
+from core.llm_client import get_client, LLM_STREAM, TextProgress
+from core import tracing
 
 # Загрузка API ключа из переменных окружения
 key = os.getenv("MISTRAL_API_KEY") or CONFIG_KEY
@@ -13,10 +23,6 @@ key = os.getenv("MISTRAL_API_KEY") or CONFIG_KEY
 def sanitize_path(path: str) -> str:
     return path.strip().strip('"').strip("'")
 
-def clean_table_name(name):
-    # Только латиница, цифры, подчёркивания
-    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
-
 # ---- Блок LLM-реформатирования (NEW!) ----
 
 sys_msg = {'role': 'system', 'content':
@@ -28,30 +34,9 @@ sys_msg = {'role': 'system', 'content':
     Всегда отвечай строго на русском!"""
 }
 
-def reformat_query(message, history):
-    previous = ""
-    for msg in reversed(history):
-        if msg["role"] == "user":
-            previous = msg["content"]
-            break
-    context_block = f"Предыдущее сообщение пользователя: {previous}" if previous else ""
-    user_message = {
-        "role": "user",
-        "content": f"{context_block}\nТекущий запрос пользователя: {message['content']}",
-    }
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": model,
-        "messages": [sys_msg, user_message],
-        "temperature": 0.1
-    }
-    response = requests.post("https://api.mistral.ai/v1/chat/completions", headers=headers, json=data)
-    if response.status_code != 200:
-        raise Exception(f"Mistral API error: {response.status_code} - {response.text[:100]}")
-    result = response.json()["choices"][0]["message"]["content"].strip()
+REFORMAT_TEMPERATURE = 0.1
+
+def parse_reformat_answer(result):
     match = re.search(r"1\. (.*?)\s*2\. Нужно создать Excel: (да|нет|Да|Нет)", result, re.DOTALL)
     if not match:
         raise ValueError(f"Формат ответа нарушен: {result}")
@@ -59,11 +44,104 @@ def reformat_query(message, history):
     need_excel = match.group(2).strip().lower() == "да"
     return rephrased, need_excel
 
+_REFORMAT_END = "2. Нужно создать Excel"
+
+def stream_reformat(messages, on_text=None):
+    """
+    Потоковая переформулировка: текст после "1. " передаётся в on_text по мере прихода
+    (последние символы придерживаются, пока не ясно, не начало ли это пункта 2).
+    """
+    result = ""
+    progress = TextProgress(on_text)
+    with contextlib.closing(get_client(key).chat_stream(messages, model, REFORMAT_TEMPERATURE, api_key=key)) as stream:
+        for delta in stream:
+            result += delta
+            start = result.find("1. ")
+            if start < 0:
+                continue
+            body = result[start + 3:]
+            end = body.find(_REFORMAT_END)
+            body = body[:end].rstrip() if end >= 0 else body[:max(len(body) - len(_REFORMAT_END) - 1, 0)]
+            progress.update(body)
+    return result.strip()
+
+def previous_user_message(history, current):
+    """
+    Предыдущий вопрос пользователя из истории (текущий вопрос уже может быть в ней последним).
+    """
+    skipped = False
+    for msg in reversed(history or []):
+        if msg["role"] != "user":
+            continue
+        if not skipped and msg["content"] == current:
+            skipped = True
+            continue
+        return msg["content"]
+    return ""
+
+def reformat_query(message, history, use_cache=None, on_text=None):
+    """
+    Переформулировка вопроса и флаг выгрузки в Excel: (rephrased, need_excel).
+    При LLM_STREAM переформулировка передаётся в on_text по мере генерации.
+    """
+    previous = previous_user_message(history, message["content"])
+    context_block = f"Предыдущее сообщение пользователя: {previous}" if previous else ""
+    user_message = {
+        "role": "user",
+        "content": f"{context_block}\nТекущий запрос пользователя: {message['content']}",
+    }
+    messages = [sys_msg, user_message]
+    with tracing.span("reformat") as s:
+        cached = llm_cache.get(messages, model, REFORMAT_TEMPERATURE, enabled=use_cache)
+        s.set(llm_cache_hit=cached is not None)
+        if cached is not None:
+            return parse_reformat_answer(cached)
+        if LLM_STREAM:
+            result = stream_reformat(messages, on_text)
+        else:
+            result = get_client(key).chat(messages, model, REFORMAT_TEMPERATURE, api_key=key)
+        parsed = parse_reformat_answer(result)
+        llm_cache.put(messages, model, REFORMAT_TEMPERATURE, result, enabled=use_cache)
+        return parsed
+
 # ---- ОСТАЛЬНОЕ оставляем как есть ----
 
-def main():
-    user_input = input('Название/путь до таблицы Excel или CSV файла: ')
-    user_sheet = sanitize_path(user_input)
+def import_incremental_file(conn, path, file_ext, table_base_name, key=None):
+    """
+    Инкрементальное обновление таблиц из файла: применяются только изменившиеся строки.
+    """
+    if file_ext == 'csv':
+        return {table_base_name: import_csv_incremental(conn, path, table_base_name, key)}
+    sheets = pd.read_excel(path, sheet_name=None)
+    return {
+        clean_table_name(f"{table_base_name}_{name}"): write_incremental(
+            conn, df, clean_table_name(f"{table_base_name}_{name}"), key)
+        for name, df in sheets.items() if not df.empty
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт Excel/CSV в SQLite")
+    parser.add_argument("paths", nargs="*",
+                        help="файл, каталоги или шаблоны (data/*.csv); без аргумента — спросить")
+    parser.add_argument("--incremental", action="store_true",
+                        help="обновить существующие таблицы только изменившимися строками")
+    parser.add_argument("--key", help="столбец-ключ для --incremental (по умолчанию определяется сам)")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS,
+                        help="процессов для разбора файлов при импорте каталогов")
+    parser.add_argument("--force", action="store_true",
+                        help="при импорте каталогов загружать и не изменившиеся файлы")
+    args = parser.parse_args(argv)
+    paths = [sanitize_path(p) for p in args.paths]
+    user_sheet = paths[0] if len(paths) == 1 else None
+    if not paths:
+        user_sheet = sanitize_path(input('Название/путь до таблицы Excel или CSV файла (или каталог): '))
+        paths = [user_sheet]
+    # Несколько файлов, каталог или шаблон — пакетный импорт с одним писателем
+    if len(paths) > 1 or os.path.isdir(paths[0]) or glob.has_magic(paths[0]):
+        if args.incremental:
+            parser.error("--incremental поддерживается только для одного файла")
+        bulk_import(paths, "main.db", max(1, args.workers), args.force)
+        return
     if not os.path.exists(user_sheet):
         print("Файл не найден:", user_sheet)
         return
@@ -74,7 +152,16 @@ def main():
 
     try:
         with sqlite3.connect(db_name) as conn:
-            if file_ext in ['xlsx', 'xls', 'xlsm', 'xlsb', 'odf', 'ods', 'odt']:
+            if args.incremental:
+                if file_ext not in EXCEL_STREAM_EXTENSIONS + ['xls', 'xlsb', 'odf', 'ods', 'odt', 'csv']:
+                    print("Неподдерживаемое расширение файла.")
+                    return
+                import_incremental_file(conn, user_sheet, file_ext, table_base_name, args.key)
+            elif file_ext in EXCEL_STREAM_EXTENSIONS:
+                sheets = excel_sheet_names(user_sheet)
+                table_names = {s: clean_table_name(f"{table_base_name}_{s}") for s in sheets}
+                import_excel_parallel(conn, user_sheet, table_names, override_existing=True)
+            elif file_ext in ['xls', 'xlsb', 'odf', 'ods', 'odt']:
                 xls = pd.ExcelFile(user_sheet, engine='openpyxl')
                 for sheet_name in xls.sheet_names:
                     df = xls.parse(sheet_name)
@@ -84,11 +171,8 @@ def main():
                     table_name = clean_table_name(f"{table_base_name}_{sheet_name}")
                     write_to_sql(conn, df, table_name, override_existing=True)
             elif file_ext == 'csv':
-                df = pd.read_csv(user_sheet)
-                if df.empty:
-                    print("CSV файл пустой, импорт пропущен.")
+                if not import_csv_streaming(conn, user_sheet, table_base_name, override_existing=True):
                     return
-                write_to_sql(conn, df, table_base_name, override_existing=True)
             else:
                 print("Неподдерживаемое расширение файла.")
                 return
@@ -2,11 +2,20 @@ import pandas as pd
 import sqlite3
 import re
 import os
+import json
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from core.pipeline import ask_mistral_simple
+from core.llm_client import get_client, LLMError, LLM_STREAM, partial_json_string, TextProgress
+from agents.importer import previous_user_message, reformat_query
+from core.catalog import load_catalog
+from core import llm_cache, indexes, result_cache, tracing, query_guard, sampling
+from core.prompt_budget import describe_for_question, PROMPT_TOKEN_BUDGET
 from core.config import model, key as CONFIG_KEY
 
 MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", model)
 API_KEY = os.getenv("MISTRAL_API_KEY") or CONFIG_KEY
+SQL_TEMPERATURE = 0.2
 
 SQL_SYSTEM_PROMPT = {
     'role': 'system',
@@ -31,6 +40,49 @@ def extract_sql_query(text):
     match = re.search(r'(SELECT[\s\S]+?;)', text, re.IGNORECASE)
     return match.group(1) if match else None
 
+_STATEMENT_START_RE = re.compile(r"(?:^|\n)[ \t`]*(?:sql\s+)?(SELECT\b)", re.IGNORECASE)
+
+def first_sql_statement(text):
+    """
+    Первый завершённый (до ;) SELECT в начале строки текста или None, если он ещё не
+    дописан. Точка с запятой внутри строк и имён в кавычках конец не означает.
+    """
+    match = _STATEMENT_START_RE.search(text)
+    if not match:
+        return None
+    start = match.start(1)
+    quote = None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif ch == ";":
+            return text[start:i + 1].strip()
+    return None
+
+def stream_sql(messages, api_key, model=MISTRAL_MODEL):
+    """
+    SQL из потокового ответа LLM: как только пришёл завершённый SELECT ...;, поток
+    обрывается и запрос можно выполнять, не дожидаясь хвоста ответа.
+    """
+    text = ""
+    try:
+        with contextlib.closing(get_client(api_key).chat_stream(
+                messages, model, SQL_TEMPERATURE, api_key=api_key)) as stream:
+            for delta in stream:
+                text += delta
+                sql = first_sql_statement(text)
+                if sql is not None:
+                    tracing.current_span().set(early_sql=True)
+                    return sql
+    except LLMError as e:
+        print("Ошибка LLM:", e)
+        return None
+    return extract_sql_query(text)
+
 def add_limit(sql, max_rows=100):
     if re.search(r'\blimit\b', sql, re.IGNORECASE):
         return sql
@@ -38,36 +90,153 @@ def add_limit(sql, max_rows=100):
     return f"{sql} LIMIT {max_rows};"
 
 def execute_sql_and_return_result(conn, sql_query):
+    """
+    Выполняет SQL через защиту core.query_guard: оценка стоимости по плану до запуска,
+    срок и отмена во время выполнения, чтение пачками. Дорогой запрос — QueryRejected.
+    """
     try:
-        cur = conn.execute(sql_query)
-        rows = cur.fetchall()
-        colnames = [description[0] for description in cur.description] if cur.description else []
-        return pd.DataFrame(rows, columns=colnames) if colnames else rows
+        key = result_cache.make_key(conn, sql_query)
+        cached = result_cache.get(key)
+        if cached is not None:
+            tracing.current_span().set(result_cache_hit=True, rows=len(cached))
+            return cached
+        with tracing.span("sql.execute", sql_chars=len(sql_query)) as s:
+            s.set(cost=round(query_guard.admit(conn, sql_query)))
+            colnames, rows = query_guard.fetch(conn, sql_query)
+            s.set(rows=len(rows))
+        if not colnames:
+            return rows
+        with tracing.span("dataframe.build", rows=len(rows), columns=len(colnames)):
+            result = pd.DataFrame(rows, columns=colnames)
+        result_cache.put(key, result)
+        return result.copy(deep=False)
+    except query_guard.QueryRejected:
+        raise
     except Exception as e:
         return f"Ошибка выполнения SQL: {e}"
 
-def answer_question_sql(
-    conn, table_name, columns, user_question,
-    api_key, model=MISTRAL_MODEL,
-    message_history=None
-):
-    sys_msg = {
-        'role': SQL_SYSTEM_PROMPT['role'],
-        'content': SQL_SYSTEM_PROMPT['content'].format(table_name=table_name)
-    }
+def describe_columns(conn, table_name, columns=None, question=None, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Описание столбцов для промпта из каталога и отпечаток схемы для кэша LLM.
+    Без вопроса — все столбцы как "имя (ТИП)"; с вопросом — в пределах budget токенов,
+    релевантные вопросу столбцы первыми и с примерами значений (core.prompt_budget).
+    """
+    info = load_catalog(conn, table_name)
+    by_name = {c["name"]: c for c in info["columns"]}
+    names = columns if columns is not None else list(by_name)
+    schema = llm_cache.schema_fingerprint(
+        table_name, [{"name": c, "type": by_name.get(c, {}).get("type", "")} for c in names])
+    if question is None:
+        types = {c: by_name[c]["type"] for c in names if c in by_name}
+        return ", ".join(f"{c} ({types[c]})" if types.get(c) else str(c) for c in names), schema
+    described, included = describe_for_question([by_name.get(c, {"name": c}) for c in names], question, budget)
+    tracing.current_span().set(prompt_columns=len(included), table_columns=len(names))
+    return described, schema
+
+def build_sql_prompt(conn, table_name, columns, user_question):
+    described, schema = describe_columns(conn, table_name, columns, user_question)
     prompt_sql = (
-        f"Таблица: {table_name}. Столбцы: {', '.join(columns)}.\n"
+        f"Таблица: {table_name}. Столбцы: {described}.\n"
         f"Составь КОРОТКИЙ ОДНОСТРОЧНЫЙ SQL SELECT для SQLite, чтобы ответить на вопрос: '{user_question}'. "
         "Ответь только строкой SQL, без комментариев, без markdown, без пояснений."
     )
-    sql = ask_mistral_simple(prompt_sql, api_key, model)
-    sql = extract_sql_query(sql)
+    return prompt_sql, schema
+
+def request_sql(prompt_sql, schema, api_key, model=MISTRAL_MODEL, use_cache=None):
+    """
+    Генерация SQL по готовому промпту (кэш LLM, затем сеть). Не трогает SQLite,
+    поэтому может выполняться в отдельном потоке.
+    """
+    cache_messages = [{"role": "user", "content": prompt_sql}]
+    with tracing.span("sql.generate", prompt_chars=len(prompt_sql)) as s:
+        sql = llm_cache.get(cache_messages, model, SQL_TEMPERATURE, schema, enabled=use_cache)
+        s.set(llm_cache_hit=sql is not None)
+        if sql is None:
+            if LLM_STREAM:
+                sql = stream_sql(cache_messages, api_key, model)
+            else:
+                sql = extract_sql_query(ask_mistral_simple(prompt_sql, api_key, model, temperature=SQL_TEMPERATURE))
+            if sql is not None:
+                llm_cache.put(cache_messages, model, SQL_TEMPERATURE, sql, schema, enabled=use_cache)
+        s.set(sql_found=sql is not None)
+    return sql
+
+def rewrite_costly_sql(sql, rejected, user_question, api_key, model=MISTRAL_MODEL):
+    """
+    Просит LLM переписать запрос, который защита отклонила как слишком дорогой.
+    """
+    prompt = (
+        f"SQL-запрос для SQLite слишком дорогой ({rejected}):\n{sql}\n"
+        f"План выполнения:\n{rejected.plan}\n"
+        f"Перепиши его так, чтобы он отвечал на тот же вопрос: '{user_question}', но без декартовых "
+        "произведений, коррелированных подзапросов и соединений больших таблиц без условия. "
+        "Ответь только строкой SQL, без комментариев, без markdown, без пояснений."
+    )
+    with tracing.span("sql.rewrite"):
+        return request_sql(prompt, "", api_key, model)
+
+def execute_guarded(conn, sql, user_question, api_key, model=MISTRAL_MODEL):
+    """
+    Выполнение SQL с защитой от дорогих запросов. При QUERY_GUARD=rewrite отклонённый
+    запрос один раз переписывается LLM. Возвращает (итоговый SQL, результат).
+    """
+    try:
+        return sql, execute_sql_and_return_result(conn, add_limit(sql))
+    except query_guard.QueryRejected as e:
+        rejected = e
+    print(f"Запрос отклонён: {rejected}")
+    if query_guard.QUERY_GUARD == "rewrite":
+        rewritten = rewrite_costly_sql(sql, rejected, user_question, api_key, model)
+        if rewritten is not None:
+            try:
+                return rewritten, execute_sql_and_return_result(conn, add_limit(rewritten))
+            except query_guard.QueryRejected as e:
+                rejected = e
+    return sql, (f"Запрос отклонён: {rejected}. Уточните вопрос (фильтры, группировка) "
+                 f"или повысьте QUERY_COST_LIMIT.\nПлан:\n{rejected.plan}")
+
+def execute_approximate(conn, approx_sql, info):
+    """
+    Запрос, переписанный на выборку (core.sampling): результат с доверительными
+    интервалами или None, если по выборке выполнить не удалось (тогда — точно).
+    """
+    with tracing.span("sql.approximate", fraction=info["fraction"], sample_rows=info["sample_rows"]):
+        try:
+            result = execute_sql_and_return_result(conn, add_limit(approx_sql))
+        except query_guard.QueryRejected:
+            return None
+    if not isinstance(result, pd.DataFrame):
+        return None
+    if not sampling.enough_rows(result):
+        print("По выборке слишком мало строк для оценки — считаю точно.")
+        return None
+    result = sampling.finish_result(result, info)
+    print(f"{sampling.describe(info)} Для точного ответа введите «точно».")
+    return result
+
+def run_generated_sql(conn, sql, user_question, api_key, model=MISTRAL_MODEL, human_answer=True,
+                      approximate=None):
+    """
+    Выполняет сгенерированный SQL. В приблизительном режиме (approximate, по умолчанию
+    APPROX_MODE) агрегаты по большим таблицам считаются по выборке; в attrs["sql"]
+    результата остаётся исходный запрос для точного ответа (answer_exact) и выгрузки.
+    """
     if sql is None:
         return f"Вопрос к таблице: {user_question}\n\n=== Результат ===\n\nНе удалось сгенерировать корректный SQL для вашего вопроса."
-    sql = add_limit(sql)
-    result = execute_sql_and_return_result(conn, sql)
-    # Если результат DataFrame — вернуть для возможного сохранения в Excel
+    if approximate is None:
+        approximate = sampling.approximate_enabled()
+    approx = sampling.approximate_query(conn, sql) if approximate else None
+    result = execute_approximate(conn, *approx) if approx is not None else None
+    if result is None:
+        sql, result = execute_guarded(conn, sql, user_question, api_key, model)
+    # Если результат DataFrame — вернуть для возможного сохранения в Excel;
+    # исходный SQL без LIMIT сохраняется для полной потоковой выгрузки
     if isinstance(result, pd.DataFrame):
+        result.attrs["sql"] = sql
+        try:
+            indexes.record_query(conn, sql)
+        except Exception as e:
+            print("Советник по индексам:", e)
         return result
     if isinstance(result, str):
         return f"Вопрос к таблице: {user_question}\n\n=== Результат ===\n\n{result}"
@@ -75,6 +244,8 @@ def answer_question_sql(
         result_text = "Нет данных по вашему запросу."
     else:
         result_text = result.head(10).to_string(index=False) if isinstance(result, pd.DataFrame) else str(result)
+    if not human_answer:
+        return f"Вопрос к таблице: {user_question}\n\n=== Результат ===\n{result_text}"
     # Human answer
     prompt_human = (
         f"Вопрос к таблице: {user_question}\n\n"
@@ -86,3 +257,140 @@ def answer_question_sql(
     match = re.search(r'=== Результат ===\n*(.+)', answer, re.DOTALL)
     result_only = match.group(1).strip() if match else answer.strip()
     return f"Вопрос к таблице: {user_question}\n\n=== Результат ===\n{result_only}"
+
+def answer_question_sql(
+    conn, table_name, columns, user_question,
+    api_key, model=MISTRAL_MODEL,
+    message_history=None, use_cache=None, approximate=None
+):
+    prompt_sql, schema = build_sql_prompt(conn, table_name, columns, user_question)
+    sql = request_sql(prompt_sql, schema, api_key, model, use_cache)
+    return run_generated_sql(conn, sql, user_question, api_key, model, approximate=approximate)
+
+def answer_exact(conn, approximate_result, user_question, api_key, model=MISTRAL_MODEL):
+    """
+    Точный ответ вместо приблизительного: тот же SQL по всей таблице.
+    """
+    return run_generated_sql(conn, approximate_result.attrs["sql"], user_question, api_key, model,
+                             human_answer=False, approximate=False)
+
+# ---- Один запрос к LLM на вопрос: переформулировка + флаг Excel + SQL ----
+
+COMBINED_TEMPERATURE = 0.1
+
+COMBINED_SYSTEM_PROMPT = {
+    'role': 'system',
+    'content': (
+        "Ты — опытный аналитик и SQL-разработчик. По запросу пользователя верни строго JSON-объект "
+        "с ключами:\n"
+        '"rephrased" — запрос, переформулированный максимально понятно для SQL-аналитика, на русском;\n'
+        '"need_excel" — true, если запрос на выгрузку/изменение/сохранение, false — если только вопрос;\n'
+        '"sql" — один короткий однострочный SQL SELECT для SQLite, отвечающий на запрос.\n'
+        "Никакого markdown, комментариев и пояснений — только JSON. "
+        "Если вопрос не относится к данным, в sql верни 'SELECT * FROM {table_name} LIMIT 5;'."
+    )
+}
+
+def parse_combined_answer(text):
+    """
+    Разбор структурированного ответа: (rephrased, need_excel, sql или None).
+    """
+    match = re.search(r"\{[\s\S]*\}", text)
+    if not match:
+        raise ValueError(f"Формат ответа нарушен: {text}")
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        raise ValueError(f"Формат ответа нарушен: {text}")
+    need_excel = data.get("need_excel")
+    if not isinstance(need_excel, bool):
+        need_excel = str(need_excel).strip().lower() in ("true", "да", "yes", "1")
+    sql = extract_sql_query(str(data.get("sql") or ""))
+    return str(data.get("rephrased") or "").strip(), need_excel, sql
+
+_NEED_EXCEL_RE = re.compile(r'"need_excel"\s*:\s*(true|false|"[^"]*")', re.IGNORECASE)
+
+def stream_combined_answer(messages, api_key, model=MISTRAL_MODEL, on_text=None):
+    """
+    Потоковый JSON-ответ combined-режима. Переформулировка передаётся в on_text по мере
+    прихода; как только известны все поля и SQL завершён (;), поток обрывается и
+    возвращается собранный JSON, иначе — ответ целиком.
+    """
+    text = ""
+    progress = TextProgress(on_text)
+    with contextlib.closing(get_client(api_key).chat_stream(
+            messages, model, COMBINED_TEMPERATURE, api_key=api_key,
+            response_format={"type": "json_object"})) as stream:
+        for delta in stream:
+            text += delta
+            rephrased, rephrased_done = partial_json_string(text, "rephrased")
+            if rephrased is not None:
+                progress.update(rephrased)
+            need_excel = _NEED_EXCEL_RE.search(text)
+            sql_text, _ = partial_json_string(text, "sql")
+            sql = first_sql_statement(sql_text) if sql_text else None
+            if sql is not None and rephrased_done and need_excel:
+                tracing.current_span().set(early_sql=True)
+                return json.dumps({"rephrased": rephrased, "need_excel": json.loads(need_excel.group(1).lower()),
+                                   "sql": sql}, ensure_ascii=False)
+    return text
+
+def answer_question_combined(
+    conn, table_name, columns, user_question,
+    api_key, model=MISTRAL_MODEL,
+    message_history=None, use_cache=None, on_text=None
+):
+    """
+    Вопрос за один запрос к LLM: в одном JSON-ответе приходят переформулировка,
+    флаг выгрузки в Excel и SQL. Возвращает (rephrased, need_excel, результат).
+    При LLM_STREAM переформулировка передаётся в on_text по мере генерации.
+    """
+    previous = previous_user_message(message_history, user_question)
+    described, schema = describe_columns(conn, table_name, columns, f"{previous} {user_question}")
+    context_block = f"Предыдущее сообщение пользователя: {previous}\n" if previous else ""
+    messages = [
+        {'role': 'system', 'content': COMBINED_SYSTEM_PROMPT['content'].format(table_name=table_name)},
+        {'role': 'user', 'content': (
+            f"Таблица: {table_name}. Столбцы: {described}.\n"
+            f"{context_block}Текущий запрос пользователя: {user_question}"
+        )},
+    ]
+    with tracing.span("llm.combined") as s:
+        text = llm_cache.get(messages, model, COMBINED_TEMPERATURE, schema, enabled=use_cache)
+        cached = text is not None
+        s.set(llm_cache_hit=cached)
+        if not cached and LLM_STREAM:
+            text = stream_combined_answer(messages, api_key, model, on_text)
+        elif not cached:
+            text = get_client(api_key).chat(
+                messages, model, COMBINED_TEMPERATURE, api_key=api_key, response_format={"type": "json_object"}
+            )
+        rephrased, need_excel, sql = parse_combined_answer(text)
+        s.set(sql_found=sql is not None)
+    if sql is not None and not cached:
+        llm_cache.put(messages, model, COMBINED_TEMPERATURE, text, schema, enabled=use_cache)
+    result = run_generated_sql(conn, sql, rephrased or user_question, api_key, model, human_answer=False)
+    return rephrased or user_question, need_excel, result
+
+def answer_question_speculative(
+    conn, table_name, columns, user_question,
+    api_key, model=MISTRAL_MODEL,
+    message_history=None, use_cache=None, on_text=None
+):
+    """
+    Переформулировка и генерация SQL по исходному вопросу запускаются параллельно.
+    Спекулятивный SQL используется, только если истории нет или переформулировка совпала
+    с вопросом: иначе он мог упустить контекст предыдущего вопроса, и SQL генерируется
+    повторно по переформулированному вопросу. Возвращает (rephrased, need_excel, результат).
+    """
+    message_history = message_history or []
+    prompt_raw, schema = build_sql_prompt(conn, table_name, columns, user_question)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        speculative = pool.submit(request_sql, prompt_raw, schema, api_key, model, use_cache)
+        rephrased, need_excel = reformat_query({"content": user_question}, message_history, use_cache, on_text)
+        sql = speculative.result()
+    standalone = not previous_user_message(message_history, user_question)
+    if sql is None or not (standalone or rephrased.strip() == user_question.strip()):
+        prompt_sql, schema = build_sql_prompt(conn, table_name, columns, rephrased)
+        sql = request_sql(prompt_sql, schema, api_key, model, use_cache)
+    return rephrased, need_excel, run_generated_sql(conn, sql, rephrased, api_key, model, human_answer=False)
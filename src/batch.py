@@ -0,0 +1,182 @@
+"""
+Пакетный режим: ответы на файл вопросов без диалога.
+
+    python batch.py questions.txt --tables churn,orders --output batch_report.xlsx --workers 4 --timeout 120
+
+Вопросы — строки .txt или первый столбец (либо столбец "Вопрос"/"question") .csv/.xlsx.
+Каждый вопрос задаётся каждой из таблиц; ответы попадают в одну книгу:
+лист Summary со сводкой и по листу на вопрос.
+"""
+import argparse
+import datetime
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from core import llm_client, tracing
+from core.catalog import load_catalog
+from core.database import DB_PATH, connect, list_tables_from_db, sql_deadline
+from core.pipeline import save_sheets_to_excel
+from main import handle_question
+from utils import history as history_log
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(llm_client.LLM_MAX_CONCURRENCY)))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "120"))  # секунды на один вопрос
+QUESTION_COLUMNS = ("вопрос", "вопросы", "question", "questions")
+SHEET_NAME_MAX = 31
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def read_questions(path):
+    """
+    Список вопросов из .txt (строка — вопрос, # — комментарий), .csv или .xlsx/.xls.
+    """
+    lower = path.lower()
+    if lower.endswith(".txt"):
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if lower.endswith((".csv", ".csv.gz")):
+        df = pd.read_csv(path, dtype=str)
+    elif lower.endswith((".xlsx", ".xlsm", ".xls")):
+        df = pd.read_excel(path, dtype=str)
+    else:
+        raise ValueError(f"Неподдерживаемый формат файла вопросов: {path}")
+    column = next((c for c in df.columns if str(c).strip().lower() in QUESTION_COLUMNS), df.columns[0])
+    return [q.strip() for q in df[column].dropna() if q.strip()]
+
+def _thread_conn():
+    """
+    Своё соединение SQLite на поток пула: объекты sqlite3 нельзя делить между потоками.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect(DB_PATH, timeout=30, check_same_thread=False)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def answer_one(batch_id, table_name, columns, question, timeout):
+    """
+    Ответ на один вопрос со сроком timeout секунд: запросы к LLM ограничены
+    llm_client.deadline, выполнение SQL прерывается обработчиком прогресса SQLite.
+    """
+    conn = _thread_conn()
+    started = time.perf_counter()
+    end = time.monotonic() + timeout
+    record = {"table": table_name, "question": question, "rephrased": "", "sql": "",
+              "status": "ok", "rows": None, "error": "", "answer": None}
+    try:
+        with llm_client.deadline(timeout), sql_deadline(conn, timeout):
+            rephrased, _, answer = handle_question(conn, table_name, columns, question, [])
+        record["rephrased"] = rephrased
+        record["answer"] = answer
+        if isinstance(answer, pd.DataFrame):
+            record["rows"] = len(answer)
+            record["sql"] = answer.attrs.get("sql", "")
+        elif history_log.answer_status(answer) == "error":
+            record["status"] = "error"
+            record["error"] = str(answer).split("=== Результат ===")[-1].strip()
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    if time.monotonic() > end and record["status"] != "ok":
+        record["status"] = "timeout"
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    history_log.log_event(batch_id, [table_name], question, record["rephrased"], record["sql"],
+                          record["status"], record["rows"], 1000 * record["seconds"], source="batch")
+    return record
+
+def sheet_name(index, table_name, multi_table):
+    name = f"Q{index:03d}_{table_name}" if multi_table else f"Q{index:03d}"
+    for ch in '[]:*?/\\':
+        name = name.replace(ch, "_")
+    return name[:SHEET_NAME_MAX]
+
+def answer_sheet(record):
+    answer = record["answer"]
+    if isinstance(answer, pd.DataFrame):
+        return answer
+    text = record["error"] or (str(answer) if answer is not None else "")
+    return pd.DataFrame({"Вопрос": [record["question"]], "Ответ": [text]})
+
+def run_batch(questions, tables, output_file, workers=BATCH_WORKERS, timeout=BATCH_TIMEOUT):
+    """
+    Отвечает на вопросы по таблицам с ограниченным параллелизмом и пишет
+    книгу-отчёт. Возвращает список записей по вопросам.
+    """
+    conn = connect(DB_PATH)
+    # Каталог строится заранее в одном потоке, чтобы воркеры его только читали
+    columns = {t: [c["name"] for c in load_catalog(conn, t)["columns"]] for t in tables}
+    conn.close()
+
+    batch_id = uuid.uuid4().hex
+    jobs = [(t, q) for q in questions for t in tables]
+    records = [None] * len(jobs)
+    started = time.perf_counter()
+    print(f"Вопросов: {len(questions)}, таблиц: {len(tables)}, потоков: {workers}, срок на вопрос: {timeout:g} с")
+    with tracing.span("batch", jobs=len(jobs), workers=workers) as s:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+            futures = {pool.submit(answer_one, batch_id, t, columns[t], q, timeout): i for i, (t, q) in enumerate(jobs)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                records[i] = future.result()
+                rec = records[i]
+                print(f"[{done}/{len(jobs)}] {rec['status']:<7} {rec['seconds']:6.1f} с  {rec['table']}: {rec['question'][:60]}")
+        s.set(errors=sum(r["status"] != "ok" for r in records))
+    with _connections_lock:
+        for c in _connections:
+            c.close()
+        _connections.clear()
+
+    multi_table = len(tables) > 1
+    sheets = {}
+    summary = []
+    for index, rec in enumerate(records, 1):
+        name = sheet_name(index, rec["table"], multi_table)
+        sheets[name] = answer_sheet(rec)
+        summary.append({
+            "Лист": name, "Таблица": rec["table"], "Вопрос": rec["question"],
+            "Переформулировка": rec["rephrased"], "SQL": rec["sql"], "Статус": rec["status"],
+            "Строк": rec["rows"], "Время, с": rec["seconds"], "Ошибка": rec["error"],
+        })
+    save_sheets_to_excel({"Summary": pd.DataFrame(summary), **sheets}, output_file)
+    history_log.log_event(batch_id, tables, status="ok", output_file=output_file, source="batch", event="export")
+    history_log.flush()
+    elapsed = time.perf_counter() - started
+    ok = sum(r["status"] == "ok" for r in records)
+    print(f"Готово: {ok} из {len(records)} успешно за {elapsed:.1f} с. Отчёт: {output_file}")
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетные ответы на вопросы к таблицам")
+    parser.add_argument("questions", help="файл вопросов: .txt, .csv или .xlsx")
+    parser.add_argument("--tables", required=True, help="таблицы через запятую")
+    parser.add_argument("--output", help="книга-отчёт .xlsx (по умолчанию batch_<время>.xlsx)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="число параллельных вопросов")
+    parser.add_argument("--timeout", type=float, default=BATCH_TIMEOUT, help="срок на один вопрос, секунды")
+    args = parser.parse_args()
+
+    available = set(list_tables_from_db(DB_PATH))
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    missing = [t for t in tables if t not in available]
+    if missing:
+        parser.error(f"таблиц нет в базе: {', '.join(missing)}")
+    questions = read_questions(args.questions)
+    if not questions:
+        parser.error("в файле нет вопросов")
+    output = args.output or f"batch_{datetime.datetime.now():%Y%m%d_%H%M%S}.xlsx"
+    if not output.lower().endswith(".xlsx"):
+        output += ".xlsx"
+    run_batch(questions, tables, output, max(1, args.workers), args.timeout)
+    if tracing.TRACE_ENABLED:
+        tracing.print_summary()
+
+if __name__ == "__main__":
+    main()
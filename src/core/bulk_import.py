@@ -0,0 +1,320 @@
+import datetime
+import glob
+import hashlib
+import json
+import multiprocessing
+import ntpath
+import os
+import queue
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from core import columnar, inference, sampling, tracing
+from core.catalog import INTERNAL_PREFIX, clean_table_name, quote_ident, refresh_catalog
+from core.database import (
+    DB_PATH, CSV_CHUNK_SIZE, EXCEL_BATCH_ROWS, EXCEL_STREAM_EXTENSIONS, IMPORT_WORKERS,
+    apply_import_pragmas, insert_chunk, _cell_value, _sheet_columns,
+)
+
+# Пакетный импорт каталогов и шаблонов файлов: файлы разбираются в пуле процессов, чанки
+# DataFrame через очередь попадают к единственному писателю (одно соединение WAL), который
+# коммитит пачками по BULK_COMMIT_ROWS строк. Каждый файл пишется во временные таблицы и
+# подменяет прежние только целиком. Файлы, содержимое которых не изменилось с прошлого
+# импорта (хэш в служебной таблице), пропускаются.
+BULK_EXTENSIONS = ("csv",) + tuple(EXCEL_STREAM_EXTENSIONS) + ("xls", "xlsb", "ods")
+BULK_COMMIT_ROWS = int(os.getenv("BULK_COMMIT_ROWS", "200000"))
+IMPORT_MANIFEST = f"{INTERNAL_PREFIX}imports"
+BULK_STAGING_PREFIX = f"{INTERNAL_PREFIX}bulk_"
+HASH_BLOCK = 1 << 20
+
+_file_queue = None
+
+def _init_file_worker(q):
+    global _file_queue
+    _file_queue = q
+
+def expand_paths(patterns):
+    """
+    Файлы по списку путей, каталогов (рекурсивно) и glob-шаблонов; только поддерживаемые
+    расширения, без временных файлов Excel (~$...). Порядок — как в аргументах, без повторов.
+    """
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = sorted(glob.glob(os.path.join(glob.escape(pattern), "**", "*"), recursive=True))
+        elif glob.has_magic(pattern):
+            paths = sorted(glob.glob(pattern, recursive=True))
+        else:
+            paths = [pattern]
+        for path in paths:
+            ext = ntpath.splitext(path)[1][1:].lower()
+            if os.path.isfile(path) and ext in BULK_EXTENSIONS and not ntpath.basename(path).startswith("~$"):
+                path = os.path.abspath(path)
+                if path not in found:
+                    found.append(path)
+    return found
+
+def table_bases(paths):
+    """
+    {путь: базовое имя таблицы}: имя файла, а при совпадении имён в разных каталогах —
+    путь относительно общего каталога (north/sales.csv -> north_sales).
+    """
+    bases = {p: clean_table_name(ntpath.splitext(ntpath.basename(p))[0]) for p in paths}
+    counts = {}
+    for base in bases.values():
+        counts[base] = counts.get(base, 0) + 1
+    root = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ""
+    for path, base in bases.items():
+        if counts[base] > 1:
+            bases[path] = clean_table_name(ntpath.splitext(os.path.relpath(path, root))[0].replace(os.sep, "_"))
+    return bases
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _send_frames(q, path, table, frames):
+    for frame in frames:
+        if len(frame):
+            q.put(("chunk", path, (table, frame)))
+
+def _xlsx_frames(path, sheet_name):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _sheet_columns(header)
+        width = len(columns)
+        batch = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            row = tuple(_cell_value(v) for v in row[:width])
+            batch.append(row + (None,) * (width - len(row)))
+            if len(batch) >= EXCEL_BATCH_ROWS:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        wb.close()
+
+def _parse_file(path, base, known_digest):
+    """
+    Воркер: хэширует файл и, если он изменился, отправляет писателю его чанки
+    ("chunk", путь, (таблица, DataFrame)). Первое сообщение — ("start"/"skip", путь, хэш).
+    """
+    q = _file_queue
+    started = time.time()
+    try:
+        digest = file_digest(path)
+        if digest == known_digest:
+            q.put(("skip", path, digest))
+            return
+        q.put(("start", path, digest))
+        ext = ntpath.splitext(path)[1][1:].lower()
+        if ext == "csv":
+            try:
+                _send_frames(q, path, base, pd.read_csv(path, chunksize=CSV_CHUNK_SIZE))
+            except pd.errors.EmptyDataError:
+                pass
+        elif ext in EXCEL_STREAM_EXTENSIONS:
+            from openpyxl import load_workbook
+            wb = load_workbook(path, read_only=True)
+            sheets = list(wb.sheetnames)
+            wb.close()
+            for sheet in sheets:
+                _send_frames(q, path, clean_table_name(f"{base}_{sheet}"), _xlsx_frames(path, sheet))
+        else:
+            for sheet, df in pd.read_excel(path, sheet_name=None).items():
+                _send_frames(q, path, clean_table_name(f"{base}_{sheet}"), [df])
+        q.put(("done", path, started))
+    except Exception as e:
+        q.put(("error", path, f"{type(e).__name__}: {e}"))
+
+def ensure_manifest(conn):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {IMPORT_MANIFEST} ("
+        "path TEXT PRIMARY KEY, digest TEXT, tables TEXT, rows INTEGER, imported_at TEXT)"
+    )
+
+def known_digests(conn, paths):
+    """
+    {путь: хэш} последнего успешного импорта, если все его таблицы ещё есть в базе.
+    """
+    ensure_manifest(conn)
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    known = {}
+    for path, digest, tables in conn.execute(f"SELECT path, digest, tables FROM {IMPORT_MANIFEST}"):
+        if path in paths and all(t in existing for t in json.loads(tables or "[]")):
+            known[path] = digest
+    return known
+
+class _Writer:
+    """
+    Единственный писатель: чанки каждого файла пишутся во временные таблицы
+    (_meta_bulk_N), по завершении файла они подменяют целевые. Транзакция
+    фиксируется, когда накоплено BULK_COMMIT_ROWS строк, и в конце.
+    """
+    def __init__(self, conn, total, commit_rows):
+        self.conn = conn
+        self.total = total
+        self.commit_rows = commit_rows
+        self.files = {}  # путь -> {"digest", "tables": {таблица: [временная, схема, строк]}}
+        self.pending_rows = 0
+        self.pending_tables = []
+        self.seq = 0
+        self.finished = 0
+        self.stats = {"imported": 0, "skipped": 0, "failed": 0, "rows": 0}
+
+    def _progress(self, path, text):
+        self.finished += 1
+        print(f"[{self.finished}/{self.total}] {path}: {text}")
+
+    def handle(self, kind, path, payload):
+        if kind == "skip":
+            self.stats["skipped"] += 1
+            self._progress(path, "не изменился, пропущен")
+        elif kind == "start":
+            self.files[path] = {"digest": payload, "tables": {}}
+        elif kind == "chunk":
+            self._chunk(path, *payload)
+        elif kind == "done":
+            self._done(path, payload)
+        elif kind == "error":
+            self._discard(path)
+            self.stats["failed"] += 1
+            self._progress(path, f"ошибка — {payload}")
+
+    def _chunk(self, path, table, frame):
+        tables = self.files[path]["tables"]
+        if frame.empty:
+            # Лист или CSV только с заголовком не заменяет существующую таблицу
+            return
+        if table not in tables:
+            self.seq += 1
+            staging = f"{BULK_STAGING_PREFIX}{self.seq}"
+            schema = inference.infer_schema(frame)
+            self.conn.execute(f"DROP TABLE IF EXISTS {quote_ident(staging)}")
+            self.conn.execute(inference.create_table_sql(staging, schema))
+            tables[table] = [staging, schema, 0]
+        staging, schema, _ = tables[table]
+        insert_chunk(self.conn, inference.apply_schema(frame, schema), staging, inference.date_columns(schema))
+        tables[table][2] += len(frame)
+        self.pending_rows += len(frame)
+
+    def _discard(self, path):
+        for staging, _, _ in self.files.pop(path, {"tables": {}})["tables"].values():
+            self.conn.execute(f"DROP TABLE IF EXISTS {quote_ident(staging)}")
+
+    def _done(self, path, started):
+        info = self.files.pop(path)
+        rows = 0
+        for table, (staging, _, count) in info["tables"].items():
+            self.conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+            self.conn.execute(f"ALTER TABLE {quote_ident(staging)} RENAME TO {quote_ident(table)}")
+            self.pending_tables.append(table)
+            rows += count
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {IMPORT_MANIFEST} (path, digest, tables, rows, imported_at) VALUES (?, ?, ?, ?, ?)",
+            (path, info["digest"], json.dumps(list(info["tables"]), ensure_ascii=False), rows,
+             datetime.datetime.now().isoformat(timespec="seconds")),
+        )
+        elapsed = max(time.time() - started, 1e-9)
+        self.stats["imported"] += 1
+        self.stats["rows"] += rows
+        self._progress(path, f"{rows} строк, таблиц: {len(info['tables'])}, {elapsed:.2f} с "
+                             f"({rows / elapsed:,.0f} строк/с)")
+        if self.pending_rows >= self.commit_rows:
+            self.commit()
+
+    def commit(self, final=False):
+        """
+        Фиксирует транзакцию, обновляет каталог изменённых таблиц и (кроме final)
+        начинает следующую.
+        """
+        self.conn.commit()
+        db_path = columnar.database_file(self.conn)
+        for table in dict.fromkeys(self.pending_tables):
+            refresh_catalog(self.conn, table)
+            # Колоночный кэш пересоздаётся при первой загрузке таблицы
+            columnar.drop_sidecar(db_path, table)
+            sampling.refresh_samples(self.conn, table)
+        self.pending_tables.clear()
+        self.pending_rows = 0
+        if not final:
+            self.conn.execute("BEGIN")
+
+@tracing.traced("import.bulk", lambda stats: stats)
+def bulk_import(patterns, db_path=DB_PATH, max_workers=IMPORT_WORKERS, force=False,
+                commit_rows=BULK_COMMIT_ROWS):
+    """
+    Импорт всех файлов по путям, каталогам и шаблонам в одну базу. force — импортировать
+    и не изменившиеся файлы. Возвращает {"imported", "skipped", "failed", "rows"}.
+    """
+    paths = expand_paths(patterns)
+    if not paths:
+        print("Файлы для импорта не найдены.")
+        return {"imported": 0, "skipped": 0, "failed": 0, "rows": 0}
+    bases = table_bases(paths)
+    # Крупные файлы — первыми, чтобы воркеры были загружены равномерно
+    paths.sort(key=lambda p: -os.path.getsize(p))
+    conn = sqlite3.connect(db_path)
+    apply_import_pragmas(conn)
+    ensure_manifest(conn)
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                (BULK_STAGING_PREFIX + "%",)).fetchall():
+        conn.execute(f"DROP TABLE {quote_ident(name)}")  # остатки прерванного запуска
+    conn.commit()
+    known = {} if force else known_digests(conn, set(paths))
+
+    started = time.perf_counter()
+    workers = max(1, min(max_workers, len(paths)))
+    print(f"Файлов: {len(paths)}, процессов: {workers}, база: {db_path}")
+    q = multiprocessing.Queue(maxsize=workers * 4)
+    writer = _Writer(conn, len(paths), commit_rows)
+    conn.execute("BEGIN")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_file_worker, initargs=(q,)) as pool:
+            futures = [pool.submit(_parse_file, p, bases[p], known.get(p)) for p in paths]
+            try:
+                while writer.finished < len(paths):
+                    try:
+                        kind, path, payload = q.get(timeout=1)
+                    except queue.Empty:
+                        for f in futures:
+                            if f.done() and f.exception() is not None:
+                                raise f.exception()
+                        continue
+                    writer.handle(kind, path, payload)
+            except BaseException:
+                # Разблокируем воркеры, ждущие места в очереди, иначе пул не завершится
+                for f in futures:
+                    f.cancel()
+                while not all(f.done() for f in futures):
+                    try:
+                        q.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                raise
+        writer.commit(final=True)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    stats = writer.stats
+    print(f"Импортировано файлов: {stats['imported']}, пропущено без изменений: {stats['skipped']}, "
+          f"с ошибкой: {stats['failed']}; {stats['rows']} строк за {elapsed:.2f} с "
+          f"({stats['rows'] / max(elapsed, 1e-9):,.0f} строк/с).")
+    return stats
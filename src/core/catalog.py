@@ -0,0 +1,254 @@
+import sqlite3
+import json
+import datetime
+import re
+import uuid
+
+# Служебные таблицы проекта начинаются с этого префикса и не показываются пользователю
+INTERNAL_PREFIX = "_meta_"
+CATALOG_TABLES = f"{INTERNAL_PREFIX}tables"
+CATALOG_COLUMNS = f"{INTERNAL_PREFIX}columns"
+CATALOG_DATABASE = f"{INTERNAL_PREFIX}database"  # свойства базы (идентификатор)
+
+SAMPLE_SCAN_ROWS = 1000  # сколько первых строк просматривать для примеров значений
+SAMPLE_VALUES = 3
+STATS_COLUMNS_PER_QUERY = 200
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IDENT = r'"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|[^\W\d]\w*'
+_IDENT_RE = re.compile(_IDENT)
+_TOKEN_RE = re.compile(rf"{_IDENT}|\d\w*|\S")
+# Ключевые слова, которыми заканчивается список источников FROM
+_FROM_END = {"where", "group", "order", "limit", "having", "window", "union", "intersect", "except",
+             "select", "values", "returning"}
+_NOT_ALIAS = {"where", "join", "on", "using", "left", "right", "inner", "outer", "cross", "natural",
+              "full", "group", "order", "limit", "having", "union", "except", "intersect", "window",
+              "indexed", "not"}
+
+def quote_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def clean_table_name(name):
+    # Только латиница, цифры, подчёркивания
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def is_internal_table(name):
+    return name.startswith(INTERNAL_PREFIX) or name.startswith("sqlite_")
+
+def ensure_catalog(conn):
+    # Соединение только для чтения (пул сервиса) создавать ничего не может: каталог
+    # читается из файла базы, где его заранее построил импорт
+    if conn.execute("PRAGMA query_only").fetchone()[0]:
+        return
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLES} ("
+        "table_name TEXT PRIMARY KEY, row_count INTEGER, column_count INTEGER, "
+        "version INTEGER NOT NULL DEFAULT 0, updated_at TEXT)"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_COLUMNS} ("
+        "table_name TEXT, position INTEGER, column_name TEXT, inferred_type TEXT, "
+        "null_count INTEGER, distinct_count INTEGER, min_value, max_value, sample_values TEXT, "
+        "PRIMARY KEY (table_name, position))"
+    )
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {CATALOG_DATABASE} (key TEXT PRIMARY KEY, value TEXT)")
+    if conn.execute(f"SELECT 1 FROM {CATALOG_DATABASE} WHERE key = 'database_id'").fetchone() is None:
+        # Версии таблиц в новой базе снова начинаются с 1: идентификатор отличает её
+        # от удалённой прежней (ключи кэша результатов)
+        insert = (f"INSERT OR IGNORE INTO {CATALOG_DATABASE} VALUES ('database_id', ?)", (uuid.uuid4().hex,))
+        if conn.in_transaction:
+            conn.execute(*insert)
+        else:
+            with conn:
+                conn.execute(*insert)
+
+def _column_type(conn, table_name, column, declared):
+    if declared:
+        return declared.upper()
+    row = conn.execute(
+        f"SELECT typeof({quote_ident(column)}) FROM {quote_ident(table_name)} "
+        f"WHERE {quote_ident(column)} IS NOT NULL LIMIT 1"
+    ).fetchone()
+    return row[0].upper() if row else "NULL"
+
+def refresh_catalog(conn, table_name):
+    """
+    Пересчитывает метаданные таблицы (столбцы, типы, число строк, статистику по
+    столбцам) агрегирующими запросами SQLite и увеличивает её версию.
+    Вызывается при каждом импорте.
+    """
+    ensure_catalog(conn)
+    info = conn.execute(f"PRAGMA table_info({quote_ident(table_name)})").fetchall()
+    columns = [(row[1], row[2]) for row in info]
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table_name)}").fetchone()[0]
+    stats = []
+    # SQLite ограничивает число выражений в SELECT, поэтому широкие таблицы — группами столбцов
+    for start in range(0, len(columns), STATS_COLUMNS_PER_QUERY):
+        aggregates = []
+        for name, _ in columns[start:start + STATS_COLUMNS_PER_QUERY]:
+            c = quote_ident(name)
+            aggregates += [f"COUNT({c})", f"COUNT(DISTINCT {c})", f"MIN({c})", f"MAX({c})"]
+        stats += conn.execute(f"SELECT {', '.join(aggregates)} FROM {quote_ident(table_name)}").fetchone()
+
+    conn.execute(f"DELETE FROM {CATALOG_COLUMNS} WHERE table_name = ?", (table_name,))
+    for pos, (name, declared) in enumerate(columns):
+        non_null, distinct, min_value, max_value = stats[4 * pos: 4 * pos + 4]
+        samples = [r[0] for r in conn.execute(
+            f"SELECT DISTINCT v FROM (SELECT {quote_ident(name)} AS v FROM {quote_ident(table_name)} "
+            f"LIMIT {SAMPLE_SCAN_ROWS}) WHERE v IS NOT NULL LIMIT {SAMPLE_VALUES}"
+        )]
+        conn.execute(
+            f"INSERT INTO {CATALOG_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (table_name, pos, name, _column_type(conn, table_name, name, declared),
+             row_count - non_null, distinct, min_value, max_value,
+             json.dumps(samples, ensure_ascii=False, default=str)),
+        )
+    conn.execute(
+        f"INSERT INTO {CATALOG_TABLES} (table_name, row_count, column_count, version, updated_at) "
+        "VALUES (?, ?, ?, 1, ?) ON CONFLICT(table_name) DO UPDATE SET "
+        "row_count = excluded.row_count, column_count = excluded.column_count, "
+        "version = version + 1, updated_at = excluded.updated_at",
+        (table_name, row_count, len(columns), datetime.datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+
+def drop_from_catalog(conn, table_name):
+    ensure_catalog(conn)
+    conn.execute(f"DELETE FROM {CATALOG_COLUMNS} WHERE table_name = ?", (table_name,))
+    conn.execute(f"DELETE FROM {CATALOG_TABLES} WHERE table_name = ?", (table_name,))
+    conn.commit()
+
+def load_catalog(conn, table_name, build_missing=True):
+    """
+    Метаданные таблицы из каталога: {"table_name", "row_count", "column_count", "version",
+    "updated_at", "columns": [{"name", "type", "null_count", "distinct_count", "min", "max",
+    "samples"}, ...]}. Если таблица ещё не в каталоге (импорт до появления каталога),
+    каталог строится один раз при build_missing=True, иначе возвращается None.
+    """
+    try:
+        row = conn.execute(
+            f"SELECT table_name, row_count, column_count, version, updated_at FROM {CATALOG_TABLES} "
+            "WHERE table_name = ?", (table_name,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is None:
+        if not build_missing:
+            return None
+        refresh_catalog(conn, table_name)
+        print(f"Каталог для таблицы '{table_name}' построен.")
+        return load_catalog(conn, table_name, build_missing=False)
+    columns = [
+        {"name": r[0], "type": r[1], "null_count": r[2], "distinct_count": r[3],
+         "min": r[4], "max": r[5], "samples": json.loads(r[6]) if r[6] else []}
+        for r in conn.execute(
+            f"SELECT column_name, inferred_type, null_count, distinct_count, min_value, max_value, "
+            f"sample_values FROM {CATALOG_COLUMNS} WHERE table_name = ? ORDER BY position",
+            (table_name,),
+        )
+    ]
+    return {"table_name": row[0], "row_count": row[1], "column_count": row[2],
+            "version": row[3], "updated_at": row[4], "columns": columns}
+
+def unquote_ident(name):
+    if name[0] in '"`[':
+        return name[1:-1].replace('""', '"')
+    return name
+
+def parse_sources(sql):
+    """
+    Источники запроса [(таблица, псевдоним или None)]: имена после FROM и JOIN, включая
+    перечисление через запятую (FROM a, b) и подзапросы на любой глубине скобок.
+    Имя со схемой возвращается как "схема.таблица".
+    """
+    tokens = _TOKEN_RE.findall(_STRING_RE.sub("''", sql))
+    sources = []
+    in_from = [False]  # по уровням скобок: идёт ли список источников FROM
+    expect = None  # "table" — ждём имя источника, "alias" — его псевдоним, "part" — имя после схемы
+    for tok in tokens:
+        ident = _IDENT_RE.fullmatch(tok) is not None
+        word = tok.lower() if ident and tok[0] not in '"`[' else None
+        if tok == "(":
+            in_from.append(False)
+            expect = None
+        elif tok == ")":
+            if len(in_from) > 1:
+                in_from.pop()
+            expect = None
+        elif word in ("from", "join"):
+            in_from[-1] = True
+            expect = "table"
+        elif word in _FROM_END:
+            in_from[-1] = False
+            expect = None
+        elif tok == "," and in_from[-1]:
+            expect = "table"
+        elif expect == "table":
+            if ident:
+                sources.append([unquote_ident(tok), None])
+            expect = "alias" if ident else None
+        elif expect == "part":
+            sources[-1][0] += unquote_ident(tok) if ident else ""
+            expect = "alias"
+        elif expect == "alias":
+            if tok == ".":
+                sources[-1][0] += "."
+                expect = "part"
+            elif word != "as":
+                if ident and word not in _NOT_ALIAS:
+                    sources[-1][1] = unquote_ident(tok)
+                expect = None
+    return [tuple(source) for source in sources]
+
+def query_sources(sql):
+    """
+    {имя или псевдоним в запросе: таблица} по FROM/JOIN запроса.
+    """
+    sources = {}
+    for table, alias in parse_sources(sql):
+        sources.setdefault(table, table)
+        if alias:
+            sources[alias] = table
+    return sources
+
+def source_tables(sql):
+    """
+    Все таблицы (и другие источники: CTE, табличные функции) из FROM/JOIN запроса по порядку.
+    """
+    return list(dict.fromkeys(table for table, _ in parse_sources(sql)))
+
+def referenced_tables(conn, sql):
+    """
+    Таблицы из каталога, упомянутые в FROM/JOIN запроса.
+    """
+    ensure_catalog(conn)
+    known = {r[0] for r in conn.execute(f"SELECT table_name FROM {CATALOG_TABLES}")}
+    return [t for t in source_tables(sql) if t in known]
+
+def database_identity(conn):
+    """
+    (файл базы с каталогом, идентификатор базы). Идентификатор None, если база создана
+    до его появления и с тех пор открывалась только для чтения.
+    """
+    # Первая база с файлом: main, а у соединения с таблицами в памяти — подключённый файл
+    path = next((r[2] for r in conn.execute("PRAGMA database_list") if r[1] != "temp" and r[2]), "")
+    try:
+        row = conn.execute(f"SELECT value FROM {CATALOG_DATABASE} WHERE key = 'database_id'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return path, row[0] if row else None
+
+def table_versions(conn, tables):
+    """
+    {таблица: версия} по каталогу; версия растёт при каждом импорте таблицы.
+    """
+    if not tables:
+        return {}
+    ensure_catalog(conn)
+    marks = ", ".join("?" * len(tables))
+    return dict(conn.execute(
+        f"SELECT table_name, version FROM {CATALOG_TABLES} WHERE table_name IN ({marks})", list(tables)
+    ).fetchall())
+
+def catalog_columns(conn, table_name):
+    return [c["name"] for c in load_catalog(conn, table_name)["columns"]]
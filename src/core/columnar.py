@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from core.catalog import quote_ident, table_versions
+from core.inference import compact_frame, schema_from_table
+
+# Колоночный кэш таблиц рядом с базой: <каталог базы>/columnar/<таблица>/v<версия>/,
+# по файлу .npy на столбец. Строки и прочие object-столбцы кодируются словарём
+# (коды int32 в .npy + значения в JSON). Версия совпадает с версией таблицы в каталоге,
+# поэтому после переимпорта устаревший кэш не используется.
+COLUMNAR_ENABLED = os.getenv("COLUMNAR_CACHE", "1").lower() not in ("0", "no", "off", "false")
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", "columnar")
+META_FILE = "meta.json"
+
+def database_file(conn):
+    """
+    Путь к файлу основной базы соединения ("" для базы в памяти).
+    """
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+def table_dir(db_path, table_name):
+    safe = re.sub(r"[^\w.-]", "_", table_name)[:64]
+    digest = hashlib.sha1(table_name.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), COLUMNAR_DIR, f"{safe}-{digest}")
+
+def _json_value(value):
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating,)):
+        return float(value)
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def write_sidecar(conn, table_name, df=None, db_path=None):
+    """
+    Записывает колоночный кэш таблицы для её текущей версии в каталоге. df — уже
+    загруженные данные (например, при импорте из DataFrame), иначе таблица читается из базы.
+    Старые версии удаляются. Возвращает каталог кэша или None.
+    """
+    if not COLUMNAR_ENABLED:
+        return None
+    db_path = db_path or database_file(conn)
+    version = table_versions(conn, [table_name]).get(table_name)
+    if not db_path or version is None:
+        return None
+    if df is None:
+        df = pd.read_sql_query(f"SELECT * FROM {quote_ident(table_name)}", conn)
+        df = compact_frame(df, schema_from_table(conn, table_name))
+    base = table_dir(db_path, table_name)
+    target = os.path.join(base, f"v{version}")
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        if isinstance(col.dtype, np.dtype) and col.dtype.kind in "biufM":
+            np.save(os.path.join(tmp, f"{i}.npy"), np.ascontiguousarray(col.to_numpy()))
+            columns.append({"name": name, "file": f"{i}.npy", "encoding": "plain"})
+        else:
+            codes, uniques = pd.factorize(col, use_na_sentinel=True)
+            np.save(os.path.join(tmp, f"{i}.npy"), codes.astype(np.int32))
+            with open(os.path.join(tmp, f"{i}.dict.json"), "w", encoding="utf-8") as f:
+                json.dump([_json_value(v) for v in uniques], f, ensure_ascii=False)
+            columns.append({"name": name, "file": f"{i}.npy", "encoding": "dictionary",
+                            "dictionary": f"{i}.dict.json"})
+    with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"table": table_name, "version": version, "rows": len(df), "columns": columns},
+                  f, ensure_ascii=False)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    for entry in os.listdir(base):
+        if entry != os.path.basename(target):
+            shutil.rmtree(os.path.join(base, entry), ignore_errors=True)
+    return target
+
+def read_meta(db_path, table_name, version):
+    """
+    Метаданные кэша для версии таблицы или None, если кэша этой версии нет.
+    """
+    path = os.path.join(table_dir(db_path, table_name), f"v{version}", META_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == version else None
+
+def load_sidecar(db_path, table_name, version, columns=None):
+    """
+    DataFrame из кэша с отображением файлов в память (mmap copy-on-write, файлы не меняются):
+    данные читаются с диска только при обращении. columns — проекция (открываются только
+    нужные столбцы). Строковые столбцы возвращаются как Categorical. None, если кэша нет.
+    """
+    meta = read_meta(db_path, table_name, version)
+    if meta is None:
+        return None
+    folder = os.path.join(table_dir(db_path, table_name), f"v{version}")
+    by_name = {c["name"]: c for c in meta["columns"]}
+    wanted = list(by_name) if columns is None else list(columns)
+    missing = [c for c in wanted if c not in by_name]
+    if missing:
+        raise KeyError(f"Нет столбцов в таблице '{table_name}': {', '.join(missing)}")
+    data = {}
+    for name in wanted:
+        col = by_name[name]
+        values = np.load(os.path.join(folder, col["file"]), mmap_mode="c")
+        if col["encoding"] == "dictionary":
+            with open(os.path.join(folder, col["dictionary"]), encoding="utf-8") as f:
+                categories = pd.Index(json.load(f), dtype=object)
+            values = pd.Categorical.from_codes(values, categories=categories)
+        data[name] = values
+    return pd.DataFrame(data, copy=False) if data else pd.DataFrame(index=range(meta["rows"]))
+
+def drop_sidecar(db_path, table_name):
+    if not db_path:
+        return
+    shutil.rmtree(table_dir(db_path, table_name), ignore_errors=True)
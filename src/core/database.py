@@ -1,22 +1,153 @@
 import pandas as pd
 import sqlite3
 import ntpath  # для обработки путей к файлам
+import os
+import time
+import datetime
+import re
+import queue
+import hashlib
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from core.catalog import INTERNAL_PREFIX, quote_ident, is_internal_table, refresh_catalog, table_versions
+from core import tracing, columnar, inference, sampling
 
 DB_PATH = "main.db"
 
+# Потоковый импорт CSV: размер чанка и PRAGMA для массовой вставки
+CSV_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "50000"))
+IMPORT_PRAGMAS = {
+    "journal_mode": os.getenv("IMPORT_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("IMPORT_SYNCHRONOUS", "OFF"),
+    "cache_size": int(os.getenv("IMPORT_CACHE_SIZE", "-65536")),  # отрицательное — в КиБ
+    "temp_store": "MEMORY",
+}
+
+# Чтение базы: отображение файла в память и кэш страниц соединения (байты; КиБ со знаком минус)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 2 ** 20)))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-131072"))
+
+# Параллельный импорт Excel: листы разбираются в пуле процессов (openpyxl read-only)
+EXCEL_STREAM_EXTENSIONS = ['xlsx', 'xlsm']
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(os.cpu_count() or 1)))
+EXCEL_BATCH_ROWS = int(os.getenv("IMPORT_EXCEL_BATCH_ROWS", "5000"))
+
+def tune_connection(conn, schema="main"):
+    """
+    mmap и кэш страниц для базы schema соединения: повторные запросы читают страницы
+    из памяти, а не с диска.
+    """
+    conn.execute(f"PRAGMA {schema}.mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA {schema}.cache_size = {DB_CACHE_SIZE}")
+    return conn
+
+def connect(db_path=DB_PATH, **kwargs):
+    return tune_connection(sqlite3.connect(db_path, **kwargs))
+
 def list_tables_from_db(db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
-    tables = df['name'].tolist()
+    conn = connect(db_path)
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY rowid;").fetchall()
     conn.close()
-    return tables
+    return [r[0] for r in rows if not is_internal_table(r[0])]
+
+class ReadOnlyPool:
+    """
+    Пул соединений SQLite только для чтения (URI mode=ro и PRAGMA query_only) для
+    обработки запросов из нескольких потоков: соединение выдаётся одному потоку за раз.
+    """
+    schema = "main"  # под каким именем файл базы виден в соединениях пула
+
+    def __init__(self, db_path=DB_PATH, size=4):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+        conn = tune_connection(sqlite3.connect(uri, uri=True, check_same_thread=False))
+        conn.execute("PRAGMA query_only = ON")
+        return conn
 
-def load_tables_from_db(table_names, db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                conn = self._connect() if len(self._all) < self.size else None
+                if conn is not None:
+                    self._all.append(conn)
+            if conn is None:
+                conn = self._idle.get(timeout=timeout)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+_deadlines = {}  # id(conn) -> [(срок, событие отмены), ...] активных sql_deadline
+
+def _interrupt_requested(stack):
+    now = time.monotonic()
+    return int(any(now > end or (cancel is not None and cancel.is_set()) for end, cancel in stack))
+
+@contextlib.contextmanager
+def sql_deadline(conn, seconds, check_every=10000, cancel=None):
+    """
+    Прерывает выполнение SQL на соединении через seconds секунд или по событию cancel
+    (threading.Event): обработчик прогресса SQLite вызывается каждые check_every инструкций
+    и останавливает запрос (interrupted). Вложенные вызовы действуют одновременно —
+    у соединения один обработчик, он проверяет все активные сроки.
+    """
+    if not seconds and cancel is None:
+        yield
+        return
+    entry = (time.monotonic() + seconds if seconds else float("inf"), cancel)
+    stack = _deadlines.setdefault(id(conn), [])
+    stack.append(entry)
+    conn.set_progress_handler(lambda: _interrupt_requested(stack), check_every)
+    try:
+        yield
+    finally:
+        stack.remove(entry)
+        if not stack:
+            del _deadlines[id(conn)]
+            conn.set_progress_handler(None, 0)
+
+def load_tables_from_db(table_names, db_path=DB_PATH, columns=None, use_columnar=True):
+    """
+    Загрузка таблиц в DataFrame — только по требованию (pandas-обработка, экспорт).
+    Если есть колоночный кэш текущей версии таблицы, столбцы отображаются из него в память
+    (columns — проекция); иначе таблица читается из SQLite и кэш дописывается.
+    """
+    conn = connect(db_path)
     dfs = []
     for t in table_names:
-        df = pd.read_sql_query(f"SELECT * FROM '{t}'", conn)
-        dfs.append(df)
+        with tracing.span("load.table", table=t) as s:
+            df = None
+            version = table_versions(conn, [t]).get(t) if use_columnar and columnar.COLUMNAR_ENABLED else None
+            if version is not None:
+                df = columnar.load_sidecar(db_path, t, version, columns)
+            s.set(columnar=df is not None)
+            if df is None:
+                cols = ", ".join(quote_ident(c) for c in columns) if columns else "*"
+                df = pd.read_sql_query(f"SELECT {cols} FROM {quote_ident(t)}", conn)
+                df = inference.compact_frame(df, inference.schema_from_table(conn, t))
+                if version is not None and columns is None:
+                    columnar.write_sidecar(conn, t, df, db_path)
+            s.set(rows=len(df))
+        dfs.append(inference.widen_integers(df))
     conn.close()
     return dfs
 
@@ -24,16 +155,267 @@ def table_exists(cursor, table_name):
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
     return cursor.fetchone() is not None
 
-def write_to_sql(conn, df, table_name):
+def confirm_overwrite(cursor, table_name, override_existing=False):
+    if override_existing or not table_exists(cursor, table_name):
+        return True
+    override = input(f"Таблица '{table_name}' уже существует. Перезаписать? [Y/N]: ").strip().lower()
+    if override not in ['y', 'yes', 'да']:
+        print(f"Пропущено: {table_name}")
+        return False
+    return True
+
+@tracing.traced("import.dataframe")
+def write_to_sql(conn, df, table_name, override_existing=False):
     cursor = conn.cursor()
-    if table_exists(cursor, table_name):
-        override = input(f"Таблица '{table_name}' уже существует. Перезаписать? [Y/N]: ").strip().lower()
-        if override not in ['y', 'yes', 'да']:
-            print(f"Пропущено: {table_name}")
-            return
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
+    if not confirm_overwrite(cursor, table_name, override_existing):
+        return
+    schema = inference.infer_schema(df)
+    df = inference.apply_schema(df, schema)
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+        conn.execute(inference.create_table_sql(table_name, schema))
+        insert_chunk(conn, df, table_name, inference.date_columns(schema))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    refresh_catalog(conn, table_name)
+    columnar.write_sidecar(conn, table_name, df)
+    sampling.refresh_samples(conn, table_name)
     print(f"Таблица '{table_name}' успешно записана.")
 
+def apply_import_pragmas(conn, pragmas=None):
+    for name, value in (pragmas or IMPORT_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+def dataframe_rows(df, date_columns=()):
+    """
+    Строки DataFrame как кортежи Python-значений для executemany (NaN -> NULL).
+    Даты пишутся ISO-строками; столбцы из date_columns — без времени.
+    """
+    out = df.astype(object).where(df.notna(), None)
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            fmt = "%Y-%m-%d" if col in date_columns else "%Y-%m-%d %H:%M:%S"
+            out[col] = df[col].dt.strftime(fmt).astype(object).where(df[col].notna(), None)
+    return out.itertuples(index=False, name=None)
+
+def insert_chunk(conn, df, table_name, date_columns=()):
+    placeholders = ", ".join("?" * len(df.columns))
+    columns = ", ".join(quote_ident(c) for c in df.columns)
+    conn.executemany(
+        f"INSERT INTO {quote_ident(table_name)} ({columns}) VALUES ({placeholders})",
+        dataframe_rows(df, date_columns),
+    )
+
+@tracing.traced("import.csv", lambda rows: {"rows": rows})
+def import_csv_streaming(conn, file_path, table_name, chunksize=CSV_CHUNK_SIZE, override_existing=False):
+    """
+    Потоковый импорт CSV: файл читается чанками по `chunksize` строк, таблица создаётся
+    один раз с типами, определёнными по первому чанку (core.inference), каждый чанк
+    приводится к ним и вставляется через executemany в одной транзакции.
+    Пиковая память ограничена размером чанка. Возвращает число записанных строк.
+    """
+    if not confirm_overwrite(conn.cursor(), table_name, override_existing):
+        return 0
+    if conn.in_transaction:
+        conn.commit()
+    apply_import_pragmas(conn)
+
+    started = time.perf_counter()
+    total = 0
+    schema = None
+    try:
+        reader = pd.read_csv(file_path, chunksize=chunksize)
+    except pd.errors.EmptyDataError:
+        print(f"CSV файл пустой, импорт '{table_name}' пропущен.")
+        return 0
+    conn.execute("BEGIN")
+    try:
+        for chunk in reader:
+            if chunk.empty:
+                # Файл только с заголовком: существующая таблица остаётся как есть
+                continue
+            if schema is None:
+                schema = inference.infer_schema(chunk)
+                conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+                conn.execute(inference.create_table_sql(table_name, schema))
+            insert_chunk(conn, inference.apply_schema(chunk, schema), table_name, inference.date_columns(schema))
+            total += len(chunk)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    if total == 0:
+        print(f"CSV файл пустой, импорт '{table_name}' пропущен.")
+        return 0
+    refresh_catalog(conn, table_name)
+    # Колоночный кэш не строится здесь (это чтение всей таблицы в память): его пересоздаст
+    # первая загрузка таблицы в load_tables_from_db
+    columnar.drop_sidecar(columnar.database_file(conn), table_name)
+    sampling.refresh_samples(conn, table_name)
+    print(f"Таблица '{table_name}' успешно записана: {total} строк за {elapsed:.2f} с "
+          f"({total / max(elapsed, 1e-9):,.0f} строк/с).")
+    return total
+
+# ---- Инкрементальный импорт: применяются только изменившиеся строки ----
+
+STAGING_TABLE = f"{INTERNAL_PREFIX}staging"
+KEY_NAME_RE = re.compile(r"(^|_)(id|key|код|номер|uuid|guid)$|^(id|код|номер)", re.I)
+KEY_CANDIDATES_MAX = 5
+
+def table_columns(conn, table_name):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({quote_ident(table_name)})")]
+
+def is_unique_key(conn, table_name, column):
+    total, distinct, non_null = conn.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT {quote_ident(column)}), COUNT({quote_ident(column)}) "
+        f"FROM {quote_ident(table_name)}"
+    ).fetchone()
+    return total == distinct == non_null
+
+def detect_key_column(conn, table_name, staging, columns):
+    """
+    Ключ для сопоставления строк: столбец без NULL и повторов и в новой, и в текущей
+    таблице. Сначала проверяются столбцы с «ключевыми» именами (id, код, номер...),
+    затем первые столбцы таблицы. None — ключа нет, строки сравниваются по хэшу.
+    """
+    named = [c for c in columns if KEY_NAME_RE.search(str(c))]
+    candidates = named + [c for c in columns[:KEY_CANDIDATES_MAX] if c not in named]
+    for column in candidates:
+        if is_unique_key(conn, staging, column) and is_unique_key(conn, table_name, column):
+            return column
+    return None
+
+def _apply_keyed_delta(conn, table_name, staging, columns, key):
+    t, s, k = quote_ident(table_name), quote_ident(staging), quote_ident(key)
+    cols = ", ".join(quote_ident(c) for c in columns)
+    target_row = ", ".join(f"{t}.{quote_ident(c)}" for c in columns)
+    staged_row = ", ".join(f"s.{quote_ident(c)}" for c in columns)
+    conn.execute(f"CREATE INDEX temp.{quote_ident(staging + '_key')} ON {s} ({k})")
+    deleted = conn.execute(f"DELETE FROM {t} WHERE {k} NOT IN (SELECT {k} FROM {s})").rowcount
+    updated = conn.execute(
+        f"UPDATE {t} SET ({cols}) = (SELECT {staged_row} FROM {s} AS s WHERE s.{k} = {t}.{k}) "
+        f"WHERE EXISTS (SELECT 1 FROM {s} AS s WHERE s.{k} = {t}.{k} AND ({target_row}) IS NOT ({staged_row}))"
+    ).rowcount
+    inserted = conn.execute(
+        f"INSERT INTO {t} ({cols}) SELECT {cols} FROM {s} WHERE {k} NOT IN (SELECT {k} FROM {t})"
+    ).rowcount
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+def _row_digest(values):
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+
+def _apply_hashed_delta(conn, table_name, staging, columns):
+    """
+    Без ключа строки сравниваются целиком по хэшу: совпавшие (с учётом повторов)
+    остаются, лишние удаляются, новые добавляются. Изменённая строка — удаление + вставка.
+    """
+    t, s = quote_ident(table_name), quote_ident(staging)
+    cols = ", ".join(quote_ident(c) for c in columns)
+    existing = {}
+    for rowid, *values in conn.execute(f"SELECT rowid, {cols} FROM {t}"):
+        existing.setdefault(_row_digest(values), []).append(rowid)
+    new_rowids = []
+    for rowid, *values in conn.execute(f"SELECT rowid, {cols} FROM {s}"):
+        bucket = existing.get(_row_digest(values))
+        if bucket:
+            bucket.pop()
+        else:
+            new_rowids.append((rowid,))
+    stale = [(rowid,) for bucket in existing.values() for rowid in bucket]
+    conn.executemany(f"DELETE FROM {t} WHERE rowid = ?", stale)
+    conn.executemany(f"INSERT INTO {t} ({cols}) SELECT {cols} FROM {s} WHERE rowid = ?", new_rowids)
+    return {"inserted": len(new_rowids), "updated": 0, "deleted": len(stale)}
+
+@tracing.traced("import.incremental", lambda counts: counts)
+def import_incremental(conn, chunks, table_name, key=None):
+    """
+    Инкрементальный импорт из последовательности DataFrame (чанки CSV или один лист):
+    данные загружаются во временную таблицу, затем к существующей таблице в одной
+    транзакции применяются только вставки, изменения и удаления. key — столбец-ключ
+    (по умолчанию определяется автоматически, без ключа — сравнение строк по хэшу).
+    Новая таблица просто создаётся. Возвращает счётчики изменений; вопросов не задаёт.
+    """
+    started = time.perf_counter()
+    if conn.in_transaction:
+        conn.commit()
+    apply_import_pragmas(conn)
+    cursor = conn.cursor()
+    exists = table_exists(cursor, table_name)
+    target = table_name if not exists else STAGING_TABLE
+    columns = None
+    schema = None
+    total = 0
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{quote_ident(STAGING_TABLE)}")
+        for chunk in chunks:
+            if columns is None:
+                columns = list(chunk.columns)
+                if not exists:
+                    schema = inference.infer_schema(chunk)
+                    conn.execute(inference.create_table_sql(table_name, schema))
+                else:
+                    current = table_columns(conn, table_name)
+                    if [str(c) for c in columns] != current:
+                        raise ValueError(
+                            f"Столбцы файла не совпадают с таблицей '{table_name}' — нужен полный импорт"
+                        )
+                    # Временная таблица с теми же типами столбцов, что и у целевой
+                    conn.execute(f"CREATE TEMP TABLE {quote_ident(STAGING_TABLE)} AS "
+                                 f"SELECT * FROM {quote_ident(table_name)} WHERE 0")
+                    # Значения приводятся так же, как при первом импорте, иначе сравнение строк не сойдётся
+                    schema = inference.schema_from_table(conn, table_name)
+            insert_chunk(conn, inference.apply_schema(chunk, schema), target, inference.date_columns(schema))
+            total += len(chunk)
+        # Пустой файл или только заголовок не означает «удалить все строки» — таблица не меняется
+        if columns is None or (exists and total == 0):
+            conn.rollback()
+            print(f"Нет данных, импорт '{table_name}' пропущен.")
+            return {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        if not exists:
+            counts = {"inserted": total, "updated": 0, "deleted": 0}
+            key = None
+        else:
+            if key is not None and not is_unique_key(conn, STAGING_TABLE, key):
+                raise ValueError(f"Столбец '{key}' не подходит как ключ: есть пустые или повторяющиеся значения")
+            key = key or detect_key_column(conn, table_name, STAGING_TABLE, columns)
+            if key is not None:
+                counts = _apply_keyed_delta(conn, table_name, STAGING_TABLE, columns, key)
+            else:
+                counts = _apply_hashed_delta(conn, table_name, STAGING_TABLE, columns)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{quote_ident(STAGING_TABLE)}")
+    counts["unchanged"] = total - counts["inserted"] - counts["updated"]
+    changed = counts["inserted"] + counts["updated"] + counts["deleted"]
+    # Без изменений версия таблицы не растёт — кэши результатов остаются действительными.
+    # Колоночный кэш после изменений пересоздаётся при первой загрузке таблицы
+    if changed:
+        refresh_catalog(conn, table_name)
+        columnar.drop_sidecar(columnar.database_file(conn), table_name)
+        sampling.refresh_samples(conn, table_name)
+    elapsed = time.perf_counter() - started
+    print(f"Таблица '{table_name}': добавлено {counts['inserted']}, изменено {counts['updated']}, "
+          f"удалено {counts['deleted']}, без изменений {counts['unchanged']} "
+          f"(сопоставление: {'по ключу ' + key if key else 'по хэшу строк' if exists else 'новая таблица'}, "
+          f"{elapsed:.2f} с).")
+    return counts
+
+def import_csv_incremental(conn, file_path, table_name, key=None, chunksize=CSV_CHUNK_SIZE):
+    return import_incremental(conn, pd.read_csv(file_path, chunksize=chunksize), table_name, key)
+
+def write_incremental(conn, df, table_name, key=None):
+    return import_incremental(conn, [df], table_name, key)
+
 def sanitize_path(path: str) -> str:
     return path.strip().strip('"').strip("'")
 
@@ -45,15 +427,17 @@ def import_file_to_db(file_path, db_path=DB_PATH):
 
     try:
         conn = sqlite3.connect(db_path)
-        if ext in ['xlsx', 'xls', 'xlsm', 'xlsb', 'odf', 'ods', 'odt']:
+        if ext in EXCEL_STREAM_EXTENSIONS:
+            sheets = excel_sheet_names(file_path)
+            import_excel_parallel(conn, file_path, {s: f"{name}_{s}" for s in sheets})
+        elif ext in ['xls', 'xlsb', 'odf', 'ods', 'odt']:
             xls = pd.ExcelFile(file_path, engine='openpyxl')
             for sheet in xls.sheet_names:
                 df = xls.parse(sheet)
                 table_name = f"{name}_{sheet}"
                 write_to_sql(conn, df, table_name)
         elif ext == 'csv':
-            df = pd.read_csv(file_path)
-            write_to_sql(conn, df, name)
+            import_csv_streaming(conn, file_path, name)
         else:
             print("Неподдерживаемое расширение файла:", ext)
             return
@@ -63,6 +447,165 @@ def import_file_to_db(file_path, db_path=DB_PATH):
     except Exception as e:
         print("Ошибка при импорте файла:", e)
 
+# ---- Параллельный потоковый импорт Excel ----
+
+_sheet_queue = None
+
+def _init_sheet_worker(q):
+    global _sheet_queue
+    _sheet_queue = q
+
+def _cell_value(v):
+    if isinstance(v, (datetime.datetime, datetime.date, datetime.time)):
+        return v.isoformat(sep=" ") if isinstance(v, datetime.datetime) else v.isoformat()
+    if isinstance(v, datetime.timedelta):
+        return str(v)
+    return v
+
+def _sheet_columns(header):
+    columns, seen = [], {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or str(name).strip() == "" else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+def _parse_sheet(file_path, sheet_name, table_name, batch_rows):
+    """
+    Воркер: читает лист в read-only режиме openpyxl и отправляет строки пачками
+    писателю через очередь. Лист целиком в память не загружается.
+    """
+    from openpyxl import load_workbook
+    q = _sheet_queue
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            q.put(("done", table_name, 0))
+            return
+        columns = _sheet_columns(header)
+        width = len(columns)
+        q.put(("header", table_name, columns))
+        batch, count = [], 0
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            row = tuple(_cell_value(v) for v in row[:width])
+            batch.append(row + (None,) * (width - len(row)))
+            if len(batch) >= batch_rows:
+                q.put(("rows", table_name, batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            q.put(("rows", table_name, batch))
+            count += len(batch)
+        q.put(("done", table_name, count))
+    except Exception as e:
+        q.put(("error", table_name, f"{type(e).__name__}: {e}"))
+    finally:
+        wb.close()
+
+def excel_sheet_names(file_path):
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _write_sheet_messages(conn, q, futures):
+    """
+    Писатель: принимает из очереди заголовки и пачки строк от воркеров и вставляет
+    их в SQLite, пока все листы не будут разобраны. Типы столбцов определяются по
+    первой пачке листа (core.inference). Возвращает {таблица: строк}.
+    """
+    columns, schemas, counts = {}, {}, {}
+    pending = len(futures)
+    while pending:
+        try:
+            kind, table, payload = q.get(timeout=1)
+        except queue.Empty:
+            for f in futures:
+                if f.done() and f.exception() is not None:
+                    raise f.exception()
+            continue
+        if kind == "header":
+            columns[table] = payload
+        elif kind == "rows":
+            chunk = pd.DataFrame.from_records(payload, columns=range(len(columns[table])))
+            if table not in counts:
+                schemas[table] = inference.infer_schema(chunk)
+                conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+                conn.execute(inference.create_table_sql(table, dict(zip(columns[table], schemas[table].values()))))
+                counts[table] = 0
+            schema = schemas[table]
+            placeholders = ", ".join("?" * len(columns[table]))
+            conn.executemany(f"INSERT INTO {quote_ident(table)} VALUES ({placeholders})",
+                             dataframe_rows(inference.apply_schema(chunk, schema), inference.date_columns(schema)))
+            counts[table] += len(payload)
+        elif kind == "done":
+            pending -= 1
+            if payload:
+                print(f"Таблица '{table}' успешно записана: {payload} строк.")
+            else:
+                print(f"Пропущен пустой лист для таблицы '{table}'")
+        elif kind == "error":
+            raise RuntimeError(f"Ошибка разбора листа для '{table}': {payload}")
+    return counts
+
+@tracing.traced("import.excel", lambda counts: {"rows": sum(counts.values()), "sheets": len(counts)})
+def import_excel_parallel(conn, file_path, table_names, max_workers=IMPORT_WORKERS, override_existing=False):
+    """
+    Импорт листов Excel: листы разбираются параллельно в пуле процессов, строки
+    через очередь попадают к единственному писателю SQLite (текущее соединение).
+    table_names: {имя листа: имя таблицы}. Возвращает {имя таблицы: число строк}.
+    """
+    cursor = conn.cursor()
+    sheets = {s: t for s, t in table_names.items() if confirm_overwrite(cursor, t, override_existing)}
+    if not sheets:
+        return {}
+    if conn.in_transaction:
+        conn.commit()
+    apply_import_pragmas(conn)
+
+    started = time.perf_counter()
+    workers = max(1, min(max_workers, len(sheets)))
+    q = multiprocessing.Queue(maxsize=workers * 4)
+    conn.execute("BEGIN")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sheet_worker, initargs=(q,)) as pool:
+            futures = [pool.submit(_parse_sheet, file_path, s, t, EXCEL_BATCH_ROWS) for s, t in sheets.items()]
+            try:
+                counts = _write_sheet_messages(conn, q, futures)
+            except BaseException:
+                # Разблокируем воркеры, ждущие места в очереди, иначе пул не завершится
+                for f in futures:
+                    f.cancel()
+                while not all(f.done() for f in futures):
+                    try:
+                        q.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                raise
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for table in counts:
+        refresh_catalog(conn, table)
+        columnar.drop_sidecar(columnar.database_file(conn), table)  # пересоздаётся при загрузке
+        sampling.refresh_samples(conn, table)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Импорт Excel: {len(counts)} лист(ов), {total} строк за {elapsed:.2f} с "
+          f"({total / max(elapsed, 1e-9):,.0f} строк/с, процессов: {workers}).")
+    return counts
+
 # Пример использования:
 if __name__ == "__main__":
     import sys
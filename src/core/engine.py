@@ -0,0 +1,188 @@
+import contextlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from core.catalog import CATALOG_TABLES, INTERNAL_PREFIX, is_internal_table, quote_ident
+from core.database import DB_PATH, ReadOnlyPool, tune_connection
+
+# Горячие таблицы в памяти: выбранные таблицы копируются из файла в общую базу SQLite
+# в памяти (file:...?mode=memory&cache=shared), а соединения пула читают их оттуда.
+# Остальные таблицы и каталог читаются из файла, подключённого только для чтения.
+# Таблица перезагружается, когда её версия в каталоге меняется (переимпорт).
+ENGINE_HOT_TABLES = [t.strip() for t in os.getenv("ENGINE_HOT_TABLES", "").split(",") if t.strip()]  # * — все
+ENGINE_CHECK_INTERVAL = float(os.getenv("ENGINE_CHECK_INTERVAL", "2"))  # секунды между проверками версий
+HOT_VERSIONS = f"{INTERNAL_PREFIX}hot"  # версии таблиц, загруженных в память
+
+_ids = itertools.count(1)
+
+class _SharedLock:
+    """
+    Блокировка читатель/писатель: запросы идут параллельно, перезагрузка таблиц ждёт
+    их окончания и не пускает новые (в общей базе в памяти нельзя менять таблицу,
+    которую читает другое соединение).
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._writer = True
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class HotTablePool(ReadOnlyPool):
+    """
+    Пул соединений только для чтения, в котором таблицы tables ("*" — все) лежат в памяти.
+    Соединение открывает общую базу в памяти и подключает файл как disk: имя без схемы
+    сначала ищется в main (память), затем в disk, поэтому SQL не меняется. Интерфейс —
+    как у ReadOnlyPool; schema — имя файла базы в соединениях (для sqlite_master).
+    """
+    schema = "disk"
+
+    def __init__(self, db_path=DB_PATH, tables=None, size=4, check_interval=ENGINE_CHECK_INTERVAL):
+        super().__init__(db_path, size)
+        self.tables = list(ENGINE_HOT_TABLES if tables is None else tables)
+        self.check_interval = check_interval
+        self.loaded = {}  # таблица -> версия копии в памяти
+        self._memory_uri = f"file:exel_hot_{os.getpid()}_{next(_ids)}?mode=memory&cache=shared"
+        self._disk_uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+        self._shared = _SharedLock()
+        self._reload_lock = threading.Lock()
+        self._checked = None
+        # Соединение загрузчика держит базу в памяти, пока пул открыт
+        self._loader = self._open()
+        self._loader.execute(f"CREATE TABLE IF NOT EXISTS main.{HOT_VERSIONS} "
+                             "(table_name TEXT PRIMARY KEY, version INTEGER)")
+
+    def _open(self):
+        conn = sqlite3.connect(self._memory_uri, uri=True, check_same_thread=False, isolation_level=None)
+        conn.execute("ATTACH DATABASE ? AS disk", (self._disk_uri,))
+        return tune_connection(conn, "disk")
+
+    def _connect(self):
+        conn = self._open()
+        # Каталог соединения: версия горячей таблицы — версия её копии в памяти, а не файла,
+        # иначе кэш результатов после переимпорта сохранит старые данные под новой версией
+        conn.execute(
+            f"CREATE TEMP VIEW {CATALOG_TABLES} AS SELECT d.table_name, d.row_count, d.column_count, "
+            f"COALESCE(h.version, d.version) AS version, d.updated_at FROM disk.{CATALOG_TABLES} d "
+            f"LEFT JOIN main.{HOT_VERSIONS} h ON h.table_name = d.table_name"
+        )
+        conn.isolation_level = ""
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _wanted_versions(self):
+        try:
+            rows = self._loader.execute(f"SELECT table_name, version FROM disk.{CATALOG_TABLES}").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        if "*" in self.tables:
+            return {t: v for t, v in rows if not is_internal_table(t)}
+        return {t: v for t, v in rows if t in self.tables}
+
+    def _load(self, table):
+        """
+        Копия таблицы в памяти с тем же определением и индексами.
+        """
+        conn = self._loader
+        q = quote_ident(table)
+        conn.execute(f"DROP TABLE IF EXISTS main.{q}")
+        # CREATE без имени схемы создаёт таблицу и индексы в main — базе в памяти
+        conn.execute(conn.execute("SELECT sql FROM disk.sqlite_master WHERE type = 'table' AND name = ?",
+                                  (table,)).fetchone()[0])
+        conn.execute(f"INSERT INTO main.{q} SELECT * FROM disk.{q}")
+        for (sql,) in conn.execute("SELECT sql FROM disk.sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                   "AND sql IS NOT NULL", (table,)).fetchall():
+            conn.execute(sql)
+
+    def refresh(self, force=False):
+        """
+        Проверяет версии горячих таблиц в каталоге (не чаще check_interval секунд) и
+        перезагружает изменившиеся. Возвращает список перезагруженных таблиц.
+        """
+        with self._reload_lock:
+            now = time.monotonic()
+            if not force and self._checked is not None and now - self._checked < self.check_interval:
+                return []
+            self._checked = now
+            versions = self._wanted_versions()
+            stale = [t for t, v in versions.items() if self.loaded.get(t) != v]
+            gone = [t for t in self.loaded if t not in versions]
+            if not stale and not gone:
+                return []
+            started = time.perf_counter()
+            with self._shared.exclusive():
+                conn = self._loader
+                # Версии и данные читаются в одной транзакции: копия соответствует версии
+                conn.execute("BEGIN")
+                try:
+                    versions = self._wanted_versions()
+                    stale = [t for t in stale if t in versions]
+                    for table in gone:
+                        conn.execute(f"DROP TABLE IF EXISTS main.{quote_ident(table)}")
+                        conn.execute(f"DELETE FROM main.{HOT_VERSIONS} WHERE table_name = ?", (table,))
+                    for table in stale:
+                        self._load(table)
+                        conn.execute(f"INSERT OR REPLACE INTO main.{HOT_VERSIONS} VALUES (?, ?)",
+                                     (table, versions.get(table)))
+                    conn.execute("COMMIT")
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK")
+                    print(f"Горячие таблицы не обновлены: {e}")
+                    return []
+            for table in gone:
+                self.loaded.pop(table, None)
+            for table in stale:
+                self.loaded[table] = versions.get(table)
+            pages, free, page_size = (self._loader.execute(f"PRAGMA main.{pragma}").fetchone()[0]
+                                      for pragma in ("page_count", "freelist_count", "page_size"))
+            print(f"В памяти: {', '.join(stale)} за {time.perf_counter() - started:.2f} с "
+                  f"(всего {len(self.loaded)} таблиц, {(pages - free) * page_size / 2 ** 20:.1f} МБ).")
+            return stale
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        self.refresh()
+        with self._shared.shared(), super().connection(timeout) as conn:
+            yield conn
+
+    def close(self):
+        super().close()
+        self._loader.close()
+
+def open_pool(db_path=DB_PATH, size=4, tables=None):
+    """
+    Пул соединений для запросов из потоков: с горячими таблицами в памяти, если они
+    заданы (ENGINE_HOT_TABLES), иначе ReadOnlyPool поверх файла.
+    """
+    tables = ENGINE_HOT_TABLES if tables is None else tables
+    return HotTablePool(db_path, tables, size) if tables else ReadOnlyPool(db_path, size)
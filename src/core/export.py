@@ -0,0 +1,98 @@
+import csv
+import gzip
+import os
+import time
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from core import tracing
+
+# Потоковая выгрузка результата запроса: курсор читается пачками, память не растёт с числом строк
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+EXCEL_MAX_ROWS = 1048576  # предел строк на лист Excel, включая заголовок
+PROGRESS_EVERY = 100000
+
+def _excel_value(v):
+    if isinstance(v, str):
+        return ILLEGAL_CHARACTERS_RE.sub("", v)
+    if isinstance(v, bytes):
+        return v.hex()
+    return v
+
+def _progress(count, started, final=False):
+    elapsed = time.perf_counter() - started
+    end = "\n" if final else ""
+    print(f"\rВыгружено строк: {count:,} ({count / max(elapsed, 1e-9):,.0f} строк/с)", end=end, flush=True)
+
+def _write_excel(cur, columns, path, batch_rows, sheet_prefix, started):
+    """
+    Запись в write-only книгу openpyxl: при достижении предела Excel создаётся
+    следующий лист (Result, Result_2, ...).
+    """
+    wb = Workbook(write_only=True)
+    ws, sheets, count = None, 0, 0
+    sheet_rows = EXCEL_MAX_ROWS
+    for batch in iter(lambda: cur.fetchmany(batch_rows), []):
+        for row in batch:
+            if sheet_rows >= EXCEL_MAX_ROWS:
+                sheets += 1
+                ws = wb.create_sheet(sheet_prefix if sheets == 1 else f"{sheet_prefix}_{sheets}")
+                ws.append(columns)
+                sheet_rows = 1
+            ws.append([_excel_value(v) for v in row])
+            sheet_rows += 1
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                _progress(count, started)
+    if ws is None:
+        wb.create_sheet(sheet_prefix).append(columns)
+        sheets = 1
+    wb.save(path)
+    return count, sheets
+
+def _write_csv(cur, columns, path, batch_rows, started):
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    count = 0
+    with opener(path, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for batch in iter(lambda: cur.fetchmany(batch_rows), []):
+            writer.writerows(batch)
+            before, count = count, count + len(batch)
+            if count // PROGRESS_EVERY != before // PROGRESS_EVERY:
+                _progress(count, started)
+    return count
+
+@tracing.traced("export", lambda rows: {"rows": rows})
+def export_query(conn, sql, path, params=(), batch_rows=EXPORT_BATCH_ROWS, sheet_name="Result"):
+    """
+    Выполняет SQL целиком (без LIMIT) и потоково пишет результат в .xlsx, .csv или .csv.gz.
+    В памяти одновременно находится только одна пачка строк курсора.
+    Возвращает число выгруженных строк.
+    """
+    started = time.perf_counter()
+    cur = conn.execute(sql, params)
+    columns = [d[0] for d in cur.description] if cur.description else []
+    lowered = path.lower()
+    if lowered.endswith((".csv", ".csv.gz")):
+        count, sheets = _write_csv(cur, columns, path, batch_rows, started), 0
+    else:
+        count, sheets = _write_excel(cur, columns, path, batch_rows, sheet_name, started)
+    _progress(count, started, final=True)
+    suffix = f", листов: {sheets}" if sheets > 1 else ""
+    print(f"Результат выгружен в {path}{suffix}")
+    return count
+
+def export_result(conn, result, path):
+    """
+    Выгрузка ответа: если у DataFrame сохранён исходный SQL (attrs["sql"]), запрос
+    выполняется заново без ограничения строк и пишется потоково; иначе пишется сам DataFrame.
+    """
+    sql = result.attrs.get("sql")
+    if sql:
+        return export_query(conn, sql, path, result.attrs.get("params", ()))
+    if path.lower().endswith((".csv", ".csv.gz")):
+        result.to_csv(path, index=False)
+    else:
+        result.to_excel(path, index=False)
+    print(f"Результат выгружен в {path}")
+    return len(result)
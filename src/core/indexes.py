@@ -0,0 +1,211 @@
+import os
+import re
+import datetime
+from core.catalog import INTERNAL_PREFIX, load_catalog, quote_ident, referenced_tables
+
+# Советник по индексам: копит статистику столбцов из WHERE/JOIN/GROUP BY/ORDER BY
+# сгенерированных запросов и предлагает (или создаёт) индексы для частых фильтров.
+INDEX_ADVISOR = os.getenv("INDEX_ADVISOR", "recommend")  # off | recommend | auto
+INDEX_MIN_USES = int(os.getenv("INDEX_MIN_USES", "3"))
+INDEX_MAX_COLUMNS = 3
+AUTO_INDEX_PREFIX = "ix_auto_"
+
+USAGE_TABLE = f"{INTERNAL_PREFIX}query_columns"
+PATTERN_TABLE = f"{INTERNAL_PREFIX}query_patterns"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_CLAUSE_RE = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|ON|FROM|JOIN|UNION|SELECT)\b", re.I)
+_IDENT_RE = re.compile(r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|\b([^\W\d]\w*)\b')
+_EQ_RE = re.compile(r"\s*(?:=|==|\bIN\b|\bIS\b)", re.I)
+_RANGE_RE = re.compile(r"\s*(?:<|>|\bBETWEEN\b|\bLIKE\b|\bGLOB\b)", re.I)
+
+def ensure_advisor_tables(conn):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {USAGE_TABLE} ("
+        "table_name TEXT, column_name TEXT, usage TEXT, uses INTEGER, last_seen TEXT, "
+        "PRIMARY KEY (table_name, column_name, usage))"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {PATTERN_TABLE} ("
+        "table_name TEXT, columns TEXT, uses INTEGER, last_sql TEXT, last_seen TEXT, "
+        "PRIMARY KEY (table_name, columns))"
+    )
+
+def extract_column_usage(sql, columns):
+    """
+    Столбцы таблицы, участвующие в условиях и сортировках запроса:
+    список (столбец, usage), usage — eq, range, join, group или order.
+    """
+    lookup = {c.lower(): c for c in columns}
+    text = _STRING_RE.sub("?", sql)
+    parts = _CLAUSE_RE.split(text)
+    usage = []
+    # split с группой даёт [текст, ключевое слово, текст, ключевое слово, ...]
+    for keyword, segment in zip(parts[1::2], parts[2::2]):
+        keyword = re.sub(r"\s+", " ", keyword.upper())
+        kind = {"WHERE": "where", "HAVING": "where", "ON": "join",
+                "GROUP BY": "group", "ORDER BY": "order"}.get(keyword)
+        if kind is None:
+            continue
+        for m in _IDENT_RE.finditer(segment):
+            name = next(g for g in m.groups() if g is not None).replace('""', '"')
+            col = lookup.get(name.lower())
+            if col is None:
+                continue
+            if kind == "where":
+                rest = segment[m.end():]
+                if _EQ_RE.match(rest):
+                    item = (col, "eq")
+                elif _RANGE_RE.match(rest):
+                    item = (col, "range")
+                else:
+                    continue
+            else:
+                item = (col, kind)
+            if item not in usage:
+                usage.append(item)
+    return usage
+
+def candidate_index(usage, catalog):
+    """
+    Составной индекс под запрос: сначала столбцы равенства (самые селективные первыми),
+    затем один столбец диапазона/сортировки/группировки.
+    """
+    distinct = {c["name"]: c["distinct_count"] or 0 for c in catalog["columns"]}
+    useful = [(c, u) for c, u in usage if distinct.get(c, 0) > 1]
+    eq = sorted({c for c, u in useful if u in ("eq", "join")}, key=lambda c: -distinct[c])
+    tail = [c for c, u in useful if u in ("range", "order", "group") and c not in eq]
+    return (eq + tail[:1])[:INDEX_MAX_COLUMNS]
+
+def record_query(conn, sql):
+    """
+    Учитывает выполненный запрос в статистике советника. В режиме auto сразу
+    создаёт индексы, набравшие INDEX_MIN_USES использований. Возвращает созданные индексы.
+    """
+    if INDEX_ADVISOR == "off" or conn.execute("PRAGMA query_only").fetchone()[0]:
+        return []
+    ensure_advisor_tables(conn)
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    for table in referenced_tables(conn, sql):
+        catalog = load_catalog(conn, table, build_missing=False)
+        if catalog is None:
+            continue
+        usage = extract_column_usage(sql, [c["name"] for c in catalog["columns"]])
+        for col, kind in usage:
+            conn.execute(
+                f"INSERT INTO {USAGE_TABLE} VALUES (?, ?, ?, 1, ?) ON CONFLICT(table_name, column_name, usage) "
+                "DO UPDATE SET uses = uses + 1, last_seen = excluded.last_seen",
+                (table, col, kind, now),
+            )
+        cols = candidate_index(usage, catalog)
+        if cols:
+            conn.execute(
+                f"INSERT INTO {PATTERN_TABLE} VALUES (?, ?, 1, ?, ?) ON CONFLICT(table_name, columns) "
+                "DO UPDATE SET uses = uses + 1, last_sql = excluded.last_sql, last_seen = excluded.last_seen",
+                (table, ",".join(cols), sql, now),
+            )
+    conn.commit()
+    if INDEX_ADVISOR != "auto":
+        return []
+    created = []
+    for rec in recommend_indexes(conn):
+        created.append(apply_index(conn, rec["table"], rec["columns"]))
+    return created
+
+def uses_full_scan(conn, sql, table_name):
+    """
+    True, если план запроса (EXPLAIN QUERY PLAN) читает таблицу полным сканированием.
+    """
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql.rstrip(';')}").fetchall()
+    except Exception:
+        return False
+    pattern = re.compile(rf"\bSCAN (?:TABLE )?{re.escape(table_name)}\b(?!.*\bINDEX\b)", re.I)
+    return any(pattern.search(row[-1]) for row in plan)
+
+def existing_indexes(conn, table_name):
+    """
+    {имя индекса: [столбцы]} для таблицы.
+    """
+    result = {}
+    for _, name, *_ in conn.execute(f"PRAGMA index_list({quote_ident(table_name)})").fetchall():
+        result[name] = [r[2] for r in conn.execute(f"PRAGMA index_info({quote_ident(name)})")]
+    return result
+
+def recommend_indexes(conn, table_name=None, min_uses=None):
+    """
+    Рекомендации: частые шаблоны фильтров, для которых последний запрос всё ещё
+    выполняется полным сканированием и нет индекса с тем же префиксом столбцов.
+    """
+    ensure_advisor_tables(conn)
+    min_uses = INDEX_MIN_USES if min_uses is None else min_uses
+    query = f"SELECT table_name, columns, uses, last_sql FROM {PATTERN_TABLE} WHERE uses >= ?"
+    params = [min_uses]
+    if table_name:
+        query += " AND table_name = ?"
+        params.append(table_name)
+    recommendations = []
+    for table, cols, uses, last_sql in conn.execute(query + " ORDER BY uses DESC", params).fetchall():
+        columns = cols.split(",")
+        have = existing_indexes(conn, table).values()
+        if any(idx[:len(columns)] == columns for idx in have):
+            continue
+        if not uses_full_scan(conn, last_sql, table):
+            continue
+        recommendations.append({"table": table, "columns": columns, "uses": uses, "sql": last_sql})
+    return recommendations
+
+def index_name(table_name, columns):
+    return AUTO_INDEX_PREFIX + re.sub(r"\W", "_", f"{table_name}__{'__'.join(columns)}")
+
+def apply_index(conn, table_name, columns):
+    name = index_name(table_name, columns)
+    cols = ", ".join(quote_ident(c) for c in columns)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(name)} ON {quote_ident(table_name)} ({cols})")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+    print(f"Создан индекс {name} ({', '.join(columns)})")
+    return name
+
+def list_auto_indexes(conn, table_name=None):
+    query = "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE ?"
+    params = [AUTO_INDEX_PREFIX + "%"]
+    if table_name:
+        query += " AND tbl_name = ?"
+        params.append(table_name)
+    return conn.execute(query, params).fetchall()
+
+def drop_auto_indexes(conn, table_name=None, name=None):
+    dropped = []
+    for idx, _, _ in list_auto_indexes(conn, table_name):
+        if name is None or idx == name:
+            conn.execute(f"DROP INDEX IF EXISTS {quote_ident(idx)}")
+            dropped.append(idx)
+    conn.commit()
+    return dropped
+
+if __name__ == "__main__":
+    import sys
+    import sqlite3
+    from core.database import DB_PATH
+    command = sys.argv[1] if len(sys.argv) > 1 else "recommend"
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+    conn = sqlite3.connect(DB_PATH)
+    if command == "list":
+        for idx, table, sql in list_auto_indexes(conn, target):
+            print(f"{table}: {idx} — {sql}")
+    elif command == "recommend":
+        for rec in recommend_indexes(conn, target):
+            print(f"{rec['table']}({', '.join(rec['columns'])}) — использований: {rec['uses']}")
+    elif command == "apply":
+        for rec in recommend_indexes(conn, target):
+            apply_index(conn, rec["table"], rec["columns"])
+    elif command == "drop":
+        if target and list_auto_indexes(conn, target):
+            dropped = drop_auto_indexes(conn, table_name=target)
+        else:
+            dropped = drop_auto_indexes(conn, name=target)
+        print("Удалены индексы:", ", ".join(dropped) or "нет")
+    else:
+        print("Использование: python -m core.indexes [list|recommend|apply|drop] [таблица|индекс]")
+    conn.close()
@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from core.catalog import quote_ident
+
+# Типизация при импорте: по выборке строк для каждого столбца определяется вид данных
+# (целые, дробные, логические, даты, категории, текст). Таблица создаётся с явными типами
+# SQLite, значения пишутся уже приведёнными, а DataFrame хранит столбцы в компактных dtype.
+INFER_SAMPLE_ROWS = int(os.getenv("INFER_SAMPLE_ROWS", "10000"))
+CATEGORY_MAX_UNIQUE = int(os.getenv("INFER_CATEGORY_MAX_UNIQUE", "1000"))
+CATEGORY_MAX_RATIO = 0.5  # доля различных значений среди непустых
+
+KIND_TYPES = {
+    "integer": "INTEGER",
+    "real": "REAL",
+    "boolean": "BOOLEAN",
+    "date": "DATE",
+    "datetime": "DATETIME",
+    "category": "TEXT",
+    "text": "TEXT",
+}
+DECLARED_KINDS = {
+    "INTEGER": "integer", "INT": "integer", "BIGINT": "integer",
+    "REAL": "real", "FLOAT": "real", "DOUBLE": "real", "NUMERIC": "real",
+    "BOOLEAN": "boolean", "BOOL": "boolean",
+    "DATE": "date", "DATETIME": "datetime", "TIMESTAMP": "datetime",
+}
+
+# Целые без ведущих нулей: "007" — это код, а не число
+INT_RE = r"[+-]?(0|[1-9]\d*)"
+FLOAT_RE = r"[+-]?((0|[1-9]\d*)([.,]\d*)?|[.,]\d+)([eE][+-]?\d+)?"
+DATE_RE = r"\d{1,4}[-./]\d{1,2}[-./]\d{1,4}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?"
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S",
+                "%d.%m.%Y", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d/%m/%Y", "ISO8601")
+BOOL_VALUES = {"true": True, "false": False, "1": True, "0": False}
+INT_DIGITS_MAX = 18  # больше — не помещается в INTEGER SQLite
+
+def _is_text(col):
+    return col.dtype == object or pd.api.types.is_string_dtype(col)
+
+def _stripped(col):
+    """
+    Непустые значения столбца как строки без пробелов по краям ("" -> NA).
+    """
+    s = col.astype("string").str.strip()
+    return s.mask(s == "")
+
+def _is_integral(values):
+    return len(values) > 0 and bool((values == np.floor(values)).all()) and values.abs().max() < 2 ** 53
+
+def _is_category(s):
+    unique = s.nunique()
+    return unique <= CATEGORY_MAX_UNIQUE and unique <= CATEGORY_MAX_RATIO * len(s)
+
+def _date_format(s):
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = pd.to_datetime(s, format=fmt, errors="coerce")
+        except (ValueError, TypeError):
+            continue
+        if parsed.notna().all():
+            return fmt, parsed
+    return None, None
+
+def _is_midnight(values):
+    values = values.dropna()
+    return bool((values == values.dt.normalize()).all())
+
+def infer_column(col):
+    """
+    Тип столбца по значениям: {"kind": вид, "format": формат дат или None}.
+    """
+    values = col.dropna()
+    if pd.api.types.is_bool_dtype(col):
+        return {"kind": "boolean", "format": None}
+    if pd.api.types.is_integer_dtype(col):
+        return {"kind": "integer", "format": None}
+    if pd.api.types.is_float_dtype(col):
+        # Целые с пропусками pandas читает как float
+        integral = values.size < col.size and _is_integral(values)
+        return {"kind": "integer" if integral else "real", "format": None}
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return {"kind": "date" if _is_midnight(col) else "datetime", "format": None}
+    if not _is_text(col):
+        return {"kind": "text", "format": None}
+    s = _stripped(col).dropna()
+    if s.empty:
+        return {"kind": "text", "format": None}
+    if set(s.str.lower().unique()) <= {"true", "false"}:
+        return {"kind": "boolean", "format": None}
+    if s.str.fullmatch(INT_RE).all() and s.str.len().max() <= INT_DIGITS_MAX:
+        return {"kind": "integer", "format": None}
+    if s.str.fullmatch(FLOAT_RE).all() and not (s.str.contains(",").any() and s.str.contains(r"\.").any()):
+        return {"kind": "real", "format": None}
+    if s.str.fullmatch(DATE_RE).all():
+        fmt, parsed = _date_format(s)
+        if fmt is not None:
+            return {"kind": "date" if _is_midnight(parsed) else "datetime", "format": fmt}
+    if _is_category(s):
+        return {"kind": "category", "format": None}
+    return {"kind": "text", "format": None}
+
+def infer_schema(df, sample_rows=INFER_SAMPLE_ROWS):
+    """
+    {столбец: тип} по первым sample_rows строкам DataFrame (см. infer_column).
+    """
+    sample = df.head(sample_rows)
+    return {name: infer_column(sample[name]) for name in df.columns}
+
+def schema_from_table(conn, table_name):
+    """
+    Схема по объявленным типам существующей таблицы; TEXT считается текстом
+    (категории определяются уже по данным, см. compact_frame).
+    """
+    schema = {}
+    for row in conn.execute(f"PRAGMA table_info({quote_ident(table_name)})"):
+        declared = (row[2] or "").upper()
+        schema[row[1]] = {"kind": DECLARED_KINDS.get(declared, "text"), "format": None}
+    return schema
+
+def create_table_sql(table_name, schema):
+    decl = ", ".join(f"{quote_ident(name)} {KIND_TYPES[spec['kind']]}" for name, spec in schema.items())
+    return f"CREATE TABLE {quote_ident(table_name)} ({decl})"
+
+def date_columns(schema):
+    return [name for name, spec in schema.items() if spec["kind"] == "date"]
+
+def _to_number(col):
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype("float64") if col.dtype.kind not in "iuf" else col
+    s = _stripped(col)
+    if s.str.contains(",").any():
+        s = s.str.replace(",", ".", regex=False)
+    numbers = pd.to_numeric(s.astype(object), errors="coerce")
+    if (numbers.isna() & s.notna()).any():
+        return None
+    return numbers.astype("float64")
+
+def _downcast_integer(numbers):
+    if numbers.isna().any():
+        return numbers  # NULL в целом столбце: float64 в памяти, INTEGER в базе
+    return pd.to_numeric(numbers.astype("int64"), downcast="integer")
+
+def _downcast_float(numbers):
+    as32 = numbers.astype("float32")
+    same = np.array_equal(as32.to_numpy(dtype="float64"), numbers.to_numpy(dtype="float64"), equal_nan=True)
+    return as32 if same else numbers
+
+def _to_bool(col):
+    if pd.api.types.is_bool_dtype(col):
+        return col
+    if pd.api.types.is_numeric_dtype(col):
+        flags = col.map(lambda v: None if pd.isna(v) else bool(v))
+    else:
+        s = _stripped(col).str.lower()
+        flags = s.map(BOOL_VALUES, na_action="ignore")
+        if (flags.isna() & s.notna()).any():
+            return None
+    return flags.astype(bool) if flags.notna().all() else flags.astype("boolean")
+
+def _to_datetime(col, fmt):
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    s = _stripped(col)
+    if fmt is None:
+        # Формат не сохранён (схема по объявленным типам таблицы) — подбирается заново
+        fmt = _date_format(s.dropna().head(INFER_SAMPLE_ROWS))[0] or "ISO8601"
+    parsed = pd.to_datetime(s.astype(object), format=fmt, errors="coerce")
+    if (parsed.isna() & s.notna()).any():
+        return None
+    return parsed
+
+def convert_column(col, spec):
+    """
+    Столбец, приведённый к типу spec, в наименьшем подходящем dtype. Если значения
+    не приводятся (например, в следующем чанке CSV), столбец возвращается без изменений.
+    """
+    kind = spec["kind"]
+    if kind in ("integer", "real"):
+        numbers = _to_number(col)
+        if numbers is None:
+            return col
+        if kind == "integer":
+            return _downcast_integer(numbers) if _is_integral(numbers.dropna()) or numbers.isna().all() else numbers
+        return _downcast_float(numbers)
+    if kind == "boolean":
+        flags = _to_bool(col)
+        return col if flags is None else flags
+    if kind in ("date", "datetime"):
+        parsed = _to_datetime(col, spec.get("format"))
+        return col if parsed is None else parsed
+    if kind == "category" and _is_text(col):
+        return col.astype("category")
+    return col
+
+def apply_schema(df, schema):
+    """
+    Копия DataFrame со столбцами, приведёнными по схеме.
+    """
+    out = df.copy(deep=False)
+    for name, spec in schema.items():
+        if name in out.columns:
+            out[name] = convert_column(out[name], spec)
+    return out
+
+def widen_integers(df):
+    """
+    DataFrame с целыми столбцами в int64. Уменьшенные int8/int16/int32 — только для
+    хранения (колоночный кэш): в коде над таблицей (df["tenure"] * 2) они молча переполняются.
+    """
+    narrow = [name for name in df.columns
+              if isinstance(df[name].dtype, np.dtype) and df[name].dtype.kind in "iu" and df[name].dtype != np.int64]
+    if not narrow:
+        return df
+    out = df.copy(deep=False)
+    for name in narrow:
+        out[name] = out[name].astype("int64")
+    return out
+
+def compact_frame(df, schema):
+    """
+    DataFrame, прочитанный из SQLite, в компактных dtype: числа уменьшаются, BOOLEAN —
+    bool, DATE/DATETIME — datetime64, текст с небольшим числом значений — category.
+    """
+    out = df.copy(deep=False)
+    for name in out.columns:
+        spec = schema.get(name, {"kind": "text", "format": None})
+        if spec["kind"] == "text":
+            if _is_text(out[name]) and _is_category(out[name].head(INFER_SAMPLE_ROWS).dropna()):
+                out[name] = out[name].astype("category")
+            continue
+        out[name] = convert_column(out[name], spec)
+    return out
@@ -0,0 +1,138 @@
+import re
+import time
+import pandas as pd
+from core.catalog import load_catalog, quote_ident
+
+# Локальные команды без LLM: регулярные выражения компилируются один раз при импорте.
+# Команда должна составлять весь вопрос (допускаются вежливые слова и «в Excel»): вопрос
+# с уточнениями («сколько строк, где ...», «top 5 клиентов по ...») уходит в LLM.
+# Порядок важен — проверяются сверху вниз, как в исходной apply_simple_task.
+_POLITE = r"(?:(?:пожалуйста|покажи|выведи|дай|сделай|please|show)[\s,]+)*"
+_TABLE = r"(?:\s+(?:в\s+)?таблиц[аеы])?"
+_TAIL = (r"(?:[\s,]+(?:и\s+)?(?:выгрузи|сохрани)(?:\s+в)?\s+(?:excel|эксель|xlsx|csv))?"
+         r"(?:[\s,]+(?:пожалуйста|please))?[\s.!?]*")
+
+def _command(body):
+    return re.compile(rf"{_POLITE}(?:{body}){_TAIL}", re.I)
+
+INTENTS = [
+    ("drop_duplicates", _command(r"удал(?:и|ить) дубликаты|drop_duplicates")),
+    ("head", _command(rf"перв(?:ых|ые)\s+(\d+)\s+строк\w*{_TABLE}|top\s*(\d+)|head\s*(\d+)")),
+    ("tail", _command(rf"последн(?:их|ие)\s+(\d+)\s+строк\w*{_TABLE}")),
+    ("dropna", _command(r"(?:очисти|удали) пропуски|dropna")),
+    ("sort", _command(r"(?:от)?сортируй по (\w+)")),
+    ("unique", _command(r"уникальные значения (?:столбца|в столбце) (\w+)")),
+    ("filter", _command(r"(?:строки\s+)?где (\w+)\s*=\s*(\S+?)")),
+    ("drop_column", _command(r"удали столбец (\w+)")),
+    ("reset_index", _command(r"сбрось индекс|reset index")),
+    ("columns", _command(rf"(?:названия|имена) столбцов{_TABLE}|сколько столбцов{_TABLE}")),
+    ("shape", _command(rf"размер таблицы|(?:сколько|число) строк{_TABLE}|число столбцов{_TABLE}")),
+    ("describe", _command(rf"describe|(?:описание|summary){_TABLE}")),
+]
+EXPORT_RE = re.compile(r"выгруз|сохрани|excel|эксель|xlsx|csv", re.I)
+NUMERIC_TYPES = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+
+stats = {"hits": 0, "misses": 0, "time": 0.0}
+
+def match_intent(text):
+    """
+    Первая локальная команда, совпавшая со всем вопросом: (имя, аргументы из групп regex)
+    или None.
+    """
+    text = text.strip()
+    for name, pattern in INTENTS:
+        m = pattern.fullmatch(text)
+        if m:
+            return name, [g for g in m.groups() if g is not None]
+    return None
+
+def _resolve_column(columns, name):
+    lowered = {c.lower(): c for c in columns}
+    return name if name in columns else lowered.get(name.lower())
+
+def build_intent_sql(intent, args, table_name, catalog):
+    """
+    SQL для локальной команды: (sql, params), либо готовый ответ (str/list) для команд,
+    которые отвечаются по каталогу без запроса. None — если команда неприменима
+    (например, столбца нет в таблице).
+    """
+    columns = [c["name"] for c in catalog["columns"]]
+    t = quote_ident(table_name)
+    if intent == "drop_duplicates":
+        return f"SELECT DISTINCT * FROM {t}", ()
+    if intent == "head":
+        return f"SELECT * FROM {t} ORDER BY rowid LIMIT ?", (int(args[0]),)
+    if intent == "tail":
+        return (f"SELECT * FROM {t} WHERE rowid IN "
+                f"(SELECT rowid FROM {t} ORDER BY rowid DESC LIMIT ?) ORDER BY rowid"), (int(args[0]),)
+    if intent == "dropna":
+        cond = " AND ".join(f"{quote_ident(c)} IS NOT NULL" for c in columns) or "1"
+        return f"SELECT * FROM {t} WHERE {cond}", ()
+    if intent == "reset_index":
+        return f"SELECT * FROM {t}", ()
+    if intent == "columns":
+        return columns
+    if intent == "shape":
+        return f"Строк: {catalog['row_count']}, столбцов: {catalog['column_count']}"
+    if intent == "describe":
+        numeric = [c["name"] for c in catalog["columns"] if c["type"].startswith(NUMERIC_TYPES)]
+        if not numeric:
+            return None
+        aggregates = []
+        for c in numeric:
+            q = quote_ident(c)
+            aggregates += [f"COUNT({q})", f"AVG({q})", f"MIN({q})", f"MAX({q})"]
+        return f"SELECT {', '.join(aggregates)} FROM {t}", ()
+    col = _resolve_column(columns, args[0]) if args else None
+    if col is None:
+        return None
+    c = quote_ident(col)
+    if intent == "sort":
+        return f"SELECT * FROM {t} ORDER BY {c}", ()
+    if intent == "unique":
+        return f"SELECT DISTINCT {c} FROM {t}", ()
+    if intent == "filter":
+        return f"SELECT * FROM {t} WHERE {c} = ? COLLATE NOCASE", (args[1].strip("'\""),)
+    if intent == "drop_column":
+        rest = ", ".join(quote_ident(x) for x in columns if x != col)
+        return (f"SELECT {rest} FROM {t}", ()) if rest else None
+    return None
+
+def _describe_frame(row, catalog):
+    numeric = [c["name"] for c in catalog["columns"] if c["type"].startswith(NUMERIC_TYPES)]
+    values = {name: row[4 * i: 4 * i + 4] for i, name in enumerate(numeric)}
+    return pd.DataFrame(values, index=["count", "mean", "min", "max"])
+
+def route_intent(conn, table_name, question, max_rows=100):
+    """
+    Пытается ответить на вопрос локальной командой прямо в SQLite, без LLM.
+    Возвращает (результат, sql, params) или None, если команда не распознана.
+    sql равен None для ответов из каталога. Результат ограничен max_rows строками.
+    """
+    started = time.perf_counter()
+    matched = match_intent(question)
+    built = None
+    if matched:
+        catalog = load_catalog(conn, table_name)
+        built = build_intent_sql(matched[0], matched[1], table_name, catalog)
+    if built is None:
+        stats["misses"] += 1
+        return None
+    if not isinstance(built, tuple):
+        result, sql, params = built, None, ()
+    else:
+        sql, params = built
+        if matched[0] == "describe":
+            result = _describe_frame(conn.execute(sql, params).fetchone(), catalog)
+        else:
+            cur = conn.execute(f"SELECT * FROM ({sql}) LIMIT {int(max_rows)}", params)
+            result = pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+            result.attrs.update(sql=sql, params=params)
+    stats["hits"] += 1
+    stats["time"] += time.perf_counter() - started
+    return result, sql, params
+
+def intent_info():
+    total = stats["hits"] + stats["misses"]
+    return dict(stats, hit_rate=stats["hits"] / total if total else 0.0,
+                avg_ms=1000 * stats["time"] / stats["hits"] if stats["hits"] else 0.0)
@@ -0,0 +1,131 @@
+import sqlite3
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# Дисковый кэш ответов LLM (SQLite): повторные вопросы не ходят в сеть
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").lower() not in ("0", "no", "off", "false")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # секунды
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_conn = None
+_conn_path = None
+stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+def _connect(path=None):
+    global _conn, _conn_path
+    path = path or LLM_CACHE_PATH
+    if _conn is None or _conn_path != path:
+        if _conn is not None:
+            _conn.close()
+        _conn = sqlite3.connect(path, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+            "created_at REAL, last_access REAL, hits INTEGER DEFAULT 0)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+        _conn_path = path
+    return _conn
+
+def normalize_prompt(text):
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+def schema_fingerprint(table_name, columns):
+    """
+    Отпечаток схемы: имя таблицы + столбцы с типами. Не зависит от данных,
+    поэтому переимпорт с той же схемой не сбрасывает кэш SQL.
+    """
+    parts = [table_name] + [f"{c['name']}:{c.get('type', '')}" if isinstance(c, dict) else str(c) for c in columns]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+def make_key(messages, model, temperature, schema=""):
+    payload = json.dumps({
+        "messages": [[m["role"], normalize_prompt(m["content"])] for m in messages],
+        "schema": schema,
+        "model": model,
+        "temperature": round(float(temperature), 3),
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get(messages, model, temperature, schema="", enabled=None):
+    if not (LLM_CACHE_ENABLED if enabled is None else enabled):
+        return None
+    key = make_key(messages, model, temperature, schema)
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > LLM_CACHE_TTL:
+            if row is not None:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+            stats["misses"] += 1
+            return None
+        conn.execute("UPDATE llm_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        conn.commit()
+        stats["hits"] += 1
+        return row[0]
+
+def put(messages, model, temperature, response, schema="", enabled=None):
+    if not (LLM_CACHE_ENABLED if enabled is None else enabled):
+        return
+    key = make_key(messages, model, temperature, schema)
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, last_access, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, 0)",
+            (key, model, response, len(response.encode("utf-8")), now, now),
+        )
+        stats["writes"] += 1
+        _evict(conn, now)
+        conn.commit()
+
+def _evict(conn, now):
+    """
+    Удаляет записи старше TTL, затем самые давно использованные (LRU),
+    пока кэш не уложится в лимиты по числу записей и размеру.
+    """
+    removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL,)).rowcount
+    count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+    if count > LLM_CACHE_MAX_ENTRIES or size > LLM_CACHE_MAX_BYTES:
+        victims = []
+        for key, entry_size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+            if count <= LLM_CACHE_MAX_ENTRIES and size <= LLM_CACHE_MAX_BYTES:
+                break
+            victims.append((key,))
+            count -= 1
+            size -= entry_size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        removed += len(victims)
+    stats["evictions"] += removed
+
+def purge():
+    with _lock:
+        conn = _connect()
+        removed = conn.execute("DELETE FROM llm_cache").rowcount
+        conn.commit()
+        conn.execute("VACUUM")
+    return removed
+
+def cache_info():
+    with _lock:
+        count, size = _connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+    lookups = stats["hits"] + stats["misses"]
+    return dict(stats, entries=count, bytes=size, hit_rate=stats["hits"] / lookups if lookups else 0.0)
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "purge":
+        print(f"Удалено записей из кэша LLM: {purge()}")
+    else:
+        print(cache_info())
@@ -0,0 +1,279 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from core import tracing
+
+# Общий клиент Mistral: пул keep-alive соединений, ограничение параллелизма, backoff с jitter
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Потоковые ответы (stream: true, SSE): текст приходит по мере генерации
+LLM_STREAM = os.getenv("LLM_STREAM", "0").lower() in ("1", "yes", "on", "true")
+BACKOFF_BASE = 0.5  # секунды
+BACKOFF_CAP = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+class LLMError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+def retry_after_seconds(value):
+    """
+    Значение заголовка Retry-After (секунды или HTTP-дата) в секундах, либо None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Срок на все запросы к LLM внутри блока (например, на один вопрос пакета):
+    таймаут HTTP и паузы между повторами не выходят за него, после срока — LLMError.
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_time():
+    """
+    Секунды до срока из deadline() или None, если срок не задан.
+    """
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Пауза перед повтором: Retry-After сервера, если он есть, иначе экспоненциальный
+    backoff с полным jitter (случайно от 0 до base * 2^attempt, не больше cap).
+    """
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_CAP * 4) + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+class MistralClient:
+    def __init__(self, api_key, url=MISTRAL_API_URL, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES, timeout=LLM_TIMEOUT):
+        self.api_key = api_key
+        self.url = url
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _headers(self, api_key=None):
+        return {"Authorization": f"Bearer {api_key or self.api_key}", "Content-Type": "application/json"}
+
+    def chat_completion(self, messages, model, temperature=0.2, api_key=None, retries=None, **params):
+        """
+        Полный JSON-ответ chat/completions. Повторяет запрос при 429/5xx и сетевых
+        ошибках, остальные ошибки API поднимает сразу как LLMError.
+        """
+        data = dict(params, model=model, messages=messages, temperature=temperature)
+        with tracing.span("llm.request", model=model,
+                          prompt_chars=sum(len(m["content"]) for m in messages)) as s:
+            return self._post_with_retries(data, api_key, retries or self.max_retries, s)
+
+    def _post_with_retries(self, data, api_key, retries, s, stream=False):
+        """
+        POST с повторами. При stream=True возвращает открытый ответ (его читает вызывающий,
+        он же держит слот параллелизма), иначе — разобранный JSON.
+        """
+        last_error = None
+        for attempt in range(retries):
+            retry_after = None
+            s.set(retries=attempt)
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise LLMError("Превышено время ожидания ответа LLM")
+            timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+            try:
+                with contextlib.nullcontext() if stream else self._slots:
+                    r = self.session.post(self.url, headers=self._headers(api_key), json=data,
+                                          timeout=timeout, stream=stream)
+                s.set(status=r.status_code)
+                if r.status_code == 200 and stream:
+                    return r
+                if r.status_code == 200:
+                    try:
+                        result = r.json()
+                        usage = result.get("usage") or {}
+                    except (ValueError, AttributeError):
+                        # Не JSON-объект (страница прокси, обрыв ответа) — повтор, как при ошибке сети
+                        last_error = LLMError(f"Некорректный ответ Mistral API: {r.text[:200]}")
+                    else:
+                        s.set(response_chars=len(r.content), prompt_tokens=usage.get("prompt_tokens"),
+                              completion_tokens=usage.get("completion_tokens"))
+                        return result
+                else:
+                    # Потоковый ответ с ошибкой закрывается, иначе соединение не вернётся в пул
+                    text = r.text
+                    r.close()
+                    last_error = LLMError(f"Mistral API error: {r.status_code} - {text[:200]}", r.status_code)
+                    if r.status_code not in RETRY_STATUSES and "rate limit" not in text.lower():
+                        raise last_error
+                    retry_after = retry_after_seconds(r.headers.get("Retry-After"))
+            except requests.RequestException as e:
+                last_error = LLMError(f"Ошибка сети: {e}")
+            if attempt + 1 < retries:
+                delay = backoff_delay(attempt, retry_after)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    break
+                print(f"{last_error}. Повтор через {delay:.1f} с...")
+                time.sleep(delay)
+        raise last_error
+
+    def chat(self, messages, model, temperature=0.2, api_key=None, retries=None, **params):
+        result = self.chat_completion(messages, model, temperature, api_key, retries, **params)
+        try:
+            return result["choices"][0]["message"]["content"].strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            raise LLMError(f"Некорректный ответ Mistral API: {str(result)[:200]}") from None
+
+    def chat_stream(self, messages, model, temperature=0.2, api_key=None, retries=None, **params):
+        """
+        Потоковый chat (stream: true, SSE): генератор фрагментов текста по мере генерации.
+        Повторы — только до начала ответа. Закрытие генератора (close() или выход из цикла
+        в with contextlib.closing) обрывает соединение, остаток ответа не читается.
+        """
+        data = dict(params, model=model, messages=messages, temperature=temperature, stream=True)
+        with tracing.span("llm.request", model=model, stream=True,
+                          prompt_chars=sum(len(m["content"]) for m in messages)) as s:
+            started = time.perf_counter()
+            chars = 0
+            with self._slots:
+                r = self._post_with_retries(data, api_key, retries or self.max_retries, s, stream=True)
+                r.encoding = "utf-8"
+                try:
+                    for line in r.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == "[DONE]":
+                            break
+                        remaining = remaining_time()
+                        if remaining is not None and remaining <= 0:
+                            raise LLMError("Превышено время ожидания ответа LLM")
+                        chunk = json.loads(payload)
+                        usage = chunk.get("usage")
+                        if usage:
+                            s.set(prompt_tokens=usage.get("prompt_tokens"),
+                                  completion_tokens=usage.get("completion_tokens"))
+                        choices = chunk.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            if not chars:
+                                s.set(first_token_ms=round(1000 * (time.perf_counter() - started), 1))
+                            chars += len(delta)
+                            yield delta
+                except requests.RequestException as e:
+                    raise LLMError(f"Ошибка сети: {e}")
+                except ValueError as e:
+                    raise LLMError(f"Некорректный поток ответа LLM: {e}")
+                finally:
+                    s.set(response_chars=chars)
+                    r.close()
+
+    async def achat(self, messages, model, temperature=0.2, api_key=None, retries=None, **params):
+        """
+        Асинхронный вариант chat: запрос выполняется в пуле потоков клиента
+        поверх тех же keep-alive соединений и того же лимита параллелизма.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: self.chat(messages, model, temperature, api_key, retries, **params)
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.session.close()
+
+def partial_json_string(text, key):
+    """
+    Значение строкового поля key из недописанного JSON-объекта: (уже пришедшая часть
+    строки или None, если поле ещё не началось; True, если строка закрыта кавычкой).
+    """
+    start = re.search(rf'"{re.escape(key)}"\s*:\s*"', text)
+    if not start:
+        return None, False
+    raw = text[start.end():]
+    escaped = False
+    for i, ch in enumerate(raw):
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            return json.loads(f'"{raw[:i]}"', strict=False), True
+    # Конец может обрезать escape-последовательность (\, \u04): она отбрасывается до прихода
+    for cut in range(min(len(raw), 6) + 1):
+        try:
+            return json.loads(f'"{raw[:len(raw) - cut]}"', strict=False), False
+        except ValueError:
+            continue
+    return "", False
+
+class TextProgress:
+    """
+    Передаёт в callback приросты текста, который по мере потока становится длиннее
+    (например, переформулировка из недописанного ответа).
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.sent = 0
+
+    def update(self, text):
+        if self.callback is not None and len(text) > self.sent:
+            self.callback(text[self.sent:])
+            self.sent = len(text)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client(api_key=None):
+    """
+    Общий для процесса клиент: keep-alive соединения переиспользуются всеми вызовами.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MistralClient(api_key or os.getenv("MISTRAL_API_KEY", ""))
+        return _client
@@ -0,0 +1,152 @@
+import os
+import re
+
+import pandas as pd
+
+# Промпт для широких таблиц: столбцы ранжируются по лексической близости к вопросу и
+# описываются в пределах бюджета токенов — релевантные с типом и примерами значений из
+# каталога, остальные короче или не попадают в промпт. Размер промпта зависит от вопроса,
+# а не от ширины таблицы. Всё детерминировано: одинаковый вопрос — одинаковый промпт (кэш LLM).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))  # на описание столбцов
+SAMPLE_TOKEN_BUDGET = int(os.getenv("PROMPT_SAMPLE_TOKENS", "800"))  # на пример строк таблицы
+EXTRA_COLUMNS = int(os.getenv("PROMPT_EXTRA_COLUMNS", "40"))  # не связанных с вопросом столбцов
+CHARS_PER_TOKEN = 3  # грубая оценка с запасом для кириллицы
+EXAMPLE_VALUES = 3
+EXAMPLE_CHARS = 24
+SAMPLE_ROWS = 10
+SAMPLE_CELL_CHARS = 30
+OMITTED_NAMES = 20  # сколько имён не показанных столбцов перечислить
+NUMERIC_TYPES = ("INTEGER", "REAL", "BOOLEAN", "NUMERIC")
+STEM_CHARS = 5  # общий префикс слов: «клиенты» ~ «клиентов», «charges» ~ «charge»
+
+_WORD_RE = re.compile(r"[a-zа-яё0-9]+")
+_CAMEL_RE = re.compile(r"([a-zа-яё0-9])([A-ZА-ЯЁ])")
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def words(text):
+    """
+    Слова текста в нижнем регистре; camelCase и snake_case разбиваются на части.
+    """
+    return _WORD_RE.findall(_CAMEL_RE.sub(r"\1 \2", str(text)).lower())
+
+def _stem(word):
+    return word[:STEM_CHARS]
+
+def _terms(text):
+    found = [w for w in words(text) if len(w) > 1]
+    return set(found), {_stem(w) for w in found if len(w) > 2}
+
+def column_score(question_terms, name, samples=()):
+    """
+    Релевантность столбца вопросу: совпадения частей имени целиком (3) или по основе (2),
+    упоминание в вопросе одного из примеров значений (1).
+    """
+    exact, stems = question_terms
+    score = 0
+    for w in words(name):
+        if w in exact:
+            score += 3
+        elif len(w) > 2 and _stem(w) in stems:
+            score += 2
+    for value in samples:
+        value_words = [w for w in words(value) if len(w) > 2]
+        if value_words and all(w in exact or _stem(w) in stems for w in value_words):
+            score += 1
+            break
+    return score
+
+def rank_columns(question, columns):
+    """
+    Столбцы каталога (словари с "name" и "samples") по убыванию релевантности вопросу;
+    при равенстве — в порядке таблицы. Возвращает [(столбец, балл), ...].
+    """
+    terms = _terms(question)
+    scored = [(c, column_score(terms, c["name"], c.get("samples") or ())) for c in columns]
+    order = sorted(range(len(scored)), key=lambda i: (-scored[i][1], i))
+    return [scored[i] for i in order]
+
+def _short_value(value, limit):
+    text = str(value)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def column_hint(column, with_examples=True):
+    """
+    "имя (ТИП)" или "имя (ТИП: 'a', 'b')". Примеры — только для текста и дат (значения
+    для WHERE и формат дат); диапазоны чисел не выводятся, чтобы промпт не менялся
+    с каждым переимпортом и кэш LLM оставался действительным.
+    """
+    name, kind = column["name"], column.get("type") or ""
+    if not kind:
+        return str(name)
+    samples = (column.get("samples") or [])[:EXAMPLE_VALUES]
+    if not with_examples or not samples or kind in NUMERIC_TYPES:
+        return f"{name} ({kind})"
+    examples = ", ".join(repr(_short_value(v, EXAMPLE_CHARS)) for v in samples)
+    return f"{name} ({kind}: {examples})"
+
+def describe_for_question(columns, question, budget=PROMPT_TOKEN_BUDGET, extra=EXTRA_COLUMNS):
+    """
+    Описание столбцов для промпта в пределах budget токенов. Столбцы перебираются по
+    убыванию релевантности: сначала с примерами значений, если не помещаются — только
+    имя и тип; не поместившиеся пропускаются. Не связанных с вопросом столбцов — не больше
+    extra. В тексте столбцы идут в порядке таблицы. Возвращает (текст, [имена столбцов]).
+    """
+    position = {c["name"]: i for i, c in enumerate(columns)}
+    chosen = {}
+    used = 0
+    unrelated = 0
+    for column, score in rank_columns(question, columns):
+        if not score:
+            if unrelated >= extra:
+                break
+            unrelated += 1
+        for hint in (column_hint(column), column_hint(column, with_examples=False)):
+            cost = estimate_tokens(hint) + 1
+            if used + cost <= budget:
+                chosen[column["name"]] = hint
+                used += cost
+                break
+    names = sorted(chosen, key=position.get)
+    text = ", ".join(chosen[n] for n in names)
+    omitted = len(columns) - len(names)
+    if omitted:
+        text += f" (и ещё {omitted} столбцов, не связанных с вопросом)"
+    return text, names
+
+def sample_rows_text(df, question, budget=SAMPLE_TOKEN_BUDGET, rows=SAMPLE_ROWS):
+    """
+    Первые строки таблицы для промпта: только столбцы, релевантные вопросу (по порядку
+    ранжирования, пока помещаются), значения обрезаны до SAMPLE_CELL_CHARS символов;
+    если не помещается — строк становится меньше.
+    """
+    head = df.head(rows).copy()
+    # Примеры значений для ранжирования — из самих первых строк
+    columns = [{"name": c, "samples": [str(v) for v in head[c].dropna().unique()[:EXAMPLE_VALUES * 3]]}
+               for c in head.columns]
+    ranked = [c["name"] for c, _ in rank_columns(question, columns)]
+    for c in head.columns:
+        if not pd.api.types.is_numeric_dtype(head[c]) and not pd.api.types.is_datetime64_any_dtype(head[c]):
+            head[c] = head[c].map(lambda v: _short_value(v, SAMPLE_CELL_CHARS) if isinstance(v, str) else v)
+    width = 0
+    selected = []
+    for column in ranked:
+        # to_string выравнивает столбец по самой длинной ячейке
+        cells = [str(column)] + [str(v) for v in head[column]]
+        cost = -(-(max(map(len, cells)) + 2) * len(cells) // CHARS_PER_TOKEN)
+        if selected and width + cost > budget:
+            continue
+        selected.append(column)
+        width += cost
+    position = {c: i for i, c in enumerate(df.columns)}
+    selected.sort(key=position.get)
+    text = head[selected].to_string(index=False)
+    while estimate_tokens(text) > budget and len(head) > 1:
+        head = head.iloc[:-1]
+        text = head[selected].to_string(index=False)
+    rest = [str(c) for c in df.columns if c not in selected]
+    if rest:
+        listed = ", ".join(rest[:OMITTED_NAMES]) + (", …" if len(rest) > OMITTED_NAMES else "")
+        text += f"\n(не показаны ещё {len(rest)} столбцов: {listed})"
+    return text
@@ -0,0 +1,178 @@
+import math
+import os
+import re
+import sqlite3
+
+from core.catalog import load_catalog, query_sources, quote_ident, unquote_ident
+from core.database import sql_deadline
+
+# Защита от дорогих запросов LLM: до выполнения стоимость оценивается по EXPLAIN QUERY PLAN
+# и числу строк таблиц из каталога (сколько строк придётся перебрать), запрос сверх лимита
+# отклоняется или отправляется LLM на переписывание. Выполнение прерывается по сроку или
+# отмене через обработчик прогресса SQLite, результат читается пачками fetchmany.
+QUERY_GUARD = os.getenv("QUERY_GUARD", "rewrite").lower()  # off | reject | rewrite
+QUERY_COST_LIMIT = float(os.getenv("QUERY_COST_LIMIT", "100000000"))  # строк перебора
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "60"))  # секунды на выполнение запроса
+QUERY_FETCH_ROWS = int(os.getenv("QUERY_FETCH_ROWS", "1000"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "1000000"))  # предел строк результата в памяти
+
+_IDENT = r'"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+'
+_LOOP_RE = re.compile(rf"^(SCAN|SEARCH) ({_IDENT})(?: USING (.*))?$")
+_SUBQUERY_RE = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (.+)$")
+
+class QueryRejected(Exception):
+    def __init__(self, cost, limit, plan):
+        super().__init__(f"оценка стоимости ~{cost:,.0f} строк превышает лимит {limit:,.0f}")
+        self.cost = cost
+        self.limit = limit
+        self.plan = plan
+
+class QueryInterrupted(Exception):
+    pass
+
+def query_plan(conn, sql, params=()):
+    """
+    Строки EXPLAIN QUERY PLAN: [(id, parent, detail), ...].
+    """
+    return [(r[0], r[1], r[3]) for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+class _TableStats:
+    def __init__(self, conn):
+        self.conn = conn
+        self.catalogs = {}
+
+    def catalog(self, table):
+        if table not in self.catalogs:
+            try:
+                self.catalogs[table] = load_catalog(self.conn, table, build_missing=False)
+            except sqlite3.Error:
+                self.catalogs[table] = None
+        return self.catalogs[table]
+
+    def rows(self, table):
+        info = self.catalog(table)
+        if info is not None:
+            return max(info["row_count"] or 0, 1)
+        try:
+            # Таблицы нет в каталоге: MAX(rowid) — быстрая оценка сверху
+            return max(self.conn.execute(f"SELECT MAX(rowid) FROM {quote_ident(table)}").fetchone()[0] or 0, 1)
+        except sqlite3.Error:
+            return None
+
+    def distinct(self, table, column):
+        info = self.catalog(table)
+        for c in (info or {}).get("columns", []):
+            if c["name"] == column:
+                return c["distinct_count"] or None
+        return None
+
+def _search_rows(stats, table, rows, using):
+    """
+    Строк на одно обращение к индексу: по равенству на первом столбце ключа —
+    rows / число различных значений, по диапазону — четверть таблицы.
+    """
+    if "(rowid=?)" in using:
+        return 1
+    m = re.search(r"\((.+)\)$", using)
+    terms = m.group(1).split(" AND ") if m else []
+    equal = [t[:-2] for t in terms if t.endswith("=?")]
+    if equal:
+        distinct = stats.distinct(table, equal[0]) if table else None
+        return max(rows / distinct, 1) if distinct else max(math.sqrt(rows), 1)
+    return max(rows / 4, 1)
+
+def _estimate(children, node, stats, sources, derived):
+    """
+    (стоимость, строк на выходе) уровня плана. Циклы одного уровня вложены друг в друга:
+    число строк перемножается, стоимость — сумма перебранных строк. Коррелированный
+    подзапрос выполняется на каждую строку внешнего цикла.
+    """
+    rows, cost = 1.0, 0.0
+    unknown = max([stats.rows(t) or 1 for t in set(sources.values())] or [1])
+    for node_id, detail in children.get(node, []):
+        loop = _LOOP_RE.match(detail)
+        sub = _SUBQUERY_RE.match(detail)
+        if sub:
+            sub_cost, sub_rows = _estimate(children, node_id, stats, sources, derived)
+            derived[unquote_ident(sub.group(1))] = sub_rows
+            cost += sub_cost
+        elif detail == "SCAN CONSTANT ROW":
+            cost += rows
+        elif loop:
+            name, using = unquote_ident(loop.group(2)), loop.group(3) or ""
+            table = sources.get(name, name)
+            total = derived.get(name) or stats.rows(table) or unknown
+            if loop.group(1) == "SCAN":
+                rows *= total
+                cost += rows
+            else:
+                cost += rows * max(math.log2(total), 1)
+                rows *= _search_rows(stats, None if name in derived else table, total, using)
+                cost += rows
+        elif detail.startswith("USE TEMP B-TREE"):
+            cost += rows * max(math.log2(max(rows, 2)), 1)
+        elif detail.startswith("BLOOM FILTER"):
+            continue
+        elif children.get(node_id):
+            # Подзапросы (SCALAR/LIST/EXISTS) и части составного запроса (UNION ...)
+            sub_cost, sub_rows = _estimate(children, node_id, stats, sources, derived)
+            cost += sub_cost * (rows if detail.startswith("CORRELATED") else 1)
+            if detail == "COMPOUND QUERY":
+                rows *= max(sub_rows, 1)
+            elif detail.startswith(("LEFT-MOST", "UNION", "INTERSECT", "EXCEPT")):
+                rows += sub_rows
+    return cost, rows
+
+def estimate_cost(conn, sql, params=()):
+    """
+    Оценка стоимости запроса (число перебираемых строк) и текст плана.
+    """
+    plan = query_plan(conn, sql, params)
+    children = {}
+    for node_id, parent, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    cost, _ = _estimate(children, 0, _TableStats(conn), query_sources(sql), {})
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return cost, "\n".join(lines)
+
+def admit(conn, sql, params=(), limit=QUERY_COST_LIMIT):
+    """
+    Проверка запроса до выполнения: QueryRejected, если оценка выше limit.
+    Возвращает оценку стоимости.
+    """
+    if QUERY_GUARD == "off" or not limit:
+        return 0.0
+    cost, plan = estimate_cost(conn, sql, params)
+    if cost > limit:
+        raise QueryRejected(cost, limit, plan)
+    return cost
+
+def fetch(conn, sql, params=(), timeout=QUERY_TIMEOUT, cancel=None, fetch_rows=QUERY_FETCH_ROWS,
+          max_rows=QUERY_MAX_ROWS):
+    """
+    Выполняет запрос со сроком timeout секунд и отменой (threading.Event cancel; Ctrl+C
+    в консоли тоже прерывает запрос) и читает строки пачками по fetch_rows, не больше
+    max_rows. Возвращает (имена столбцов, строки); QueryInterrupted — если прерван.
+    """
+    rows = []
+    try:
+        with sql_deadline(conn, timeout, cancel=cancel):
+            cur = conn.execute(sql, params)
+            columns = [d[0] for d in cur.description] if cur.description else []
+            while len(rows) < max_rows:
+                batch = cur.fetchmany(min(fetch_rows, max_rows - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            cur.close()
+    except sqlite3.OperationalError as e:
+        if "interrupt" not in str(e):
+            raise
+        if cancel is not None and cancel.is_set():
+            raise QueryInterrupted("запрос отменён") from None
+        raise QueryInterrupted(f"запрос прерван: срок {timeout:g} с или отмена пользователем") from None
+    return columns, rows
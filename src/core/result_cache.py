@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from core.catalog import database_identity, source_tables, table_versions
+
+# Кэш результатов SQL: ключ — файл и идентификатор базы + нормализованный SQL + параметры +
+# версии таблиц из каталога. Переимпорт таблицы увеличивает её версию, а пересозданная база
+# получает новый идентификатор, поэтому устаревший результат не находится.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1").lower() not in ("0", "no", "off", "false")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")  # пусто — без дискового уровня
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key -> (DataFrame, size)
+_memory_bytes = 0
+_disk = None
+stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+def normalize_sql(sql):
+    """
+    Нормализация SQL для ключа: пробелы схлопываются, регистр вне кавычек
+    не учитывается, завершающая ';' отбрасывается. Литералы не меняются.
+    """
+    parts = _QUOTED_RE.split(sql.strip().rstrip(";").strip())
+    return "".join(p if i % 2 else re.sub(r"\s+", " ", p).lower() for i, p in enumerate(parts))
+
+def make_key(conn, sql, params=()):
+    """
+    Ключ кэша или None, если хотя бы один источник запроса не найден в каталоге (CTE,
+    табличная функция, имя со схемой) или у базы нет идентификатора: версии неоднозначны,
+    кэшировать такой результат небезопасно.
+    """
+    tables = source_tables(sql)
+    versions = table_versions(conn, tables)
+    if not tables or len(versions) != len(tables):
+        return None
+    path, database_id = database_identity(conn)
+    if database_id is None:
+        return None
+    payload = json.dumps([path, database_id, normalize_sql(sql), list(params), sorted(versions.items())],
+                         ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _disk_conn():
+    global _disk
+    if _disk is None:
+        _disk = sqlite3.connect(RESULT_CACHE_PATH, check_same_thread=False)
+        _disk.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_access REAL)"
+        )
+    return _disk
+
+def _remember(key, df, size):
+    global _memory_bytes
+    if size > RESULT_CACHE_MAX_BYTES // 4:
+        return
+    if key in _memory:
+        _memory_bytes -= _memory.pop(key)[1]
+    _memory[key] = (df, size)
+    _memory_bytes += size
+    while _memory_bytes > RESULT_CACHE_MAX_BYTES and _memory:
+        _memory_bytes -= _memory.popitem(last=False)[1][1]
+
+def get(key):
+    if not RESULT_CACHE_ENABLED or key is None:
+        return None
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            stats["hits"] += 1
+            return _memory[key][0].copy(deep=False)
+        if RESULT_CACHE_PATH:
+            disk = _disk_conn()
+            row = disk.execute("SELECT data, size FROM result_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                disk.execute("UPDATE result_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                disk.commit()
+                df = pickle.loads(row[0])
+                _remember(key, df, row[1])
+                stats["disk_hits"] += 1
+                return df.copy(deep=False)
+        stats["misses"] += 1
+    return None
+
+def put(key, df):
+    if not RESULT_CACHE_ENABLED or key is None:
+        return
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    with _lock:
+        _remember(key, df, size)
+        if RESULT_CACHE_PATH and size <= RESULT_CACHE_DISK_MAX_BYTES // 4:
+            disk = _disk_conn()
+            disk.execute("INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?)",
+                         (key, pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), size, time.time()))
+            total = disk.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+            for old_key, old_size in disk.execute("SELECT key, size FROM result_cache ORDER BY last_access").fetchall():
+                if total <= RESULT_CACHE_DISK_MAX_BYTES:
+                    break
+                disk.execute("DELETE FROM result_cache WHERE key = ?", (old_key,))
+                total -= old_size
+            disk.commit()
+
+def clear():
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+        if RESULT_CACHE_PATH:
+            _disk_conn().execute("DELETE FROM result_cache")
+            _disk_conn().commit()
+
+def cache_info():
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    hits = stats["hits"] + stats["disk_hits"]
+    return dict(stats, entries=len(_memory), bytes=_memory_bytes, hit_rate=hits / lookups if lookups else 0.0)
@@ -0,0 +1,396 @@
+import contextlib
+import contextvars
+import datetime
+import math
+import os
+import re
+import statistics
+import time
+
+import pandas as pd
+
+from core.catalog import INTERNAL_PREFIX, load_catalog, quote_ident, source_tables, table_versions
+
+# Приблизительные ответы для больших таблиц: при импорте рядом с таблицей строятся
+# стратифицированные выборки (доля строк из APPROX_FRACTIONS, в каждой страте не меньше
+# APPROX_MIN_STRATUM_ROWS строк) со столбцом веса. Агрегирующий запрос переписывается на
+# выборку: COUNT/SUM взвешиваются, AVG считается как отношение взвешенных сумм, рядом
+# с оценкой выводится полуширина доверительного интервала.
+APPROX_MODE = os.getenv("APPROX_MODE", "0").lower() in ("1", "yes", "on", "true")
+APPROX_FRACTIONS = [float(f) for f in os.getenv("APPROX_FRACTIONS", "0.01,0.1").split(",") if f.strip()]
+APPROX_MIN_ROWS = int(os.getenv("APPROX_MIN_ROWS", "1000000"))  # меньшие таблицы — только точно
+APPROX_MIN_SAMPLE_ROWS = int(os.getenv("APPROX_MIN_SAMPLE_ROWS", "10000"))
+APPROX_MIN_STRATUM_ROWS = int(os.getenv("APPROX_MIN_STRATUM_ROWS", "100"))
+# Оценка по группе (или по всему фильтру) из меньшего числа строк выборки ненадёжна — тогда точно
+APPROX_MIN_GROUP_ROWS = int(os.getenv("APPROX_MIN_GROUP_ROWS", str(APPROX_MIN_STRATUM_ROWS)))
+APPROX_MAX_STRATA = int(os.getenv("APPROX_MAX_STRATA", "50"))
+APPROX_STRATIFY = os.getenv("APPROX_STRATIFY", "")  # столбец страт; пусто — автоматически, none — без страт
+APPROX_CONFIDENCE = float(os.getenv("APPROX_CONFIDENCE", "0.95"))
+
+SAMPLES_TABLE = f"{INTERNAL_PREFIX}samples"
+SAMPLE_PREFIX = f"{INTERNAL_PREFIX}sample_"
+WEIGHT_COLUMN = "_sample_weight"
+ROWS_COLUMN = "_approx_rows"  # строк выборки в группе результата
+RANDOM_SCALE = 1_000_000
+STRATA_TYPES = ("TEXT", "INTEGER", "BOOLEAN")
+
+_approximate = contextvars.ContextVar("approximate_mode", default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]")
+_IDENT = r'"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+'
+_AGGREGATE_RE = re.compile(r"\b(COUNT|SUM|AVG|TOTAL)\s*\(", re.I)
+_ROUND_RE = re.compile(r"^ROUND\s*\((.*?)(?:,\s*(\d+))?\s*\)$", re.I | re.S)
+_ALIAS_RE = re.compile(rf"(?:\s+AS\s+|(?<=\))\s*)({_IDENT})$", re.I)
+# По выборке не оцениваются экстремумы и агрегаты по различным значениям: MAX по 1% строк
+# систематически занижен, а интервала для него нет
+_UNSUPPORTED_RE = re.compile(
+    r"\b(?:JOIN|UNION|INTERSECT|EXCEPT|OVER|WITH)\b|\b(?:COUNT|SUM|AVG|TOTAL)\s*\(\s*DISTINCT\b"
+    r"|\b(?:MIN|MAX|GROUP_CONCAT|STRING_AGG|JSON_GROUP_ARRAY|JSON_GROUP_OBJECT)\s*\("
+    r"|\bSELECT\s+(?:DISTINCT\s+)?\*|\.\*", re.I)
+_NOT_ALIAS = {"where", "group", "order", "limit", "having", "window", "as"}
+
+@contextlib.contextmanager
+def approximate_mode(enabled):
+    """
+    Приблизительные ответы внутри блока включены или выключены независимо от APPROX_MODE
+    (например, точный ответ по запросу пользователя).
+    """
+    token = _approximate.set(enabled)
+    try:
+        yield
+    finally:
+        _approximate.reset(token)
+
+def approximate_enabled():
+    enabled = _approximate.get()
+    return APPROX_MODE if enabled is None else enabled
+
+def ensure_samples_table(conn):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SAMPLES_TABLE} ("
+        "table_name TEXT, fraction REAL, sample_table TEXT, source_version INTEGER, source_rows INTEGER, "
+        "sample_rows INTEGER, strata_column TEXT, created_at TEXT, PRIMARY KEY (table_name, fraction))"
+    )
+
+def sample_table_name(table_name, fraction):
+    return f"{SAMPLE_PREFIX}{table_name}_{f'{fraction:g}'.replace('.', '_')}"
+
+def strata_column(info):
+    """
+    Столбец для страт: APPROX_STRATIFY или столбец каталога с наибольшим числом различных
+    значений не больше APPROX_MAX_STRATA (регион, тариф, тип договора). None — без страт.
+    """
+    if APPROX_STRATIFY.lower() == "none":
+        return None
+    names = {c["name"] for c in info["columns"]}
+    if APPROX_STRATIFY:
+        return APPROX_STRATIFY if APPROX_STRATIFY in names else None
+    candidates = [c for c in info["columns"]
+                  if c["type"] in STRATA_TYPES and 2 <= (c["distinct_count"] or 0) <= APPROX_MAX_STRATA]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (c["distinct_count"], -(c["null_count"] or 0)))["name"]
+
+def drop_samples(conn, table_name):
+    ensure_samples_table(conn)
+    for (sample,) in conn.execute(f"SELECT sample_table FROM {SAMPLES_TABLE} WHERE table_name = ?",
+                                  (table_name,)).fetchall():
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(sample)}")
+    conn.execute(f"DELETE FROM {SAMPLES_TABLE} WHERE table_name = ?", (table_name,))
+    conn.commit()
+
+def refresh_samples(conn, table_name, fractions=None):
+    """
+    Пересоздаёт выборки таблицы после импорта (по версии из каталога). Таблица читается
+    один раз, для самой крупной выборки; меньшие прореживают её. Таблицы меньше
+    APPROX_MIN_ROWS пропускаются.
+    Возвращает {доля: строк в выборке}.
+    """
+    fractions = sorted(set(APPROX_FRACTIONS if fractions is None else fractions))
+    drop_samples(conn, table_name)
+    info = load_catalog(conn, table_name, build_missing=False)
+    if not fractions or info is None or (info["row_count"] or 0) < APPROX_MIN_ROWS:
+        return {}
+    started = time.perf_counter()
+    source = quote_ident(table_name)
+    stratum = strata_column(info)
+    strata = conn.execute(f"SELECT {quote_ident(stratum) if stratum else 'NULL'}, COUNT(*) "
+                          f"FROM {source} GROUP BY 1").fetchall()
+
+    def rate(fraction, rows):
+        return min(1.0, max(fraction, APPROX_MIN_STRATUM_ROWS / rows))
+
+    def stratum_of(alias):
+        return f"{alias}.{quote_ident(stratum)}" if stratum else "NULL"
+
+    def thresholds(fraction, parent=None):
+        # Меньшая выборка прореживает бо́льшую с условной вероятностью rate / rate родителя
+        return [(round(rate(fraction, rows) / (rate(parent, rows) if parent else 1) * RANDOM_SCALE), value)
+                for value, rows in strata]
+
+    conn.execute("DROP TABLE IF EXISTS temp._sample_rates")
+    conn.execute("CREATE TEMP TABLE _sample_rates (stratum PRIMARY KEY, source_rows INTEGER, threshold INTEGER, "
+                 "weight REAL)")
+    conn.executemany("INSERT INTO temp._sample_rates (stratum, source_rows) VALUES (?, ?)", strata)
+    lookup = "(SELECT r.{} FROM temp._sample_rates r WHERE r.stratum IS {})"
+    results = {}
+    parent = None
+    try:
+        for fraction in reversed(fractions):
+            sample = sample_table_name(table_name, fraction)
+            target = quote_ident(sample)
+            conn.executemany("UPDATE temp._sample_rates SET threshold = ? WHERE stratum IS ?",
+                             thresholds(fraction, parent))
+            origin = source if parent is None else quote_ident(sample_table_name(table_name, parent))
+            columns = "t.*" if parent is not None else f"t.*, 1.0 AS {WEIGHT_COLUMN}"
+            conn.execute(
+                f"CREATE TABLE {target} AS SELECT {columns} FROM {origin} t "
+                f"WHERE abs(random()) % {RANDOM_SCALE} < {lookup.format('threshold', stratum_of('t'))}"
+            )
+            parent = fraction
+            # Вес строки — число строк страты в таблице на строку страты в выборке
+            picked = dict(conn.execute(f"SELECT {stratum_of('t')}, COUNT(*) FROM {target} t GROUP BY 1").fetchall())
+            conn.executemany("UPDATE temp._sample_rates SET weight = ? WHERE stratum IS ?",
+                             [(rows / picked[value] if picked.get(value) else None, value) for value, rows in strata])
+            conn.execute(f"UPDATE {target} SET {WEIGHT_COLUMN} = {lookup.format('weight', stratum_of(target))}")
+            rows = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+            conn.execute(
+                f"INSERT INTO {SAMPLES_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (table_name, fraction, sample, info["version"], info["row_count"], rows, stratum,
+                 datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+            results[fraction] = rows
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp._sample_rates")
+    sizes = ", ".join(f"{f:.1%} — {n} строк" for f, n in sorted(results.items()))
+    print(f"Выборки для '{table_name}': {sizes}"
+          f"{f' (страты по {stratum})' if stratum else ''}, {time.perf_counter() - started:.2f} с.")
+    return results
+
+def choose_sample(conn, table_name, min_rows=APPROX_MIN_SAMPLE_ROWS):
+    """
+    Наименьшая актуальная (той же версии таблицы) выборка не меньше min_rows строк,
+    иначе самая крупная. None, если выборок нет или они устарели.
+    """
+    try:
+        rows = conn.execute(
+            f"SELECT fraction, sample_table, source_version, source_rows, sample_rows, strata_column "
+            f"FROM {SAMPLES_TABLE} WHERE table_name = ? ORDER BY fraction", (table_name,)
+        ).fetchall()
+    except Exception:
+        return None
+    version = table_versions(conn, [table_name]).get(table_name)
+    fresh = [r for r in rows if r[2] == version]
+    if not fresh:
+        return None
+    chosen = next((r for r in fresh if r[4] >= min_rows), fresh[-1])
+    return {"table": table_name, "fraction": chosen[0], "sample_table": chosen[1], "source_rows": chosen[3],
+            "sample_rows": chosen[4], "strata_column": chosen[5]}
+
+def _mask(sql):
+    """
+    Строки и имена в кавычках заменяются заполнителем той же длины: позиции совпадают
+    с исходным текстом, а ключевые слова внутри них не мешают разбору.
+    """
+    return _STRING_RE.sub(lambda m: m.group(0)[0] + "_" * (len(m.group(0)) - 2) + m.group(0)[-1], sql)
+
+def _closing_paren(masked, start):
+    depth = 0
+    for i in range(start, len(masked)):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+def _split_top_level(masked, start, end):
+    """
+    Границы элементов списка через запятую на верхнем уровне скобок.
+    """
+    parts, depth, begin = [], 0, start
+    for i in range(start, end):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+        elif masked[i] == "," and depth == 0:
+            parts.append((begin, i))
+            begin = i + 1
+    parts.append((begin, end))
+    return parts
+
+def _aggregate_parts(func, arg):
+    """
+    (оценка по выборке, выражение значения, условие учёта строки) для агрегата.
+    """
+    w = WEIGHT_COLUMN
+    func = func.upper()
+    if func == "COUNT":
+        if arg.strip() == "*":
+            return f"TOTAL({w})", "1", "1"
+        return f"TOTAL(CASE WHEN ({arg}) IS NOT NULL THEN {w} END)", "1", f"({arg}) IS NOT NULL"
+    if func == "AVG":
+        return (f"(SUM(({arg}) * {w}) / SUM(CASE WHEN ({arg}) IS NOT NULL THEN {w} END))",
+                f"({arg})", f"({arg}) IS NOT NULL")
+    return f"{func}(({arg}) * {w})", f"({arg})", f"({arg}) IS NOT NULL"
+
+def _rewrite_aggregates(sql, masked, start, end):
+    """
+    Текст sql[start:end] с агрегатами, пересчитанными на взвешенную выборку,
+    и список найденных агрегатов [(функция, аргумент)].
+    """
+    out, found, pos = [], [], start
+    for m in _AGGREGATE_RE.finditer(masked, start, end):
+        if m.start() < pos:
+            continue
+        close = _closing_paren(masked, m.end() - 1)
+        if close is None or close > end:
+            return None, []
+        arg = sql[m.end():close]
+        estimate, _, _ = _aggregate_parts(m.group(1), arg)
+        out += [sql[pos:m.start()], estimate]
+        found.append((m.group(1).upper(), arg))
+        pos = close + 1
+    out.append(sql[pos:end])
+    return "".join(out), found
+
+def rewrite_for_sample(sql, table_name, sample_table):
+    """
+    Агрегирующий запрос к одной таблице, переписанный на выборку: (SQL, оценки).
+    Оценки — [{"column", "kind", "digits", "hidden"}] для столбцов-агрегатов, по ним
+    после выполнения считаются доверительные интервалы; ROWS_COLUMN — строк выборки в группе.
+    None — запрос не приближается (соединения, подзапросы, оконные функции, MIN/MAX,
+    агрегаты по DISTINCT, нет агрегатов).
+    """
+    sql = sql.strip().rstrip(";")
+    masked = _mask(sql)
+    if len(re.findall(r"\bSELECT\b", masked, re.I)) != 1 or _UNSUPPORTED_RE.search(masked):
+        return None
+    if not _AGGREGATE_RE.search(masked):
+        return None
+    select = re.match(r"\s*SELECT\s+(?:DISTINCT\s+)?", masked, re.I)
+    source = re.compile(rf"\bFROM\s+({_IDENT})(\s+(?:AS\s+)?({_IDENT}))?", re.I).search(masked)
+    if not select or not source:
+        return None
+    name = sql[source.start(1):source.end(1)]
+    if name.strip('"`[]').replace('""', '"') != table_name:
+        return None
+    alias = source.group(3)
+    has_alias = alias is not None and alias.lower() not in _NOT_ALIAS
+
+    items = []
+    estimates = []
+    for i, (a, b) in enumerate(_split_top_level(masked, select.end(), source.start())):
+        text, item_masked = sql[a:b].strip(), masked[a:b].strip()
+        rewritten, found = _rewrite_aggregates(text, item_masked, 0, len(text))
+        if rewritten is None:
+            return None
+        if not found:
+            items.append(text)
+            continue
+        alias_match = _ALIAS_RE.search(item_masked)
+        if alias_match:
+            column = text[alias_match.start(1):].strip('"`[]').replace('""', '"')
+            expression = text[:alias_match.start()].strip()
+            rewritten = rewritten[:len(rewritten) - (len(text) - alias_match.start())].strip()
+        else:
+            column, expression = text, text
+        items.append(f"{rewritten} AS {quote_ident(column)}")
+        # Интервал — для столбца из одного агрегата (возможно, под ROUND)
+        rounded = _ROUND_RE.match(expression)
+        inner = rounded.group(1).strip() if rounded else expression
+        single = _AGGREGATE_RE.match(inner)
+        if len(found) != 1 or not single or _closing_paren(_mask(inner), single.end() - 1) != len(inner) - 1:
+            continue
+        func, arg = found[0]
+        _, value, present = _aggregate_parts(func, arg)
+        w, dw = WEIGHT_COLUMN, f"{WEIGHT_COLUMN} * ({WEIGHT_COLUMN} - 1)"
+        hidden = {
+            "a": f"TOTAL({dw} * {value} * {value})",
+            "b": f"TOTAL({dw} * {value})",
+            "c": f"TOTAL(CASE WHEN {present} THEN {dw} END)",
+            "n": f"TOTAL(CASE WHEN {present} THEN {w} END)",
+            "s": f"TOTAL({w} * {value})",
+        }
+        names = {k: f"_approx{i}_{k}" for k in hidden}
+        items += [f"{expr} AS {names[k]}" for k, expr in hidden.items()]
+        estimates.append({"column": column, "kind": func.lower(), "hidden": names,
+                          "digits": int(rounded.group(2)) if rounded and rounded.group(2) else None})
+
+    items.append(f"COUNT(*) AS {ROWS_COLUMN}")
+    head = sql[:select.end()]
+    source_sql = (f"FROM {quote_ident(sample_table)}" if has_alias
+                  else f"FROM {quote_ident(sample_table)} AS {quote_ident(table_name)}")
+    tail_start = source.end(2) if has_alias else source.end(1)
+    tail, _ = _rewrite_aggregates(sql, masked, tail_start, len(sql))
+    if tail is None:
+        return None
+    rest = sql[source.end(1):tail_start]
+    return f"{head}{', '.join(items)} {source_sql}{rest}{tail};", estimates
+
+def approximate_query(conn, sql):
+    """
+    (SQL по выборке, сведения о выборке и оценках) или None, если для запроса
+    нет актуальной выборки или он не приближается.
+    """
+    tables = source_tables(sql)
+    if len(tables) != 1 or not table_versions(conn, tables):
+        return None
+    sample = choose_sample(conn, tables[0])
+    if sample is None:
+        return None
+    rewritten = rewrite_for_sample(sql, tables[0], sample["sample_table"])
+    if rewritten is None:
+        return None
+    approx_sql, estimates = rewritten
+    return approx_sql, dict(sample, estimates=estimates, confidence=APPROX_CONFIDENCE)
+
+def enough_rows(df, min_rows=APPROX_MIN_GROUP_ROWS):
+    """
+    Каждая строка результата по выборке посчитана не меньше чем по min_rows строкам выборки.
+    Пустой результат или редкая группа (селективный фильтр) — считать точно.
+    """
+    return not df.empty and ROWS_COLUMN in df.columns and df[ROWS_COLUMN].min() >= min_rows
+
+def finish_result(df, info):
+    """
+    Результат запроса по выборке: рядом с оценками — столбцы «<оценка> ±» (полуширина
+    доверительного интервала), служебные столбцы удаляются, число строк — целое.
+    Сведения о выборке сохраняются в df.attrs["approximate"].
+    """
+    z = statistics.NormalDist().inv_cdf((1 + info["confidence"]) / 2)
+    df = df.copy()
+    for est in info["estimates"]:
+        names = est["hidden"]
+        if est["column"] not in df.columns or any(n not in df.columns for n in names.values()):
+            continue
+        a, b, c, n, s = (df[names[k]].astype("float64") for k in "abcns")
+        if est["kind"] == "count":
+            variance = c
+        elif est["kind"] == "avg":
+            ratio = s / n.where(n > 0)
+            variance = (a - 2 * ratio * b + ratio * ratio * c) / (n * n).where(n > 0)
+        else:
+            variance = a
+        half = z * variance.clip(lower=0).map(math.sqrt)
+        if est["digits"] is not None:
+            half = half.round(est["digits"])
+        if est["kind"] == "count" and df[est["column"]].notna().all():
+            df[est["column"]] = df[est["column"]].round().astype("int64")
+            half = half.round()
+        df.insert(df.columns.get_loc(est["column"]) + 1, f"{est['column']} ±", half)
+    df = df.drop(columns=[c for c in df.columns if isinstance(c, str) and c.startswith("_approx")])
+    df.attrs["approximate"] = {k: info[k] for k in ("table", "fraction", "sample_rows", "source_rows",
+                                                   "strata_column", "confidence")}
+    return df
+
+def describe(info):
+    return (f"Приблизительный ответ по выборке {info['fraction']:.1%} ({info['sample_rows']:,} из "
+            f"{info['source_rows']:,} строк{', страты по ' + info['strata_column'] if info['strata_column'] else ''}), "
+            f"± — {info['confidence']:.0%} доверительный интервал.")
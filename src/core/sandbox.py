@@ -0,0 +1,330 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from core.inference import widen_integers
+
+try:
+    import resource  # только POSIX: лимит памяти воркера
+except ImportError:
+    resource = None
+
+# Исполнение сгенерированного LLM pandas-кода в пуле заранее запущенных процессов.
+# Таблица передаётся воркерам через разделяемую память (без копии на каждый вопрос),
+# у каждого запуска есть лимит времени и памяти; зависший воркер убивается и заменяется.
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "30"))  # секунды на один запуск
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "1024"))  # сверх размера таблицы
+POLL_INTERVAL = 0.05
+ALIGN = 8
+
+SAFE_BUILTINS = {
+    'len': len,
+    'range': range,
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'abs': abs,
+}
+
+class SandboxError(Exception):
+    pass
+
+class SandboxTimeout(SandboxError):
+    pass
+
+class SharedTable:
+    """
+    Столбцы DataFrame в одном блоке разделяемой памяти. Числа, bool и datetime64
+    лежат как есть; остальные столбцы кодируются словарём (коды int32 в блоке,
+    словарь значений — в spec). Воркер собирает DataFrame поверх блока без копирования.
+    Блок освобождается после close(), когда закончатся все запуски, которые его используют.
+    """
+    def __init__(self, df):
+        columns = []
+        arrays = []
+        offset = 0
+        for name in df.columns:
+            col = df[name]
+            dtype = col.dtype
+            if isinstance(dtype, np.dtype) and dtype.kind in "biufM":
+                values = np.ascontiguousarray(col.to_numpy())
+                categories = None
+            else:
+                codes, uniques = pd.factorize(col, use_na_sentinel=True)
+                values = codes.astype(np.int32)
+                categories = list(uniques)
+            columns.append((name, values.dtype.str, offset, len(values), categories))
+            arrays.append(values)
+            offset += -(-values.nbytes // ALIGN) * ALIGN
+        self.nbytes = offset
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (_, _, start, _, _), values in zip(columns, arrays):
+            self.shm.buf[start:start + values.nbytes] = values.view(np.uint8).reshape(-1)
+        self.name = self.shm.name
+        self.spec = {"name": self.shm.name, "columns": columns, "index": list(df.index)
+                     if not isinstance(df.index, pd.RangeIndex) else None}
+        self._refs = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            free = self._closed and not self._refs
+        if free:
+            self._free()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            free = not self._refs
+        if free:
+            self._free()
+
+    def _free(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+def _attach(name):
+    # Воркеры делят resource_tracker с родителем: блок удаляет только владелец (SharedTable.close)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+def attach_table(spec):
+    """
+    (shm, DataFrame) поверх разделяемого блока. Массивы только для чтения: изменения
+    в сгенерированном коде копируют столбец (copy-on-write) и не портят общую таблицу.
+    """
+    shm = _attach(spec["name"])
+    data = {}
+    for name, dtype, offset, length, categories in spec["columns"]:
+        values = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+        values.flags.writeable = False
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories=pd.Index(categories, dtype=object))
+        data[name] = values
+    df = pd.DataFrame(data, index=spec["index"], copy=False)
+    return shm, df
+
+def _enable_copy_on_write():
+    # В pandas 3 copy-on-write включён всегда, в 2.x — опция
+    if int(pd.__version__.split(".")[0]) < 3:
+        try:
+            pd.set_option("mode.copy_on_write", True)
+        except Exception:
+            pass
+
+def _virtual_memory_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _limit_memory(memory_mb):
+    if resource is None or not memory_mb:
+        return
+    current = _virtual_memory_bytes()
+    if current is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    soft = current + memory_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+def execute_code(code, df):
+    """
+    Выполняет код с df в окружении pd/np и урезанными builtins.
+    Возвращает result_df, answer или None.
+    """
+    local_vars = {"df": df}
+    exec(code, {"pd": pd, "np": np, "__builtins__": SAFE_BUILTINS}, local_vars)
+    if "result_df" in local_vars and isinstance(local_vars["result_df"], pd.DataFrame):
+        return local_vars["result_df"]
+    return local_vars.get("answer")
+
+def _worker_main(conn, memory_mb):
+    _enable_copy_on_write()
+    attached = {}  # имя блока -> (shm, DataFrame); держим последние две таблицы
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        name, spec, code = message
+        if name not in attached and spec is None:
+            # Описание таблицы приходит только для ещё не подключённого блока
+            conn.send(("need_spec", None))
+            continue
+        try:
+            if name not in attached:
+                while len(attached) >= 2:
+                    old_shm, _ = attached.pop(next(iter(attached)))
+                    old_shm.close()
+                attached[name] = attach_table(spec)
+            df = attached[name][1].copy(deep=False)
+            _limit_memory(memory_mb)
+            reply = ("ok", execute_code(code, df))
+        except MemoryError:
+            reply = ("error", f"превышен лимит памяти ({memory_mb} МБ)")
+        except BaseException as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send(("error", f"результат нельзя передать: {e}"))
+
+class CodeSandbox:
+    """
+    Пул процессов-воркеров для сгенерированного кода. run() блокирует вызывающий
+    поток до ответа, срока или отмены; при сроке/отмене воркер убивается и заменяется.
+    """
+    def __init__(self, workers=SANDBOX_WORKERS, memory_mb=SANDBOX_MEMORY_MB):
+        self.memory_mb = memory_mb
+        self._ctx = multiprocessing.get_context()
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        if os.name == "posix":
+            # Трекер разделяемой памяти запускается до воркеров, чтобы они делили его с родителем
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        for _ in range(max(1, workers)):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child, self.memory_mb),
+                                    name="sandbox", daemon=True)
+        process.start()
+        child.close()
+        worker = (process, parent)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+        with self._lock:
+            self._workers.discard(worker)
+        return self._spawn()
+
+    def run(self, table, code, timeout=SANDBOX_TIMEOUT, cancel=None):
+        """
+        Выполняет code над таблицей table (SharedTable). Возвращает result_df/answer;
+        SandboxTimeout — по сроку или отмене (threading.Event cancel), SandboxError — при ошибке.
+        Словари категорий и индекс (spec) передаются воркеру, только если блок у него
+        ещё не подключён; обычно отправляются имя блока и код.
+        """
+        worker = self._idle.get()
+        try:
+            process, conn = worker
+            end = time.monotonic() + timeout
+            message = (table.name, None, code)
+            while True:
+                conn.send(message)
+                while not conn.poll(POLL_INTERVAL):
+                    if cancel is not None and cancel.is_set():
+                        worker = self._replace(worker)
+                        raise SandboxTimeout("выполнение отменено")
+                    if time.monotonic() > end:
+                        worker = self._replace(worker)
+                        raise SandboxTimeout(f"превышено время выполнения ({timeout:g} с)")
+                    if not process.is_alive():
+                        break
+                status, payload = conn.recv()
+                if status != "need_spec":
+                    break
+                message = (table.name, table.spec, code)
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            raise SandboxError("процесс-исполнитель аварийно завершился")
+        finally:
+            self._idle.put(worker)
+        if status != "ok":
+            raise SandboxError(payload)
+        return payload
+
+    def close(self):
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for process, conn in workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+
+_sandbox = None
+_shared = None  # (DataFrame, SharedTable) последней переданной таблицы
+_sandbox_lock = threading.Lock()
+
+def get_sandbox():
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = CodeSandbox()
+        return _sandbox
+
+def _share(df):
+    global _shared
+    if _shared is not None and _shared[0] is df:
+        return _shared[1]
+    if _shared is not None:
+        # Блок удалится, когда закончатся запуски, которые ещё его используют
+        _shared[1].close()
+    # Целые — в int64, как в обычном pandas: коду над таблицей не должны достаться int8
+    _shared = (df, SharedTable(widen_integers(df)))
+    return _shared[1]
+
+def run_code(df, code, timeout=SANDBOX_TIMEOUT, cancel=None):
+    sandbox = get_sandbox()
+    with _sandbox_lock:
+        table = _share(df)
+        table.acquire()
+    try:
+        return sandbox.run(table, code, timeout, cancel)
+    finally:
+        table.release()
+
+def shutdown():
+    global _sandbox, _shared
+    with _sandbox_lock:
+        if _sandbox is not None:
+            _sandbox.close()
+            _sandbox = None
+        if _shared is not None:
+            _shared[1].close()
+            _shared = None
+
+atexit.register(shutdown)
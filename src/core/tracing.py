@@ -0,0 +1,162 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+# Трассировка этапов обработки вопроса: длительности и атрибуты спанов пишутся в JSONL.
+# При выключенной трассировке span() возвращает общий пустой объект — накладные расходы
+# сводятся к одной проверке флага.
+TRACE_ENABLED = os.getenv("TRACE", "0").lower() in ("1", "yes", "on", "true")
+TRACE_PATH = os.getenv("TRACE_PATH", "trace.jsonl")
+TRACE_FLUSH_EVERY = 50
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_buffer = []
+_lock = threading.Lock()
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def add(self, key, value=1):
+        return self
+
+NOOP_SPAN = _NoopSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "_t0", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self._token = None
+
+    def __enter__(self):
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        record = {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "start": round(self.start, 6), "duration_ms": round(duration * 1000, 3),
+        }
+        record.update(self.attrs)
+        _emit(record)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def add(self, key, value=1):
+        self.attrs[key] = self.attrs.get(key, 0) + value
+        return self
+
+def span(name, **attrs):
+    """
+    Контекстный менеджер этапа: with span("sql.execute", table=...) as s: ...; s.set(rows=n).
+    Вложенные спаны наследуют trace_id и ссылаются на родителя.
+    """
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    return Span(name, attrs)
+
+def traced(name, result_attrs=None):
+    """
+    Декоратор: вызов функции как спан. result_attrs(результат) -> dict дописывает
+    атрибуты по результату (например, число строк).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACE_ENABLED:
+                return fn(*args, **kwargs)
+            with Span(name, {}) as s:
+                result = fn(*args, **kwargs)
+                if result_attrs is not None:
+                    s.set(**result_attrs(result))
+                return result
+        return wrapper
+    return decorator
+
+def current_span():
+    """
+    Текущий спан (или пустой объект), чтобы дописать атрибуты из глубины вызовов.
+    """
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    return _current.get() or NOOP_SPAN
+
+def _emit(record):
+    with _lock:
+        _buffer.append(record)
+        if len(_buffer) >= TRACE_FLUSH_EVERY:
+            _flush_locked()
+
+def _flush_locked():
+    if not _buffer:
+        return
+    with open(TRACE_PATH, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in _buffer))
+    _buffer.clear()
+
+def flush():
+    with _lock:
+        _flush_locked()
+
+atexit.register(flush)
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summarize(path=None):
+    """
+    Сводка по файлу трассировки: {имя спана: {"count", "p50_ms", "p95_ms", "max_ms"}}.
+    """
+    flush()
+    durations = {}
+    with open(path or TRACE_PATH, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                durations.setdefault(r["name"], []).append(r["duration_ms"])
+    return {
+        name: {"count": len(v), "p50_ms": round(_percentile(v, 0.5), 3),
+               "p95_ms": round(_percentile(v, 0.95), 3), "max_ms": round(max(v), 3)}
+        for name, v in sorted(durations.items())
+    }
+
+def print_summary(path=None):
+    summary = summarize(path)
+    print(f"{'Этап':<24}{'вызовов':>9}{'p50, мс':>12}{'p95, мс':>12}{'max, мс':>12}")
+    for name, s in summary.items():
+        print(f"{name:<24}{s['count']:>9}{s['p50_ms']:>12.1f}{s['p95_ms']:>12.1f}{s['max_ms']:>12.1f}")
+
+if __name__ == "__main__":
+    import sys
+    print_summary(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,18 +1,25 @@
 from core.config import model, key as CONFIG_KEY
-from core.database import list_tables_from_db, load_tables_from_db
-from core.pipeline import process_question, apply_simple_task, save_with_explanations_to_excel, ask_mistral_simple
-from agents.sql_agent import answer_question_sql
-from utils.session import save_history, add_message, message_history, reset_session_timer, clear_history
+from core.database import connect, list_tables_from_db
+from core.catalog import load_catalog
+from core.pipeline import apply_simple_task, save_with_explanations_to_excel, ask_mistral_simple
+from agents.sql_agent import answer_question_sql, answer_question_combined, answer_question_speculative, answer_exact
+from utils.session import add_message, message_history, reset_session_timer, clear_history
+from utils import history as history_log
 from agents.importer import reformat_query
-import sqlite3
-import datetime
+from core import llm_cache, result_cache, tracing
+from core.intents import route_intent, intent_info, EXPORT_RE
+from core.export import export_result
+import time
+import re
+import uuid
 import pandas as pd
 import os
 
 API_KEY = os.getenv("MISTRAL_API_KEY") or CONFIG_KEY
 MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", model)
-HISTORY_FILE = "history.xlsx"
 DB_PATH = "main.db"
+QUESTION_MODE = os.getenv("QUESTION_MODE", "combined")  # combined | speculative | serial
+EXACT_RE = re.compile(r"^\s*(точно|точный ответ|exact)\s*[.!]?\s*$", re.IGNORECASE)
 
 SYSTEM_PROMPT = {
     "role": "system",
@@ -25,7 +32,7 @@ SYSTEM_PROMPT = {
 }
 
 def run_agent_session():
-    history = []
+    session_id = uuid.uuid4().hex
     user_qa_list = []
     clear_history()
     add_message(SYSTEM_PROMPT["role"], SYSTEM_PROMPT["content"])
@@ -37,70 +44,150 @@ def run_agent_session():
         print("В базе нет таблиц.")
         return
 
-    selected_tables = select_tables(tables)
+    conn = connect(DB_PATH)
+    selected_tables = select_tables(tables, conn)
     if not selected_tables:
         print("Таблицы не выбраны.")
+        conn.close()
         return
 
-    # 2. Загрузка выбранной таблицы
-    dfs = load_tables_from_db(selected_tables)
-    df0 = dfs[0].copy(deep=True)
-    orig_names = list(df0.columns)
+    # 2. Схема выбранной таблицы из каталога (строки не загружаются)
+    catalog = load_catalog(conn, selected_tables[0])
+    orig_names = [c["name"] for c in catalog["columns"]]
     new_names = orig_names
     explanations = [""] * len(orig_names)
 
-    conn = sqlite3.connect(DB_PATH)
-
     print("Теперь вы можете задавать вопросы к таблице (пустая строка — завершить):")
+    approximate = None  # последний приблизительный ответ: (результат, переформулировка)
     while True:
         user_q = input("Вопрос: ").strip()
         if not user_q:
             break
         add_message('user', user_q)
 
-        # ==== Сначала реформатируем вопрос через LLM ====
+        started = time.perf_counter()
+        streamed = []
+
+        def show_rephrased(text):
+            # Переформулировка из потокового ответа LLM печатается по мере генерации
+            if not streamed:
+                print("\nПереформулированный запрос: ", end="")
+            streamed.append(text)
+            print(text, end="", flush=True)
+
         try:
-            rephrased, need_excel = reformat_query({"content": user_q}, message_history)
+            if approximate is not None and EXACT_RE.match(user_q):
+                # Уточнение приблизительного ответа: тот же SQL по всей таблице
+                rephrased, need_excel = approximate[1], False
+                sql_answer = answer_exact(conn, approximate[0], rephrased, API_KEY)
+            else:
+                rephrased, need_excel, sql_answer = handle_question(
+                    conn, selected_tables[0], orig_names, user_q, message_history, on_text=show_rephrased
+                )
         except Exception as e:
-            print("Ошибка реформатирования:", e)
+            if streamed:
+                print()
+            print("Ошибка обработки вопроса:", e)
+            history_log.log_event(session_id, selected_tables, user_q, status="error",
+                                  duration_ms=1000 * (time.perf_counter() - started))
             continue
+        duration_ms = 1000 * (time.perf_counter() - started)
 
-        print(f"\nПереформулированный запрос: {rephrased}\nНужно создать Excel: {'Да' if need_excel else 'Нет'}")
-
-        # ==== Отправляем на обработку SQL-агенту ====
-        sql_answer = answer_question_sql(conn, selected_tables[0], orig_names, rephrased, API_KEY)
+        if not streamed:
+            print(f"\nПереформулированный запрос: {rephrased}", end="")
+        print(f"\nНужно создать Excel: {'Да' if need_excel else 'Нет'}")
         add_message('assistant', sql_answer)
         print(sql_answer)
         user_qa_list.append((user_q, sql_answer))
 
+        is_table = isinstance(sql_answer, pd.DataFrame)
+        approximate = (sql_answer, rephrased) if is_table and sql_answer.attrs.get("approximate") else None
+        file_name = ""
         # ==== Если нужно сохранить Excel ====
-        if need_excel and isinstance(sql_answer, pd.DataFrame):
-            file_name = input("Имя файла для Excel (.xlsx): ").strip()
-            if not file_name.endswith(".xlsx"):
+        if need_excel and is_table:
+            file_name = input("Имя файла для Excel (.xlsx, .csv или .csv.gz): ").strip()
+            if not file_name.lower().endswith((".xlsx", ".csv", ".csv.gz")):
                 file_name += ".xlsx"
-            sql_answer.to_excel(file_name, index=False)
-            print(f"Результат выгружен в {file_name}")
+            try:
+                export_result(conn, sql_answer, file_name)
+            except Exception as e:
+                print("Ошибка выгрузки:", e)
+                file_name = ""
+        history_log.log_event(
+            session_id, selected_tables, user_q, rephrased,
+            sql=sql_answer.attrs.get("sql", "") if is_table else "",
+            status=history_log.answer_status(sql_answer),
+            rows=len(sql_answer) if is_table else None, duration_ms=duration_ms, output_file=file_name,
+        )
 
     conn.close()
-
-    # Сохраняем только последнюю историю
-    if user_qa_list:
-        history.append({
-            "timestamp": datetime.datetime.now(),
-            "tables": ", ".join(selected_tables),
-            "task": user_qa_list[-1][0],
-            "output_file": file_name if 'file_name' in locals() else ""
-        })
-        save_history(history)
-
-def select_tables(tables):
+    info = llm_cache.cache_info()
+    if info["hits"] or info["misses"]:
+        print(f"Кэш LLM: попаданий {info['hits']}, промахов {info['misses']} ({info['hit_rate']:.0%}).")
+    info = result_cache.cache_info()
+    if info["hits"] or info["disk_hits"]:
+        print(f"Кэш результатов SQL: попаданий {info['hits'] + info['disk_hits']}, промахов {info['misses']}.")
+    info = intent_info()
+    if info["hits"]:
+        print(f"Локальные команды: {info['hits']} из {info['hits'] + info['misses']} вопросов "
+              f"({info['hit_rate']:.0%}), в среднем {info['avg_ms']:.1f} мс.")
+
+    if tracing.TRACE_ENABLED:
+        tracing.print_summary()
+
+    history_log.flush()
+
+def handle_question(conn, table_name, columns, user_q, history, on_text=None):
+    """
+    Один вопрос целиком: сначала локальные команды прямо в SQLite (без LLM),
+    иначе переформулировка + SQL через LLM. Возвращает (rephrased, need_excel, ответ).
+    on_text получает переформулировку по частям, если ответ LLM потоковый (LLM_STREAM).
+    """
+    with tracing.span("question", table=table_name, mode=QUESTION_MODE, question_chars=len(user_q)) as s:
+        local = route_intent(conn, table_name, user_q)
+        if local is not None:
+            s.set(local=True)
+            print("Выполнено локально, без LLM.")
+            return user_q, bool(EXPORT_RE.search(user_q)), local[0]
+        s.set(local=False)
+        result = answer_question(conn, table_name, columns, user_q, history, on_text)
+        if isinstance(result[2], pd.DataFrame):
+            s.set(rows=len(result[2]))
+        return result
+
+def answer_question(conn, table_name, columns, user_q, history, on_text=None):
+    """
+    Ответ на вопрос в режиме QUESTION_MODE:
+    combined — один запрос к LLM (переформулировка, флаг Excel и SQL в одном ответе);
+    speculative — переформулировка и SQL по исходному вопросу параллельно;
+    serial — переформулировка, затем SQL (два последовательных запроса).
+    """
+    if QUESTION_MODE == "combined":
+        return answer_question_combined(conn, table_name, columns, user_q, API_KEY,
+                                        message_history=history, on_text=on_text)
+    if QUESTION_MODE == "speculative":
+        return answer_question_speculative(conn, table_name, columns, user_q, API_KEY,
+                                           message_history=history, on_text=on_text)
+    rephrased, need_excel = reformat_query({"content": user_q}, history, on_text=on_text)
+    return rephrased, need_excel, answer_question_sql(conn, table_name, columns, rephrased, API_KEY)
+
+def select_tables(tables, conn=None):
     print("С какой(ими) таблицей будем работать? (введите номера через запятую):")
     for idx, t in enumerate(tables):
-        print(f"{idx+1}. {t}")
+        info = load_catalog(conn, t, build_missing=False) if conn is not None else None
+        if info:
+            print(f"{idx+1}. {t} (строк: {info['row_count']}, столбцов: {info['column_count']})")
+        else:
+            print(f"{idx+1}. {t}")
     selected = input("Введите номера через запятую: ")
     indices = [int(i)-1 for i in selected.strip().split(",") if i.strip().isdigit() and 0 < int(i) <= len(tables)]
     selected_tables = [tables[i] for i in indices]
     return selected_tables
 
 if __name__ == "__main__":
+    import sys
+    if "--purge-cache" in sys.argv:
+        print(f"Кэш LLM очищен, удалено записей: {llm_cache.purge()}")
+    if "--no-cache" in sys.argv:
+        llm_cache.LLM_CACHE_ENABLED = False
     run_agent_session()
@@ -0,0 +1,335 @@
+"""
+HTTP-сервис для нескольких аналитиков одновременно (asyncio, только стандартная библиотека).
+
+    python server.py --host 127.0.0.1 --port 8000
+
+GET    /tables                               — таблицы с числом строк и столбцов
+POST   /sessions {"tables": [...]}           — новая сессия: {"session_id"}
+DELETE /sessions/<id>                        — завершить сессию
+POST   /ask {"session_id", "table", "question"} — ответ на вопрос (без session_id создаётся сессия;
+                                             "exact": true — без приблизительного ответа по выборке)
+GET    /export?session_id=<id>&format=xlsx   — полная выгрузка последнего результата (xlsx, csv, csv.gz)
+
+У каждой сессии своя история; истечение по бездействию — через одно колесо таймеров.
+База открывается только на чтение через общий пул соединений.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+from core import llm_client, sampling
+from core.engine import open_pool
+from core.catalog import ensure_catalog, is_internal_table, load_catalog, table_versions
+from core.database import DB_PATH, connect, list_tables_from_db, sql_deadline
+from core.export import export_result
+from main import SYSTEM_PROMPT, handle_question
+from utils import history as history_log
+from utils.session import SessionStore, session_timeout
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+SERVER_REQUEST_TIMEOUT = float(os.getenv("SERVER_REQUEST_TIMEOUT", "120"))  # секунды на вопрос
+MAX_BODY_BYTES = 1024 * 1024
+EXPORT_CHUNK_BYTES = 1024 * 1024
+EXPORT_FORMATS = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                  "csv": "text/csv; charset=utf-8", "csv.gz": "application/gzip"}
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def result_payload(answer):
+    """
+    Ответ в JSON: таблица — {"columns", "data"}, иначе текст.
+    """
+    if isinstance(answer, pd.DataFrame):
+        return {"type": "table", **json.loads(answer.to_json(orient="split", index=False, date_format="iso"))}
+    return {"type": "text", "text": str(answer)}
+
+class AnalystService:
+    def __init__(self, db_path=DB_PATH, workers=SERVER_WORKERS, timeout=SERVER_REQUEST_TIMEOUT):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.pool = open_pool(db_path, size=workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask")
+        self.sessions = SessionStore(session_timeout)
+        self.routes = {
+            ("GET", "/tables"): self.list_tables,
+            ("POST", "/sessions"): self.create_session,
+            ("POST", "/ask"): self.ask,
+            ("GET", "/export"): self.export,
+        }
+
+    def prepare(self):
+        """
+        Каталог всех таблиц строится заранее обычным соединением: дальше пул только читает.
+        """
+        conn = connect(self.db_path)
+        ensure_catalog(conn)  # и идентификатор базы для ключей кэша результатов
+        for table in list_tables_from_db(self.db_path):
+            load_catalog(conn, table)
+        conn.close()
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _tables(self):
+        with self.pool.connection() as conn:
+            names = [r[0] for r in conn.execute(
+                f"SELECT name FROM {self.pool.schema}.sqlite_master WHERE type='table' ORDER BY rowid")]
+            result = []
+            for name in names:
+                if is_internal_table(name):
+                    continue
+                info = load_catalog(conn, name, build_missing=False)
+                result.append({"name": name, "rows": info and info["row_count"],
+                               "columns": info and info["column_count"]})
+        return result
+
+    async def list_tables(self, query, body):
+        return 200, {"tables": await self._run(self._tables)}
+
+    def _known_tables(self, names):
+        with self.pool.connection() as conn:
+            return set(table_versions(conn, names))
+
+    async def _session_tables(self, body):
+        """
+        Таблицы новой сессии из тела запроса: список имён таблиц базы, иначе 400.
+        """
+        tables = body.get("tables")
+        if tables is None:
+            return []
+        if not isinstance(tables, list) or not all(isinstance(t, str) and t for t in tables):
+            raise HTTPError(400, "tables должен быть списком имён таблиц")
+        known = await self._run(self._known_tables, tables)
+        unknown = [t for t in tables if t not in known]
+        if unknown:
+            raise HTTPError(400, f"Таблиц нет в базе: {', '.join(unknown)}")
+        return tables
+
+    async def create_session(self, query, body):
+        session = self.sessions.create(await self._session_tables(body))
+        session.add_message(SYSTEM_PROMPT["role"], SYSTEM_PROMPT["content"])
+        return 201, {"session_id": session.id, "tables": session.tables}
+
+    def delete_session(self, session_id):
+        if not self.sessions.drop(session_id):
+            raise HTTPError(404, "Сессия не найдена")
+        return 204, None
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, "Сессия не найдена или истекла")
+        return session
+
+    def _answer(self, table, question, history, cancel=None, exact=False):
+        with self.pool.connection() as conn:
+            catalog = load_catalog(conn, table, build_missing=False)
+            if catalog is None:
+                raise HTTPError(404, f"Таблица '{table}' не найдена")
+            columns = [c["name"] for c in catalog["columns"]]
+            with llm_client.deadline(self.timeout), sql_deadline(conn, self.timeout, cancel=cancel), \
+                    sampling.approximate_mode(False if exact else None):
+                return handle_question(conn, table, columns, question, history)
+
+    async def ask(self, query, body):
+        question = str(body.get("question") or "").strip()
+        if not question:
+            raise HTTPError(400, "Не задан вопрос (question)")
+        if body.get("session_id"):
+            session = self._session(body["session_id"])
+        else:
+            session = self.sessions.create(await self._session_tables(body))
+            session.add_message(SYSTEM_PROMPT["role"], SYSTEM_PROMPT["content"])
+        table = body.get("table") or (session.tables[0] if session.tables else None)
+        if not table or not isinstance(table, str):
+            raise HTTPError(400, "Не задана таблица (table)")
+        # Вопросы одной сессии идут по очереди, разные сессии — параллельно
+        async with session.lock:
+            session.add_message("user", question)
+            started = time.perf_counter()
+            try:
+                rephrased, need_excel, answer = await self._run(self._answer, table, question, list(session.history),
+                                                             session.cancel, bool(body.get("exact")))
+            except Exception:
+                history_log.log_event(session.id, [table], question, status="error", source="http",
+                                      duration_ms=1000 * (time.perf_counter() - started))
+                raise
+            is_table = isinstance(answer, pd.DataFrame)
+            history_log.log_event(
+                session.id, [table], question, rephrased, answer.attrs.get("sql", "") if is_table else "",
+                history_log.answer_status(answer), len(answer) if is_table else None,
+                1000 * (time.perf_counter() - started), source="http",
+            )
+            text = answer.to_string(index=False, max_rows=20) if isinstance(answer, pd.DataFrame) else str(answer)
+            session.add_message("assistant", text)
+            if isinstance(answer, pd.DataFrame):
+                session.last_result = answer
+        return 200, {
+            "session_id": session.id, "table": table, "rephrased": rephrased, "need_excel": need_excel,
+            "sql": answer.attrs.get("sql") if isinstance(answer, pd.DataFrame) else None,
+            "approximate": answer.attrs.get("approximate") if isinstance(answer, pd.DataFrame) else None,
+            "result": result_payload(answer),
+        }
+
+    def _export(self, result, fmt):
+        fd, path = tempfile.mkstemp(suffix="." + fmt)
+        os.close(fd)
+        try:
+            with self.pool.connection() as conn:
+                export_result(conn, result, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    async def export(self, query, body):
+        session = self._session((query.get("session_id") or [""])[0])
+        fmt = (query.get("format") or ["xlsx"])[0].lower()
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPError(400, f"Формат выгрузки: {', '.join(EXPORT_FORMATS)}")
+        if session.last_result is None:
+            raise HTTPError(409, "В сессии ещё нет табличного результата")
+        path = await self._run(self._export, session.last_result, fmt)
+        history_log.log_event(session.id, session.tables, sql=session.last_result.attrs.get("sql", ""),
+                              output_file=f"result.{fmt}", source="http", event="export")
+        return 200, ("file", path, fmt)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/") or "/"
+        if method == "DELETE" and path.startswith("/sessions/"):
+            return self.delete_session(path.rsplit("/", 1)[1])
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(p == path for _, p in self.routes):
+                raise HTTPError(405, "Метод не поддерживается")
+            raise HTTPError(404, "Нет такого адреса")
+        if body:
+            try:
+                body = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "Тело запроса — не JSON")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Тело запроса должно быть JSON-объектом")
+        return await handler(query, body or {})
+
+    async def handle(self, reader, writer):
+        """
+        Соединение HTTP/1.1 с keep-alive: запросы читаются по одному до закрытия.
+        """
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                if isinstance(payload, tuple) and payload[0] == "file":
+                    await send_file(writer, payload[1], payload[2], keep_alive)
+                else:
+                    await send_json(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            await send_json(writer, e.status, {"error": str(e)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pool.close()
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Некорректная строка запроса")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+def _head(status, content_type, length, keep_alive, extra=""):
+    return (
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\nContent-Length: {length}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n{extra}\r\n"
+    ).encode("latin-1")
+
+async def send_json(writer, status, payload, keep_alive):
+    data = b"" if payload is None else json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    writer.write(_head(status, "application/json; charset=utf-8", len(data), keep_alive) + data)
+    await writer.drain()
+
+async def send_file(writer, path, fmt, keep_alive):
+    try:
+        size = os.path.getsize(path)
+        extra = f"Content-Disposition: attachment; filename=\"result.{fmt}\"\r\n"
+        writer.write(_head(200, EXPORT_FORMATS[fmt], size, keep_alive, extra))
+        with open(path, "rb") as f:
+            while chunk := f.read(EXPORT_CHUNK_BYTES):
+                writer.write(chunk)
+                await writer.drain()
+    finally:
+        os.remove(path)
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT, db_path=DB_PATH, workers=SERVER_WORKERS):
+    service = AnalystService(db_path, workers)
+    service.prepare()
+    server = await asyncio.start_server(service.handle, host, port)
+    expiry = asyncio.create_task(service.sessions.wheel.run(service.sessions.expire))
+    print(f"Сервис слушает http://{host}:{server.sockets[0].getsockname()[1]} (потоков: {workers})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        expiry.cancel()
+        service.close()
+        history_log.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP-сервис вопросов к таблицам")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="потоков и соединений для вопросов")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.db, args.workers))
+    except KeyboardInterrupt:
+        pass
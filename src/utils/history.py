@@ -0,0 +1,184 @@
+import atexit
+import datetime
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+# История вопросов: журнал только на дозапись в отдельной базе SQLite. Запись — добавление
+# в буфер в памяти; на диск буфер пачкой пишет фоновый поток (по HISTORY_FLUSH_EVERY записям
+# или раз в HISTORY_FLUSH_SECONDS), остаток — при выходе. Excel-представление строится по запросу.
+HISTORY_DB = os.getenv("HISTORY_DB", "history.db")
+HISTORY_FILE = "history.xlsx"
+HISTORY_FLUSH_EVERY = 50
+HISTORY_FLUSH_SECONDS = 5.0
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365"))  # 0 — хранить всё
+
+FIELDS = ("ts", "session_id", "source", "event", "tables", "question", "rephrased", "sql",
+          "status", "rows", "duration_ms", "output_file")
+EXCEL_COLUMNS = {
+    "ts": "Время", "session_id": "Сессия", "source": "Источник", "event": "Событие",
+    "tables": "Таблицы", "question": "Вопрос", "rephrased": "Переформулировка", "sql": "SQL",
+    "status": "Статус", "rows": "Строк", "duration_ms": "Время ответа, мс", "output_file": "Файл",
+}
+
+_buffer = []
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_wakeup = threading.Event()
+_writer = None
+
+def _connect(path=None):
+    conn = sqlite3.connect(path or HISTORY_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS history ("
+        "id INTEGER PRIMARY KEY, ts TEXT, session_id TEXT, source TEXT, event TEXT, tables TEXT, "
+        "question TEXT, rephrased TEXT, sql TEXT, status TEXT, rows INTEGER, duration_ms REAL, output_file TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS history_ts ON history (ts)")
+    return conn
+
+def answer_status(answer):
+    """
+    Статус ответа для журнала: таблица — ok, текст с ошибкой SQL/LLM или отказом — error.
+    """
+    if isinstance(answer, pd.DataFrame):
+        return "ok"
+    text = str(answer)
+    return "error" if "Ошибка" in text or "Не удалось" in text or "Запрос отклонён" in text else "ok"
+
+def log_event(session_id, tables, question="", rephrased="", sql="", status="ok", rows=None,
+              duration_ms=None, output_file="", source="cli", event="question"):
+    """
+    Добавляет запись в журнал. На диск записи уходят пачками (см. flush).
+    """
+    if not isinstance(tables, str):
+        tables = ", ".join(tables)
+    record = (datetime.datetime.now().isoformat(timespec="milliseconds"), session_id, source, event, tables,
+              question, rephrased or "", sql or "", status, rows,
+              None if duration_ms is None else round(duration_ms, 3), output_file or "")
+    global _writer
+    with _lock:
+        _buffer.append(record)
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="history-writer", daemon=True)
+            _writer.start()
+        if len(_buffer) >= HISTORY_FLUSH_EVERY:
+            _wakeup.set()
+
+def _write_loop():
+    try:
+        compact(vacuum=False)
+    except sqlite3.Error as e:
+        print("Не удалось применить срок хранения истории:", e)
+    while True:
+        _wakeup.wait(HISTORY_FLUSH_SECONDS)
+        _wakeup.clear()
+        flush()
+
+def flush():
+    """
+    Пишет накопленные записи одной транзакцией. Буфер подменяется под блокировкой,
+    поэтому log_event не ждёт диска.
+    """
+    with _write_lock:
+        with _lock:
+            batch = _buffer[:]
+            _buffer.clear()
+        if not batch:
+            return
+        try:
+            conn = _connect()
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO history ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", batch
+                )
+            conn.close()
+        except sqlite3.Error as e:
+            print("Не удалось сохранить историю:", e)
+            with _lock:
+                _buffer[:0] = batch
+
+atexit.register(flush)
+
+def compact(retention_days=None, vacuum=True):
+    """
+    Удаляет записи старше retention_days дней (по умолчанию HISTORY_RETENTION_DAYS)
+    и освобождает место (VACUUM). Возвращает число удалённых записей.
+    """
+    days = HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+    flush()
+    conn = _connect()
+    deleted = 0
+    if days > 0:
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec="milliseconds")
+        with conn:
+            deleted = conn.execute("DELETE FROM history WHERE ts < ?", (cutoff,)).rowcount
+    if vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+    return deleted
+
+def load_history(days=None, session_id=None):
+    """
+    Журнал как DataFrame (по возрастанию времени), с фильтром по давности и сессии.
+    """
+    flush()
+    query = f"SELECT {', '.join(FIELDS)} FROM history WHERE 1 = 1"
+    params = []
+    if days:
+        query += " AND ts >= ?"
+        params.append((datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec="milliseconds"))
+    if session_id:
+        query += " AND session_id = ?"
+        params.append(session_id)
+    conn = _connect()
+    df = pd.read_sql_query(query + " ORDER BY id", conn, params=params)
+    conn.close()
+    return df
+
+def export_excel(path=HISTORY_FILE, days=None):
+    """
+    Excel-представление журнала: лист History со всеми записями и лист Usage со сводкой.
+    """
+    from core.pipeline import save_sheets_to_excel
+    df = load_history(days)
+    save_sheets_to_excel({"History": df.rename(columns=EXCEL_COLUMNS), "Usage": usage_stats(days)}, path)
+    print(f"История ({len(df)} записей) выгружена в {path}")
+    return len(df)
+
+def usage_stats(days=None):
+    """
+    Сводка по дням и источникам: вопросов, ошибок, выгрузок, среднее и p95 время ответа.
+    """
+    df = load_history(days)
+    if df.empty:
+        return pd.DataFrame(columns=["День", "Источник", "Вопросов", "Ошибок", "Выгрузок", "Среднее, мс", "p95, мс"])
+    df["day"] = df["ts"].str[:10]
+    questions = df[df["event"] == "question"]
+    grouped = questions.groupby(["day", "source"])
+    stats = pd.DataFrame({
+        "Вопросов": grouped.size(),
+        "Ошибок": grouped["status"].apply(lambda s: int((s != "ok").sum())),
+        "Среднее, мс": grouped["duration_ms"].mean().round(1),
+        "p95, мс": grouped["duration_ms"].quantile(0.95).round(1),
+    })
+    exports = df[df["output_file"] != ""].groupby(["day", "source"]).size()
+    stats["Выгрузок"] = exports.reindex(stats.index, fill_value=0)
+    stats = stats.reset_index().rename(columns={"day": "День", "source": "Источник"})
+    return stats[["День", "Источник", "Вопросов", "Ошибок", "Выгрузок", "Среднее, мс", "p95, мс"]]
+
+if __name__ == "__main__":
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        export_excel(sys.argv[2] if len(sys.argv) > 2 else HISTORY_FILE)
+    elif command == "stats":
+        print(usage_stats().to_string(index=False))
+    elif command == "compact":
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"Удалено записей: {compact(days)}")
+    else:
+        print("Использование: python -m utils.history [export [файл.xlsx]|stats|compact [дней]]")
@@ -1,24 +1,101 @@
-import pandas as pd
+import asyncio
 import datetime
 import threading
-
-HISTORY_FILE = "history.xlsx"
+import time
+import uuid
 
 message_history = []
 
 session_timeout = 1800  # 30 минут
-session_timer = None
+TIMER_TICK = 1.0  # секунды на слот колеса таймеров
+TIMER_SLOTS = 512
+
+class TimerWheel:
+    """
+    Хешированное колесо таймеров: ключ лежит в слоте своего срока, schedule/cancel — O(1),
+    продвижение проверяет только слоты прошедших тиков. Один драйвер на все сессии
+    вместо потока threading.Timer на каждое продление.
+    """
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self._lock = threading.Lock()
+        self._position = int(time.monotonic() / tick)
+
+    def schedule(self, key, delay):
+        deadline = time.monotonic() + delay
+        with self._lock:
+            self._remove(key)
+            self.deadlines[key] = deadline
+            self.slots[int(deadline / self.tick) % len(self.slots)].add(key)
+
+    def cancel(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        deadline = self.deadlines.pop(key, None)
+        if deadline is not None:
+            self.slots[int(deadline / self.tick) % len(self.slots)].discard(key)
+
+    def advance(self, now=None):
+        """
+        Ключи, срок которых истёк к моменту now; они удаляются из колеса.
+        """
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        with self._lock:
+            # За один проход достаточно обойти колесо целиком: дальние сроки остаются в слотах
+            for position in range(max(self._position, target - len(self.slots) + 1), target + 1):
+                slot = self.slots[position % len(self.slots)]
+                for key in [k for k in slot if self.deadlines[k] <= now]:
+                    slot.discard(key)
+                    del self.deadlines[key]
+                    expired.append(key)
+            self._position = target
+        return expired
+
+    def start_thread(self, callback):
+        """
+        Драйвер для синхронного кода: один фоновый поток на всё колесо.
+        """
+        def loop():
+            while True:
+                time.sleep(self.tick)
+                for key in self.advance():
+                    callback(key)
+        thread = threading.Thread(target=loop, name="session-timers", daemon=True)
+        thread.start()
+        return thread
+
+    async def run(self, callback):
+        """
+        Драйвер для asyncio: задача цикла событий, вызывающая callback(key) по истечении срока.
+        """
+        while True:
+            await asyncio.sleep(self.tick)
+            for key in self.advance():
+                callback(key)
+
+_wheel = None
+_wheel_lock = threading.Lock()
+
+def _cli_wheel():
+    global _wheel
+    with _wheel_lock:
+        if _wheel is None:
+            _wheel = TimerWheel()
+            _wheel.start_thread(lambda key: end_session())
+        return _wheel
 
 def reset_session_timer():
-    global session_timer, message_history
-    if session_timer:
-        session_timer.cancel()
-    session_timer = threading.Timer(session_timeout, end_session)
-    session_timer.start()
+    _cli_wheel().schedule("cli", session_timeout)
 
 def end_session():
-    global message_history
-    message_history = []
+    # Очистка на месте: модули, импортировавшие message_history, видят тот же список
+    message_history.clear()
     print("\nСессия завершена из-за бездействия.")
 
 def add_message(role, content):
@@ -26,16 +103,57 @@ def add_message(role, content):
     reset_session_timer()
 
 def clear_history():
-    global message_history
-    message_history = []
-
-def save_history(history):
-    try:
-        if history:
-            last = pd.DataFrame([history[-1]])
-            last.to_excel(HISTORY_FILE, index=False)
-            print("История операции сохранена в", HISTORY_FILE)
-        else:
-            print("Нет записей для сохранения истории.")
-    except Exception as e:
-        print("Не удалось сохранить историю:", e)
+    message_history.clear()
+
+class Session:
+    """
+    Состояние одного пользователя сервиса: своя история сообщений, выбранные таблицы,
+    последний результат (для выгрузки) и блокировка, упорядочивающая его вопросы.
+    cancel прерывает выполняемый SQL при удалении сессии.
+    """
+    def __init__(self, tables=None):
+        self.id = uuid.uuid4().hex
+        self.tables = list(tables or [])
+        self.history = []
+        self.last_result = None
+        self.created = datetime.datetime.now()
+        self.last_seen = self.created
+        self.lock = asyncio.Lock()
+        self.cancel = threading.Event()
+
+    def add_message(self, role, content):
+        self.history.append({'role': role, 'content': content})
+
+class SessionStore:
+    """
+    Сессии сервиса по id; истечение по бездействию — через общее колесо таймеров.
+    """
+    def __init__(self, timeout=session_timeout, wheel=None):
+        self.timeout = timeout
+        self.wheel = wheel or TimerWheel()
+        self.sessions = {}
+
+    def create(self, tables=None):
+        session = Session(tables)
+        self.sessions[session.id] = session
+        self.wheel.schedule(session.id, self.timeout)
+        return session
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_seen = datetime.datetime.now()
+            self.wheel.schedule(session_id, self.timeout)
+        return session
+
+    def drop(self, session_id):
+        self.wheel.cancel(session_id)
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.cancel.set()
+        return session is not None
+
+    def expire(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.cancel.set()
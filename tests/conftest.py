@@ -0,0 +1,6 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+# core.config требует ключ при импорте; в тестах запросов к API нет
+os.environ.setdefault("MISTRAL_API_KEY", "test")
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from agents.sql_agent import execute_sql_and_return_result
+from core.catalog import table_versions
+from core.database import connect, write_to_sql
+from core.engine import HotTablePool
+
+
+def _import(db_path, rows):
+    conn = connect(db_path)
+    write_to_sql(conn, pd.DataFrame({"g": [i % 3 for i in range(rows)], "x": range(rows)}), "t",
+                 override_existing=True)
+    conn.close()
+
+
+def test_query_through_hot_pool(tmp_path):
+    db_path = str(tmp_path / "main.db")
+    _import(db_path, 100)
+    pool = HotTablePool(db_path, ["t"], size=2, check_interval=3600)
+    try:
+        with pool.connection() as conn:
+            result = execute_sql_and_return_result(conn, "SELECT g, COUNT(*) AS n FROM t GROUP BY g ORDER BY g")
+            assert isinstance(result, pd.DataFrame), result
+            assert result["n"].tolist() == [34, 33, 33]
+            assert conn.execute("SELECT COUNT(*) FROM main.sqlite_master WHERE name = 't'").fetchone()[0] == 1
+            version = table_versions(conn, ["t"])["t"]
+        assert pool.loaded == {"t": version}
+
+        # Переимпорт: пока копия в памяти не перезагружена, версия в каталоге соединения — её
+        _import(db_path, 10)
+        with pool.connection() as conn:
+            assert table_versions(conn, ["t"])["t"] == version
+            assert execute_sql_and_return_result(conn, "SELECT COUNT(*) AS n FROM t")["n"][0] == 100
+        assert pool.refresh(force=True) == ["t"]
+        with pool.connection() as conn:
+            assert table_versions(conn, ["t"])["t"] > version
+            assert execute_sql_and_return_result(conn, "SELECT COUNT(*) AS n FROM t")["n"][0] == 10
+    finally:
+        pool.close()
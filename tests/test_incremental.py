@@ -0,0 +1,49 @@
+import pandas as pd
+
+from core.catalog import table_versions
+from core.database import connect, import_csv_incremental, write_incremental, write_to_sql
+
+
+def _rows(conn, table):
+    return conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+
+
+def test_keyed_delta(tmp_path):
+    conn = connect(str(tmp_path / "main.db"))
+    try:
+        write_to_sql(conn, pd.DataFrame({"id": [1, 2, 3], "v": ["a", "b", "c"]}), "t", override_existing=True)
+        counts = write_incremental(conn, pd.DataFrame({"id": [1, 2, 4], "v": ["a", "B", "d"]}), "t", key="id")
+        assert counts == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+        assert _rows(conn, "t") == [(1, "a"), (2, "B"), (4, "d")]
+    finally:
+        conn.close()
+
+
+def test_hashed_delta(tmp_path):
+    conn = connect(str(tmp_path / "main.db"))
+    try:
+        write_to_sql(conn, pd.DataFrame({"g": [1, 1, 2], "v": ["a", "b", "c"]}), "t", override_existing=True)
+        counts = write_incremental(conn, pd.DataFrame({"g": [1, 2, 2], "v": ["a", "c", "d"]}), "t")
+        assert counts["inserted"] == 1 and counts["deleted"] == 1
+        assert _rows(conn, "t") == [(1, "a"), (2, "c"), (2, "d")]
+    finally:
+        conn.close()
+
+
+def test_empty_delta_keeps_table(tmp_path):
+    conn = connect(str(tmp_path / "main.db"))
+    try:
+        write_to_sql(conn, pd.DataFrame({"id": [1, 2], "v": ["a", "b"]}), "t", override_existing=True)
+        version = table_versions(conn, ["t"])["t"]
+        csv = tmp_path / "t.csv"
+        csv.write_text("id,v\n")
+        # Незавершённая транзакция вызывающего кода не мешает импорту
+        conn.execute("INSERT INTO t VALUES (3, 'c')")
+        assert conn.in_transaction
+
+        assert import_csv_incremental(conn, str(csv), "t", key="id")["deleted"] == 0
+        assert write_incremental(conn, pd.DataFrame({"id": [], "v": []}), "t")["deleted"] == 0
+        assert _rows(conn, "t") == [(1, "a"), (2, "b"), (3, "c")]
+        assert table_versions(conn, ["t"])["t"] == version
+    finally:
+        conn.close()
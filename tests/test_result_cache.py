@@ -0,0 +1,37 @@
+import pandas as pd
+
+from agents.sql_agent import execute_sql_and_return_result
+from core.catalog import referenced_tables
+from core.database import connect, write_to_sql
+from core.result_cache import make_key
+
+
+def _import(conn, table, values):
+    write_to_sql(conn, pd.DataFrame({"x": values}), table, override_existing=True)
+
+
+def test_comma_join_invalidated_on_reimport(tmp_path):
+    conn = connect(str(tmp_path / "main.db"))
+    try:
+        _import(conn, "a", [1, 2, 3])
+        _import(conn, "b", [1, 2])
+        sql = "SELECT COUNT(*) AS n FROM a, b WHERE a.x = b.x"
+        assert referenced_tables(conn, sql) == ["a", "b"]
+        assert execute_sql_and_return_result(conn, sql)["n"][0] == 2
+
+        # Переимпорт второй таблицы из перечисления через запятую сбрасывает кэш
+        _import(conn, "b", [1, 2, 3])
+        assert execute_sql_and_return_result(conn, sql)["n"][0] == 3
+    finally:
+        conn.close()
+
+
+def test_unresolved_source_not_cached(tmp_path):
+    conn = connect(str(tmp_path / "main.db"))
+    try:
+        _import(conn, "a", [1, 2, 3])
+        assert make_key(conn, "SELECT * FROM a") is not None
+        assert make_key(conn, "SELECT * FROM a, missing") is None
+        assert make_key(conn, "WITH c AS (SELECT x FROM a) SELECT * FROM c") is None
+    finally:
+        conn.close()